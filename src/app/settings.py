@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import copy
 import os
 from datetime import timedelta
 from pathlib import Path
@@ -20,12 +21,32 @@ import environ  # type: ignore
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = environ.Env(
+    ACTIVITY_TRACKING_BATCH_SIZE=(int, 500), # Number of buffered last seen times that triggers a write
+    ACTIVITY_TRACKING_ENABLED=(bool, True), # Whether to record when users were last seen
+    ACTIVITY_TRACKING_FLUSH_INTERVAL=(int, 10), # Seconds between two writes of the buffered last seen times
+    ACTIVITY_TRACKING_INTERVAL=(int, 300), # Min seconds between two recorded last seen times of a user
+    ACTIVITY_TRACKING_MAX_SIZE=(int, 10000), # Max number of recently seen users remembered per worker
     ALLOWED_HOSTS=(list[str], []), # Allowed hosts for the Django app
     ALLOWED_ORIGINS=(list[str], []), # Allowed origins for CORS
+    AUTH_COOKIE_CIPHER=(str, "aesgcm"), # Cipher of compact credentials cookies: aesgcm, chacha20 or fernet
+    AUTH_COOKIE_COMPRESS=(bool, True), # Whether to compress compact credentials cookies
+    AUTH_COOKIE_FORMAT=(str, "compact"), # Format of the credentials cookie: compact or json
+    AUTH_COOKIE_RENEW_WINDOW=(int, 600), # Seconds before the credentials cookie expires when it is set again
+    CACHE_URL=(str, "locmemcache://"), # Django cache backend URL
+    DB_CONN_HEALTH_CHECKS=(bool, False), # Check that persistent connections are alive before reusing them
+    DB_CONN_MAX_AGE=(int, 0), # Seconds a database connection is kept open (0 closes it after each request)
     DB_HOST=(str, None), # Database host
     DB_NAME=(str, None), # Database name
     DB_PASSWORD=(str, None), # Database password
+    DB_POOL=(bool, False), # Use a psycopg connection pool per worker process (ignores DB_CONN_MAX_AGE)
+    DB_POOL_MAX_IDLE=(float, 600), # Seconds an idle pooled connection is kept open
+    DB_POOL_MAX_LIFETIME=(float, 3600), # Seconds after which a pooled connection is replaced
+    DB_POOL_MAX_SIZE=(int, 10), # Max connections in the pool
+    DB_POOL_MIN_SIZE=(int, 2), # Connections kept open in the pool
+    DB_POOL_TIMEOUT=(float, 10), # Max seconds to wait for a connection from the pool
     DB_PORT=(int, None), # Database port
+    DB_REPLICA_HOST=(str, None), # Host of the read replica (no replica if empty)
+    DB_REPLICA_PORT=(int, None), # Port of the read replica (defaults to DB_PORT)
     DB_USER=(str, None), # Database user
     DEBUG=(bool, False), # Debug mode for Django
     DJANGO_SECRET_KEY=(
@@ -33,12 +54,51 @@ env = environ.Env(
         "django-insecure-trkc%c14mv8b%95!spl5n&sg51f7wsyvasx%7ddl$07-f-iynh",
     ), # Secret key for Django
     ENCRYPTION_KEY=(str, None), # Key used for encrypting sensitive data
+    ENCRYPTION_KEYS=(list[str], []), # Keys used for encrypting sensitive data, newest first (overrides ENCRYPTION_KEY, used for key rotation)
     FRONT_END_URL=(str, None), # Frontend URL for the application
+    LOG_ASYNC=(bool, True), # Whether to write the logs from a background thread instead of the request's thread
+    LOG_DEBUG_SAMPLE_RATE=(float, 0.1), # Fraction of requests whose debug logs are kept
+    LOG_FORMAT=(str, "json"), # Format of the logs: "json" (one object per line) or "text"
+    LOG_LEVEL=(str, "INFO"), # Min level of the logs
+    METRICS_ENABLED=(bool, False), # Whether to collect Prometheus metrics and expose them
+    METRICS_PATH=(str, "metrics"), # Path of the Prometheus metrics endpoint
     MOCK_AUTH=(bool, False), # Allow mock authentication (used only during testing)
+    OKTA_AUDIENCE=(str, "api://default"), # Expected audience of the access tokens (JWT verification mode)
     OKTA_CLIENT_ID=(str, None), # Okta client ID
     OKTA_CLIENT_SECRET=(str, None), # Okta client secret
     OKTA_DOMAIN=(str, None), # Okta domain
+    OKTA_HTTP_BACKOFF_FACTOR=(float, 0.2), # Backoff factor between retries of calls to Okta
+    OKTA_HTTP_CONNECT_TIMEOUT=(float, 3.05), # Seconds to wait for a connection to Okta
+    OKTA_HTTP_MAX_RETRIES=(int, 2), # Max retries of a failed call to Okta
+    OKTA_HTTP_MAX_RETRY_AFTER=(float, 2), # Max seconds to wait before a retry asked with a Retry-After header
+    OKTA_HTTP_POOL_SIZE=(int, 10), # Max keep-alive connections to Okta per worker process
+    OKTA_HTTP_READ_TIMEOUT=(float, 10), # Seconds to wait for Okta to respond
+    OKTA_ISSUER=(str, None), # Expected issuer of the access tokens (JWT verification mode, defaults to OKTA_DOMAIN)
+    OKTA_JWKS_REFRESH_INTERVAL=(int, 60), # Min seconds between two refreshes of the JWKS on unknown key IDs
+    OKTA_JWKS_URL=(str, None), # URL of the JWKS used to verify access tokens (defaults to OKTA_DOMAIN/keys)
+    OKTA_JWT_EMAIL_CLAIM=(str, "email"), # Claim of the access token containing the email (JWT verification mode)
+    OKTA_JWT_LEEWAY=(int, 30), # Seconds of clock skew tolerated when checking the expiration of access tokens
     OKTA_LOGIN_REDIRECT=(str, None), # Okta login redirect URL
+    OKTA_REFRESH_AHEAD_WINDOW=(int, 0), # Seconds before expiry when access tokens are refreshed in the background (0 disables it)
+    OKTA_REFRESH_CACHE_ALIAS=(str, "default"), # Django cache holding the cross-worker refresh locks
+    OKTA_REFRESH_LOCK_TIMEOUT=(int, 10), # Max seconds to wait for a concurrent refresh of the same token
+    OKTA_REFRESH_RESULT_TTL=(int, 30), # Seconds the result of a refresh is reused by requests with the old refresh token
+    OKTA_REFRESH_SHARED_LOCK=(bool, False), # Coalesce refreshes across workers through the Django cache
+    OKTA_REFRESH_TOKEN_ROTATION=(bool, True), # Whether Okta rotates refresh tokens (disables background refreshes)
+    OKTA_REFRESH_WORKERS=(int, 2), # Threads per worker process running background refreshes
+    OKTA_TOKEN_CACHE_ALIAS=(str, "default"), # Django cache used when the token cache backend is "django"
+    OKTA_TOKEN_CACHE_BACKEND=(str, "local"), # Where verified tokens are cached: "local", "django" or "none"
+    OKTA_TOKEN_CACHE_MAX_SIZE=(int, 10000), # Max number of tokens in the local token cache
+    OKTA_TOKEN_CACHE_TTL=(int, 300), # Max seconds a verified token is cached (never beyond its expiry)
+    OKTA_VERIFICATION_MODE=(str, "userinfo"), # How access tokens are verified: "userinfo" (calling Okta) or "jwt" (locally)
+    REQUEST_TIMING_ENABLED=(bool, True), # Whether to time the stages of each request and log them
+    REQUEST_TIMING_HEADER=(bool, False), # Whether to send the timings of each request in a Server-Timing header
+    REQUEST_TIMING_LOG_THRESHOLD=(float, 0), # Min seconds a request must take to log its timings
+    USER_CACHE_ALIAS=(str, "default"), # Django cache used by the "django" and "tiered" user cache backends
+    USER_CACHE_BACKEND=(str, "local"), # Where users are cached: "local", "django", "tiered" (local in front of django) or "none"
+    USER_CACHE_LOCAL_TTL=(int, 30), # Max seconds a user stays in the local tier of the "tiered" user cache
+    USER_CACHE_MAX_SIZE=(int, 10000), # Max number of users in the local user cache
+    USER_CACHE_TTL=(int, 60), # Seconds a user is cached
     USE_HTTPS=(bool, True), # Whether to run the application using HTTPS (affects secure cookies)
 )
 
@@ -51,6 +111,9 @@ environ.Env.read_env(os.path.join(BASE_DIR, ".env"))
 SECRET_KEY = env.str("DJANGO_SECRET_KEY")
 DEBUG = env.bool("DEBUG")
 ENCRYPTION_KEY = env.str("ENCRYPTION_KEY")
+ENCRYPTION_KEYS: list[str] = env.list("ENCRYPTION_KEYS") or [
+    key for key in [ENCRYPTION_KEY] if key
+]
 
 ALLOWED_HOSTS: list[str] = env.list("ALLOWED_HOSTS")
 CORS_ALLOWED_ORIGINS: list[str] = env.list("ALLOWED_ORIGINS")
@@ -72,8 +135,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "core.auth.CustomAuthMiddleware",
+    # The request ID goes first, so the logs of all the middlewares carry it
+    "core.log.RequestContextMiddleware",
+    # Timing goes next, so the time spent in the other middlewares counts
+    "core.timing.TimingMiddleware",
+    "core.metrics.MetricsMiddleware",
+    # CORS goes next, so preflights are answered before authenticating
     "corsheaders.middleware.CorsMiddleware",
+    "core.auth.CustomAuthMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -114,9 +183,72 @@ DATABASES = {
         "USER": env.str("DB_USER"),
         "PASSWORD": env.str("DB_PASSWORD"),
         "PORT": env.int("DB_PORT"),
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE"),
+        "CONN_HEALTH_CHECKS": env.bool("DB_CONN_HEALTH_CHECKS"),
+        "OPTIONS": {},
+    }
+}
+
+# Connection pool (requires psycopg 3)
+# https://docs.djangoproject.com/en/5.1/ref/databases/#connection-pool
+if env.bool("DB_POOL"):
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": env.int("DB_POOL_MIN_SIZE"),
+        "max_size": env.int("DB_POOL_MAX_SIZE"),
+        "timeout": env.float("DB_POOL_TIMEOUT"),
+        "max_idle": env.float("DB_POOL_MAX_IDLE"),
+        "max_lifetime": env.float("DB_POOL_MAX_LIFETIME"),
     }
+    # Connections are kept open by the pool, which Django doesn't allow
+    # together with persistent connections
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+# Optional read replica. Reads of the core models go to the replica, unless
+# the request already wrote to the primary (see core.routers)
+if env.str("DB_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **copy.deepcopy(DATABASES["default"]),
+        "HOST": env.str("DB_REPLICA_HOST"),
+        "PORT": env.int("DB_REPLICA_PORT") or env.int("DB_PORT"),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    "default": env.cache("CACHE_URL"),
+}
+
+ACTIVITY_TRACKING = {
+    "BATCH_SIZE": env.int("ACTIVITY_TRACKING_BATCH_SIZE"),
+    "ENABLED": env.bool("ACTIVITY_TRACKING_ENABLED"),
+    "FLUSH_INTERVAL": env.int("ACTIVITY_TRACKING_FLUSH_INTERVAL"),
+    "INTERVAL": env.int("ACTIVITY_TRACKING_INTERVAL"),
+    "MAX_SIZE": env.int("ACTIVITY_TRACKING_MAX_SIZE"),
+}
+
+METRICS = {
+    "ENABLED": env.bool("METRICS_ENABLED"),
+    "PATH": env.str("METRICS_PATH"),
 }
 
+REQUEST_TIMING = {
+    "ENABLED": env.bool("REQUEST_TIMING_ENABLED"),
+    "HEADER": env.bool("REQUEST_TIMING_HEADER"),
+    "LOG_THRESHOLD": env.float("REQUEST_TIMING_LOG_THRESHOLD"),
+}
+
+USER_CACHE = {
+    "BACKEND": env.str("USER_CACHE_BACKEND"),
+    "CACHE_ALIAS": env.str("USER_CACHE_ALIAS"),
+    "LOCAL_TTL": env.int("USER_CACHE_LOCAL_TTL"),
+    "MAX_SIZE": env.int("USER_CACHE_MAX_SIZE"),
+    "TTL": env.int("USER_CACHE_TTL"),
+}
 
 
 # Internationalization
@@ -149,7 +281,42 @@ OKTA = {
     "DOMAIN": env.str("OKTA_DOMAIN"),
     "CLIENT_ID": env.str("OKTA_CLIENT_ID"),
     "CLIENT_SECRET": env.str("OKTA_CLIENT_SECRET"),
-    "LOGIN_REDIRECT": env.str("OKTA_LOGIN_REDIRECT")
+    "LOGIN_REDIRECT": env.str("OKTA_LOGIN_REDIRECT"),
+    "REFRESH": {
+        "AHEAD_WINDOW": env.int("OKTA_REFRESH_AHEAD_WINDOW"),
+        "CACHE_ALIAS": env.str("OKTA_REFRESH_CACHE_ALIAS"),
+        "LOCK_TIMEOUT": env.int("OKTA_REFRESH_LOCK_TIMEOUT"),
+        "MAX_SIZE": env.int("OKTA_TOKEN_CACHE_MAX_SIZE"),
+        "RESULT_TTL": env.int("OKTA_REFRESH_RESULT_TTL"),
+        "ROTATION": env.bool("OKTA_REFRESH_TOKEN_ROTATION"),
+        "SHARED": env.bool("OKTA_REFRESH_SHARED_LOCK"),
+        "WORKERS": env.int("OKTA_REFRESH_WORKERS"),
+    },
+    "TOKEN_CACHE": {
+        "BACKEND": env.str("OKTA_TOKEN_CACHE_BACKEND"),
+        "CACHE_ALIAS": env.str("OKTA_TOKEN_CACHE_ALIAS"),
+        "MAX_SIZE": env.int("OKTA_TOKEN_CACHE_MAX_SIZE"),
+        "TTL": env.int("OKTA_TOKEN_CACHE_TTL"),
+    },
+    "HTTP": {
+        "BACKOFF_FACTOR": env.float("OKTA_HTTP_BACKOFF_FACTOR"),
+        "CONNECT_TIMEOUT": env.float("OKTA_HTTP_CONNECT_TIMEOUT"),
+        "MAX_RETRIES": env.int("OKTA_HTTP_MAX_RETRIES"),
+        "MAX_RETRY_AFTER": env.float("OKTA_HTTP_MAX_RETRY_AFTER"),
+        "POOL_SIZE": env.int("OKTA_HTTP_POOL_SIZE"),
+        "READ_TIMEOUT": env.float("OKTA_HTTP_READ_TIMEOUT"),
+    },
+    "VERIFICATION_MODE": env.str("OKTA_VERIFICATION_MODE"),
+    "JWT": {
+        "AUDIENCE": env.str("OKTA_AUDIENCE"),
+        "EMAIL_CLAIM": env.str("OKTA_JWT_EMAIL_CLAIM"),
+        "ISSUER": env.str("OKTA_ISSUER") or env.str("OKTA_DOMAIN"),
+        "JWKS_REFRESH_INTERVAL": env.int("OKTA_JWKS_REFRESH_INTERVAL"),
+        "JWKS_URL": (
+            env.str("OKTA_JWKS_URL") or f"{env.str('OKTA_DOMAIN')}/keys"
+        ),
+        "LEEWAY": env.int("OKTA_JWT_LEEWAY"),
+    },
 }
 MOCK_AUTH = env.bool("MOCK_AUTH")
 
@@ -163,21 +330,63 @@ AUTH_COOKIE_CONFIG = {
     "HTTP_ONLY": True,
     "PATH": "/",
     "SAMESITE": "Lax",
-    "LIFETIME": timedelta(hours=1)
+    "LIFETIME": timedelta(hours=1),
+    "RENEW_WINDOW": timedelta(seconds=env.int("AUTH_COOKIE_RENEW_WINDOW")),
+    "FORMAT": env.str("AUTH_COOKIE_FORMAT"),
+    "COMPRESS": env.bool("AUTH_COOKIE_COMPRESS"),
+    "CIPHER": env.str("AUTH_COOKIE_CIPHER"),
 }
 
 # Logging config
 
+LOGGING_CONFIG = "core.log.configure_logging"
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {
+            '()': 'core.log.RequestContextFilter',
+        },
+        'debug_sampling': {
+            '()': 'core.log.SamplingFilter',
+            'rate': env.float("LOG_DEBUG_SAMPLE_RATE"),
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'core.log.JsonFormatter',
+        },
+        'text': {
+            'format': (
+                '%(asctime)s %(levelname)s %(name)s '
+                '[%(request_id)s] %(message)s'
+            ),
+        },
+    },
     'handlers': {
         'console': {
+            # With LOG_ASYNC, the records are formatted in the request's
+            # thread and written by the stream handler from a background
+            # thread, started by core.log.configure_logging
+            **(
+                {
+                    'class': 'logging.handlers.QueueHandler',
+                    'handlers': ['stream'],
+                    'respect_handler_level': True,
+                }
+                if env.bool("LOG_ASYNC")
+                else {'class': 'logging.StreamHandler'}
+            ),
+            'filters': ['request_context', 'debug_sampling'],
+            'formatter': env.str("LOG_FORMAT"),
+        },
+        'stream': {
             'class': 'logging.StreamHandler',
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': env.str("LOG_LEVEL"),
     },
 }
@@ -15,10 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import URLPattern, URLResolver, path, include
 
-urlpatterns = [
+from core.metrics import metrics_view
+
+urlpatterns: list[URLPattern | URLResolver] = [
     path("admin/", admin.site.urls),
     path("users/", include("user.urls"))
 ]
+
+if settings.METRICS["ENABLED"]:
+    urlpatterns.append(
+        path(settings.METRICS["PATH"], metrics_view, name="metrics")
+        )
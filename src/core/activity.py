@@ -0,0 +1,153 @@
+"""
+Tracking of when users were last seen.
+
+Writing the timestamp on every request would turn each read into a write
+on the primary database. Instead, each user is marked as seen at most once
+per interval, the timestamps are buffered in memory and a background
+thread writes them all with a single UPDATE.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Optional
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from core.cache import LocalCache
+from core.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """
+    Buffers the last time each user was seen and writes the buffer to the
+    database periodically
+    """
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        """
+        :param config: The activity tracking configuration from the settings
+        """
+        self.config = config
+        # Users seen within the interval, which are not marked again
+        self.recently_seen = LocalCache(config["MAX_SIZE"])
+        self.pending: dict[int, datetime] = {}
+        self.lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def touch(self, user_id: int) -> bool:
+        """
+        Mark a user as seen now. It never touches the database: the
+        timestamp is written by the next flush.
+
+        :param user_id: The ID of the user
+
+        :return: Whether the user was marked (False if it was already marked
+        within the interval)
+        """
+        key = str(user_id)
+        with self.lock:
+            if self.recently_seen.get(key) is not None:
+                return False
+            self.recently_seen.set(key, True, self.config["INTERVAL"])
+            self.pending[user_id] = timezone.now()
+            batch_is_full = len(self.pending) >= self.config["BATCH_SIZE"]
+        self.start()
+        if batch_is_full:
+            self.flush_requested.set()
+        return True
+
+    def start(self) -> None:
+        """
+        Start the thread flushing the buffer, if it's not running yet
+        """
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name="activity-tracker", daemon=True
+                )
+            self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self) -> None:
+        while True:
+            self.flush_requested.wait(self.config["FLUSH_INTERVAL"])
+            self.flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Failed to write the last seen times: %s", e)
+            finally:
+                # The thread is long-lived, so its connection is not kept
+                # open between flushes
+                connections.close_all()
+
+    def flush(self) -> int:
+        """
+        Write the buffered timestamps to the database
+
+        :return: The number of users written
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        db = router.db_for_write(User)
+        connection = connections[db]
+        if connection.vendor != "postgresql":
+            users = User.objects.using(db).filter(pk__in=pending.keys())
+            for user in users:
+                user.last_seen = pending[user.pk]
+            User.objects.using(db).bulk_update(users, ["last_seen"])
+            return len(pending)
+
+        meta = User._meta
+        table = connection.ops.quote_name(meta.db_table)
+        pk_column = connection.ops.quote_name(meta.pk.column)
+        last_seen_column = connection.ops.quote_name(
+            meta.get_field("last_seen").column
+            )
+        values = ", ".join(["(%s::bigint, %s::timestamptz)"] * len(pending))
+        params: list[Any] = []
+        for user_id, seen_at in pending.items():
+            params += [user_id, seen_at]
+        # Another worker may have written a more recent time, which is kept
+        query = f"""
+            UPDATE {table} AS u
+            SET {last_seen_column} = v.last_seen
+            FROM (VALUES {values}) AS v(id, last_seen)
+            WHERE u.{pk_column} = v.id
+            AND (
+                u.{last_seen_column} IS NULL
+                OR u.{last_seen_column} < v.last_seen
+            )
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+        return len(pending)
+
+
+_tracker: Optional[ActivityTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_activity_tracker() -> ActivityTracker:
+    """
+    Get the per-process activity tracker
+
+    :return: The activity tracker
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = ActivityTracker(settings.ACTIVITY_TRACKING)
+    return _tracker
@@ -1,17 +1,45 @@
 import json
-from typing import Optional, Tuple
+import logging
+import time
+from functools import partial
+from typing import Any, Awaitable, Optional, Tuple, cast
 
+import httpx
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.contrib.auth.middleware import AuthenticationMiddleware
 from django.contrib.auth.models import AnonymousUser
 from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.functional import SimpleLazyObject
 
+from core import cookie
+from core.activity import get_activity_tracker
+from core.cache import digest, get_token_cache
 from core.crypto import Crypto
+from core.http import arequest, get_session, get_timeout
+from core.jwt import (
+    InvalidTokenError,
+    get_expiration,
+    get_jwks_client,
+    verify,
+)
+from core.log import set_user_id
+from core.metrics import (
+    record_auth_failure,
+    record_cache_lookup,
+    record_token_refresh,
+)
+from core.models import User
+from core.refresh import get_background_refresher, get_refresh_coalescer
+from core.timing import span
 from user.serializers import UserSerializer
 
-User = get_user_model()
+logger = logging.getLogger(__name__)
+
+"""Refresh token used for requests authenticated with a bearer token"""
+PLACEHOLDER_REFRESH_TOKEN = "placeholder_refresh_token"
 
 
 class TokenManager:
@@ -33,56 +61,203 @@ class TokenManager:
         :return: The email address from the token, the access token, and the
         refresh token
         """
-        # In testing environments we don't use real Okta, so the token is
-        # just a JSON string containing the claims
-        if settings.MOCK_AUTH:
-            # Decode the token as a JSON string
-            decoded_token = json.loads(access_token)
+        mock_claims = self.get_mock_claims(access_token)
+        if mock_claims is not None:
             # Get the email from the decoded token
-            mock_email: str = decoded_token.get('sub')
+            mock_email: str = mock_claims.get("sub", "")
             return mock_email, access_token, refresh_token
 
-        url = f"{settings.OKTA['DOMAIN']}/userinfo"
-        headers = {
+        cache = get_token_cache()
+        with span("token_cache"):
+            cached_email: Optional[str] = cache.get(digest(access_token))
+        record_cache_lookup("token", bool(cached_email))
+        if cached_email:
+            return cached_email, access_token, refresh_token
+
+        if settings.OKTA["VERIFICATION_MODE"] == "jwt":
+            with span("jwt_verify"):
+                local_email = self.verify_locally(access_token)
+            if local_email:
+                with span("token_cache"):
+                    cache.set(
+                        digest(access_token),
+                        local_email,
+                        self.get_cache_ttl(access_token),
+                        )
+                return local_email, access_token, refresh_token
+
+        url = self.get_userinfo_url()
+        session = get_session()
+        with span("okta_userinfo"):
+            response = session.get(
+                url,
+                headers=self.get_userinfo_headers(access_token),
+                timeout=get_timeout(),
+                )
+        if response.status_code == 401:
+            access_token, refresh_token = self.refresh(refresh_token)
+            with span("okta_userinfo"):
+                response = session.get(
+                    url,
+                    headers=self.get_userinfo_headers(access_token),
+                    timeout=get_timeout(),
+                    )
+        response.raise_for_status()
+        email = self.get_email_from_userinfo(response.json())
+        with span("token_cache"):
+            cache.set(
+                digest(access_token), email, self.get_cache_ttl(access_token)
+                )
+        return email, access_token, refresh_token
+
+    def get_mock_claims(self, access_token: str) -> Optional[dict[str, Any]]:
+        """
+        In testing environments we don't use real Okta, so the token is
+        just a JSON string containing the claims. Tokens that are not JSON
+        go through the regular flow, so that it can be tested against a
+        mocked Okta
+
+        :param access_token: The access token
+
+        :return: The claims of a mock token, or None if mock authentication
+        is disabled or the token is not a mock token
+        """
+        if not settings.MOCK_AUTH:
+            return None
+        try:
+            decoded_token = json.loads(access_token)
+        except ValueError:
+            return None
+        if not isinstance(decoded_token, dict):
+            return None
+        return decoded_token
+
+    def get_userinfo_url(self) -> str:
+        """
+        :return: The URL of Okta's userinfo endpoint
+        """
+        return f"{settings.OKTA['DOMAIN']}/userinfo"
+
+    def get_userinfo_headers(self, access_token: str) -> dict[str, str]:
+        """
+        :param access_token: The access token to verify
+
+        :return: The headers of a request to Okta's userinfo endpoint
+        """
+        return {
             "Accept": "application/json",
             "Authorization": f"Bearer {access_token}"
         }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 401:
-            access_token = self.get_access_token_from_refresh_token(
-                refresh_token
-                )
-            headers["Authorization"] = f"Bearer {access_token}"
-            response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        userinfo = response.json()
-        email: str = userinfo.get("email")
+
+    def get_email_from_userinfo(self, userinfo: dict[str, Any]) -> str:
+        """
+        :param userinfo: The response of Okta's userinfo endpoint
+
+        :return: The email of the user
+        """
+        email: Optional[str] = userinfo.get("email")
         if not email:
             raise ValueError("Email not found in the token")
-        return email, access_token, refresh_token
+        return email
 
-    def get_tokens_from_provider(self, code: str) -> Tuple[str, str]:
+    def get_token_url(self) -> str:
         """
-        Make a request to Okta to retrieve the access token based on the
-        code
-
-        :param code: The authorization code received from Okta
+        :return: The URL of Okta's token endpoint
+        """
+        return f"{settings.OKTA['DOMAIN']}/oauth/token"
 
-        :return: The access token and refresh token
+    def get_token_headers(self) -> dict[str, str]:
         """
-        url = f"{settings.OKTA['DOMAIN']}/oauth/token"
-        headers = {
+        :return: The headers of a request to Okta's token endpoint
+        """
+        return {
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "application/json",
         }
-        payload = {
+
+    def get_authorization_code_payload(self, code: str) -> dict[str, str]:
+        """
+        :param code: The authorization code received from Okta
+
+        :return: The payload to exchange the code for tokens
+        """
+        return {
             "grant_type": "authorization_code",
             "code": code,
             "redirect_uri": settings.OKTA["LOGIN_REDIRECT"],
             "client_id": settings.OKTA["CLIENT_ID"],
             "client_secret": settings.OKTA["CLIENT_SECRET"]
         }
-        response = requests.post(url, headers=headers, data=payload)
+
+    def get_refresh_token_payload(self, refresh_token: str) -> dict[str, str]:
+        """
+        :param refresh_token: The refresh token
+
+        :return: The payload to get a new access token
+        """
+        return {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": settings.OKTA["CLIENT_ID"],
+            "client_secret": settings.OKTA["CLIENT_SECRET"]
+        }
+
+    def verify_locally(self, access_token: str) -> Optional[str]:
+        """
+        Verify the access token as a JWT signed by Okta, without calling Okta
+
+        :param access_token: The access token
+
+        :return: The email from the token, or None if the token can't be
+        verified locally or doesn't contain the email
+        """
+        config = settings.OKTA["JWT"]
+        try:
+            claims = verify(
+                access_token,
+                get_jwks_client(),
+                issuer=config["ISSUER"],
+                audience=config["AUDIENCE"],
+                leeway=config["LEEWAY"],
+            )
+        except InvalidTokenError:
+            return None
+        email = claims.get(config["EMAIL_CLAIM"])
+        if not isinstance(email, str):
+            return None
+        return email
+
+    def get_cache_ttl(self, access_token: str) -> float:
+        """
+        Get for how long the result of verifying an access token can be
+        cached. It is never longer than the lifetime left for the token.
+
+        :param access_token: The access token
+
+        :return: The number of seconds the verification can be cached for
+        """
+        ttl: float = settings.OKTA["TOKEN_CACHE"]["TTL"]
+        expiration = get_expiration(access_token)
+        if expiration is not None:
+            ttl = min(ttl, expiration - time.time())
+        return ttl
+
+    def get_tokens_from_provider(self, code: str) -> Tuple[str, str]:
+        """
+        Make a request to Okta to retrieve the access token based on the
+        code
+
+        :param code: The authorization code received from Okta
+
+        :return: The access token and refresh token
+        """
+        with span("okta_token"):
+            response = get_session().post(
+                self.get_token_url(),
+                headers=self.get_token_headers(),
+                data=self.get_authorization_code_payload(code),
+                timeout=get_timeout(),
+                )
         response.raise_for_status()
         access_token: str = response.json().get("access_token")
         refresh_token: str = response.json().get("refresh_token")
@@ -99,6 +274,8 @@ class TokenManager:
 
         :return: A tuple containing the access token and refresh token, or None
         """
+        access_token: Optional[str] = None
+        refresh_token: Optional[str] = None
         encrypted_credentials = request.COOKIES.get(
             settings.AUTH_COOKIE_CONFIG["NAME"]
             )
@@ -108,41 +285,133 @@ class TokenManager:
                 header_parts = auth_header.split(" ")
                 if len(header_parts) >= 2 and header_parts[0] == "Bearer":
                     access_token = " ".join(header_parts[1:])
-                    refresh_token = 'placeholder_refresh_token'
+                    refresh_token = PLACEHOLDER_REFRESH_TOKEN
         else:
-            crypto = Crypto()
-            credentials_json = crypto.decrypt(encrypted_credentials)
-            credentials = json.loads(credentials_json)
-            access_token = credentials.get("access_token")
-            refresh_token = credentials.get("refresh_token")
+            with span("cookie_decode"):
+                access_token, refresh_token = cookie.decode(
+                    encrypted_credentials
+                    )
         return access_token, refresh_token
 
-    def get_access_token_from_refresh_token(
+    def refresh(self, refresh_token: str) -> Tuple[str, str]:
+        """
+        Get new tokens using the refresh token. Concurrent refreshes of the
+        same refresh token are coalesced into a single call to Okta.
+
+        :param refresh_token: The refresh token
+
+        :return: The new access token and refresh token
+        """
+        record_token_refresh("expired")
+        # It includes the time spent waiting for a concurrent refresh
+        with span("okta_refresh"):
+            return get_refresh_coalescer().refresh(
+                refresh_token, self.get_tokens_from_refresh_token
+                )
+
+    def get_refreshed_tokens(
+        self, access_token: str, refresh_token: str
+    ) -> Tuple[str, str]:
+        """
+        Get the tokens that replaced the given ones in a background refresh
+        ahead of expiry, if any. The result is only given once, to the
+        request that sends the new tokens back in the cookie.
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: The newest access token and refresh token
+        """
+        with span("refresh_result"):
+            refreshed = get_refresh_coalescer().pop_ahead_result(
+                access_token, refresh_token
+                )
+        if refreshed is None:
+            return access_token, refresh_token
+        return refreshed
+
+    def refresh_ahead_of_expiry(
+        self, access_token: str, refresh_token: str
+    ) -> bool:
+        """
+        Refresh the tokens in the background if the access token is about to
+        expire. The new tokens are returned by get_refreshed_tokens once the
+        refresh is done.
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: Whether a refresh was started
+        """
+        if refresh_token == PLACEHOLDER_REFRESH_TOKEN:
+            return False
+        scheduled = get_background_refresher().schedule(
+            access_token, refresh_token, self.get_tokens_from_refresh_token
+            )
+        if scheduled:
+            record_token_refresh("ahead")
+        return scheduled
+
+    def get_tokens_from_refresh_token(
         self, refresh_token: str
-    ) -> str:
+    ) -> Tuple[str, str]:
         """
         Get a new access token using the refresh token
         :param refresh_token: The refresh token to use for getting a new
         access token
-        :return: The new access token
+        :return: The new access token, and the new refresh token if Okta
+        rotated it (otherwise the same refresh token)
         """
-        url = f"{settings.OKTA['DOMAIN']}/oauth/token"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "application/json",
-        }
-        payload = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-            "client_id": settings.OKTA["CLIENT_ID"],
-            "client_secret": settings.OKTA["CLIENT_SECRET"]
-        }
-        response = requests.post(url, headers=headers, data=payload)
+        response = get_session().post(
+            self.get_token_url(),
+            headers=self.get_token_headers(),
+            data=self.get_refresh_token_payload(refresh_token),
+            timeout=get_timeout(),
+            )
         response.raise_for_status()
-        access_token: Optional[str] = response.json().get("access_token")
+        return self.get_tokens_from_refresh_response(
+            response.json(), refresh_token
+            )
+
+    def get_tokens_from_refresh_response(
+        self, body: dict[str, Any], refresh_token: str
+    ) -> Tuple[str, str]:
+        """
+        :param body: The response of Okta's token endpoint to a refresh
+        :param refresh_token: The refresh token that was used
+
+        :return: The new access token and refresh token
+        """
+        access_token: Optional[str] = body.get("access_token")
         if not access_token:
             raise ValueError("Access token not found in the response")
-        return access_token
+        new_refresh_token: str = body.get("refresh_token") or refresh_token
+        return access_token, new_refresh_token
+
+    def cookie_needs_renewal(self, request: HttpRequest) -> bool:
+        """
+        Check whether the credentials cookie of the request is about to
+        expire, so it must be set again even if the tokens didn't change
+
+        :param request: The request object
+
+        :return: Whether the cookie must be renewed (it's about to expire, or
+        was encoded with an old format or key)
+        """
+        encrypted_credentials = request.COOKIES.get(
+            settings.AUTH_COOKIE_CONFIG["NAME"]
+            )
+        if encrypted_credentials is None:
+            return False
+        if not cookie.is_current(encrypted_credentials):
+            # Encode the cookie again with the new format or key while
+            # migrating formats or rotating keys
+            return True
+        issued_at = cookie.get_issued_at(encrypted_credentials)
+        config = settings.AUTH_COOKIE_CONFIG
+        lifetime: float = config["LIFETIME"].total_seconds()
+        renew_window: float = config["RENEW_WINDOW"].total_seconds()
+        return issued_at + lifetime - time.time() <= renew_window
 
     def set_credentials_as_cookie(self, response: HttpResponse,
                                   access_token: str,
@@ -153,69 +422,473 @@ class TokenManager:
         :param access_token: The access token to set in the cookie
         :param refresh_token: The refresh token to set in the cookie
         """
-        crypto = Crypto()
-        credentials_map = {
-            "access_token": access_token,
-            "refresh_token": refresh_token,
-        }
-        credentials = json.dumps(credentials_map)
-        encrypted_credentials = crypto.encrypt(credentials)
+        with span("cookie_encode"):
+            encrypted_credentials = cookie.encode(access_token, refresh_token)
 
         response.set_cookie(
             key=settings.AUTH_COOKIE_CONFIG["NAME"],
             value=encrypted_credentials,
             domain=settings.AUTH_COOKIE_CONFIG["DOMAIN"],
             path=settings.AUTH_COOKIE_CONFIG["PATH"],
-            expires=settings.AUTH_COOKIE_CONFIG["LIFETIME"],
+            max_age=settings.AUTH_COOKIE_CONFIG["LIFETIME"],
             secure=settings.AUTH_COOKIE_CONFIG["SECURE"],
             httponly=settings.AUTH_COOKIE_CONFIG["HTTP_ONLY"],
             samesite=settings.AUTH_COOKIE_CONFIG["SAMESITE"],
         )
 
 
+class AsyncTokenManager(TokenManager):
+    """
+    Variant of the TokenManager for async code (e.g. under ASGI). The calls
+    to Okta are made with an httpx.AsyncClient, so they don't block the
+    event loop.
+    """
+
+    async def aauthenticate(
+        self,
+        access_token: str,
+        refresh_token: str
+    ) -> Tuple[str, str, str]:
+        """
+        Async version of TokenManager.authenticate
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: The email address from the token, the access token, and the
+        refresh token
+        """
+        mock_claims = self.get_mock_claims(access_token)
+        if mock_claims is not None:
+            mock_email: str = mock_claims.get("sub", "")
+            return mock_email, access_token, refresh_token
+
+        cache = get_token_cache()
+        with span("token_cache"):
+            cached_email: Optional[str] = await cache.aget(
+                digest(access_token)
+                )
+        record_cache_lookup("token", bool(cached_email))
+        if cached_email:
+            return cached_email, access_token, refresh_token
+
+        if settings.OKTA["VERIFICATION_MODE"] == "jwt":
+            jwks = get_jwks_client()
+            local_email: Optional[str] = None
+            with span("jwt_verify"):
+                if jwks.keys is None:
+                    # The key set is downloaded only once, so it's fine to do
+                    # it in a thread instead of having an async JWKS client
+                    try:
+                        await sync_to_async(jwks.load)()
+                    except InvalidTokenError:
+                        pass
+                # Without keys, verifying would download the key set again,
+                # blocking the event loop
+                if jwks.keys is not None:
+                    local_email = self.verify_locally(access_token)
+            if local_email:
+                with span("token_cache"):
+                    await cache.aset(
+                        digest(access_token),
+                        local_email,
+                        self.get_cache_ttl(access_token),
+                        )
+                return local_email, access_token, refresh_token
+
+        url = self.get_userinfo_url()
+        with span("okta_userinfo"):
+            response = await arequest(
+                "GET", url, headers=self.get_userinfo_headers(access_token)
+                )
+        if response.status_code == 401:
+            access_token, refresh_token = await self.arefresh(refresh_token)
+            with span("okta_userinfo"):
+                response = await arequest(
+                    "GET",
+                    url,
+                    headers=self.get_userinfo_headers(access_token),
+                    )
+        response.raise_for_status()
+        email = self.get_email_from_userinfo(response.json())
+        with span("token_cache"):
+            await cache.aset(
+                digest(access_token), email, self.get_cache_ttl(access_token)
+                )
+        return email, access_token, refresh_token
+
+    async def aget_tokens_from_provider(self, code: str) -> Tuple[str, str]:
+        """
+        Async version of TokenManager.get_tokens_from_provider
+
+        :param code: The authorization code received from Okta
+
+        :return: The access token and refresh token
+        """
+        with span("okta_token"):
+            response = await arequest(
+                "POST",
+                self.get_token_url(),
+                headers=self.get_token_headers(),
+                data=self.get_authorization_code_payload(code),
+                )
+        response.raise_for_status()
+        access_token: str = response.json().get("access_token")
+        refresh_token: str = response.json().get("refresh_token")
+        return access_token, refresh_token
+
+    async def arefresh(self, refresh_token: str) -> Tuple[str, str]:
+        """
+        Async version of TokenManager.refresh
+
+        :param refresh_token: The refresh token
+
+        :return: The new access token and refresh token
+        """
+        record_token_refresh("expired")
+        with span("okta_refresh"):
+            return await get_refresh_coalescer().arefresh(
+                refresh_token, self.aget_tokens_from_refresh_token
+                )
+
+    async def aget_refreshed_tokens(
+        self, access_token: str, refresh_token: str
+    ) -> Tuple[str, str]:
+        """
+        Async version of TokenManager.get_refreshed_tokens
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: The newest access token and refresh token
+        """
+        with span("refresh_result"):
+            refreshed = await get_refresh_coalescer().apop_ahead_result(
+                access_token, refresh_token
+                )
+        if refreshed is None:
+            return access_token, refresh_token
+        return refreshed
+
+    async def aget_tokens_from_refresh_token(
+        self, refresh_token: str
+    ) -> Tuple[str, str]:
+        """
+        Async version of TokenManager.get_tokens_from_refresh_token
+
+        :param refresh_token: The refresh token to use for getting a new
+        access token
+
+        :return: The new access token and refresh token
+        """
+        response = await arequest(
+            "POST",
+            self.get_token_url(),
+            headers=self.get_token_headers(),
+            data=self.get_refresh_token_payload(refresh_token),
+            )
+        response.raise_for_status()
+        return self.get_tokens_from_refresh_response(
+            response.json(), refresh_token
+            )
+
+
+class Credentials:
+    """
+    Tokens of the request being processed. They are stored on the request
+    object, so concurrent requests handled by the same worker (in threads or
+    in an event loop) never see each other's tokens.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        refresh_token: str,
+        changed: bool = False,
+    ) -> None:
+        """
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+        :param changed: Whether the tokens must be sent back in the cookie
+        """
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.changed = changed
+
+
+"""Attribute of the request holding its credentials"""
+CREDENTIALS_ATTRIBUTE = "okta_credentials"
+
+"""Attribute of the request holding its authenticated user"""
+CACHED_USER_ATTRIBUTE = "_okta_user"
+
+
+def get_request_credentials(request: HttpRequest) -> Optional[Credentials]:
+    """
+    Get the credentials of a request
+
+    :param request: The request object
+
+    :return: The credentials, or None if the request has no tokens
+    """
+    credentials: Optional[Credentials] = getattr(
+        request, CREDENTIALS_ATTRIBUTE, None
+        )
+    return credentials
+
+
+def set_request_credentials(
+    request: HttpRequest, credentials: Credentials
+) -> None:
+    """
+    Set the credentials of a request
+
+    :param request: The request object
+    :param credentials: The credentials
+    """
+    setattr(request, CREDENTIALS_ATTRIBUTE, credentials)
+
+
+def get_failure_reason(error: Exception) -> str:
+    """
+    :param error: The error raised while authenticating a request
+
+    :return: The reason of the failure, as reported in the metrics
+    """
+    if isinstance(error, cookie.InvalidCookieError):
+        return "invalid_cookie"
+    if isinstance(error, User.DoesNotExist):
+        return "unknown_user"
+    response = getattr(error, "response", None)
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        if response is not None and response.status_code in (400, 401):
+            return "okta_rejected"
+        return "okta_error"
+    if isinstance(error, (requests.RequestException, httpx.HTTPError)):
+        return "okta_unavailable"
+    if isinstance(error, ValueError):
+        return "invalid_token"
+    return "other"
+
+
 class CustomAuthMiddleware(AuthenticationMiddleware):
     """
-    Custom authentication middleware to handle Okta authentication
+    Custom authentication middleware to handle Okta authentication. It
+    supports both sync (WSGI) and async (ASGI) request handling.
+
+    Like Django's AuthenticationMiddleware, the user is resolved lazily:
+    the tokens are only decoded and verified, and the user only looked up,
+    when request.user is accessed (or request.auser() awaited, which doesn't
+    block the event loop). Requests that never need the user don't pay for
+    authenticating it.
+
+    Under ASGI, only async views awaiting request.auser() verify the tokens
+    with the async client. Sync views, like the ones of this project, run
+    in a thread, where accessing request.user goes through the sync path.
+    The views are kept sync because the shipped server is WSGI: an async
+    view would run in a new event loop for each request, losing the pooled
+    connections of the async client.
+
+    The middleware instance is shared by all the requests of the worker, so
+    it must not hold any per-request state: the tokens of each request are
+    kept in its Credentials.
     """
 
+    sync_capable = True
+    async_capable = True
+
     verifier = TokenManager()
+    async_verifier = AsyncTokenManager()
     serializer = UserSerializer()
-    access_token: Optional[str] = None
-    refresh_token: Optional[str] = None
+
+    def __init__(self, get_response: Any) -> None:
+        super().__init__(get_response)
+        # Build the cookie cipher when the server starts instead of on the
+        # first request, so invalid keys are detected early
+        Crypto()
 
     def process_request(self, request: HttpRequest) -> None:
         """
-        Process the request to authenticate the user based on the token
+        Set the user of the request, which is authenticated on first access.
+        CORS preflights and requests without credentials are anonymous, so
+        they skip decoding the credentials altogether.
 
         :param request: The request object
         """
-        try:
-            at, rt = self.verifier.get_tokens_from_request(request)
-            if at is None or rt is None:
-                request.user = AnonymousUser()
-                return
-            self.access_token = at
-            self.refresh_token = rt
-            email, at, rt = self.verifier.authenticate(at, rt)
-            user = self.serializer.find_by_email(email)
-            request.user = user
-        except Exception as e:
-            print(f"Authentication failed: {str(e)}")
-            request.user = AnonymousUser()
+        if self.is_preflight(request) or not self.has_credentials(request):
+            anonymous_user = AnonymousUser()
+            setattr(request, CACHED_USER_ATTRIBUTE, anonymous_user)
+            request.user = anonymous_user
+            request.auser = partial(self.aget_user, request)
+            return
+        # SimpleLazyObject proxies the user, but isn't typed as one
+        request.user = cast(Any, SimpleLazyObject(
+            lambda: self.get_user(request)
+            ))
+        request.auser = partial(self.aget_user, request)
+
+    def is_preflight(self, request: HttpRequest) -> bool:
+        """
+        :param request: The request object
+
+        :return: Whether the request is a CORS preflight, which never
+        carries credentials and is answered by the CORS middleware
+        """
+        return (
+            request.method == "OPTIONS"
+            and "Access-Control-Request-Method" in request.headers
+        )
+
+    def has_credentials(self, request: HttpRequest) -> bool:
+        """
+        :param request: The request object
+
+        :return: Whether the request has a credentials cookie or an
+        Authorization header
+        """
+        return (
+            settings.AUTH_COOKIE_CONFIG["NAME"] in request.COOKIES
+            or "Authorization" in request.headers
+        )
+
+    def get_user(self, request: HttpRequest) -> "User | AnonymousUser":
+        """
+        Authenticate the user based on the tokens of the request. The result
+        is kept on the request, so it's only done once per request.
+
+        :param request: The request object
+
+        :return: The user, or AnonymousUser if the request can't be
+        authenticated
+        """
+        cached_user: Optional[User | AnonymousUser] = getattr(
+            request, CACHED_USER_ATTRIBUTE, None
+            )
+        if cached_user is not None:
+            return cached_user
+        with span("auth"):
+            try:
+                at, rt = self.verifier.get_tokens_from_request(request)
+                if at is None or rt is None:
+                    user: User | AnonymousUser = AnonymousUser()
+                else:
+                    received_tokens = (at, rt)
+                    at, rt = self.verifier.get_refreshed_tokens(at, rt)
+                    self.verifier.refresh_ahead_of_expiry(at, rt)
+                    email, at, rt = self.verifier.authenticate(at, rt)
+                    changed = (
+                        (at, rt) != received_tokens
+                        or self.verifier.cookie_needs_renewal(request)
+                    )
+                    credentials = Credentials(at, rt, changed)
+                    set_request_credentials(request, credentials)
+                    with span("user_lookup"):
+                        user = self.serializer.find_by_email(email)
+                    set_user_id(user.pk)
+                    self.track_activity(user)
+            except Exception as e:
+                reason = get_failure_reason(e)
+                logger.info(
+                    "Authentication failed: %s", e, extra={"reason": reason}
+                    )
+                record_auth_failure(reason)
+                user = AnonymousUser()
+        setattr(request, CACHED_USER_ATTRIBUTE, user)
+        return user
+
+    async def aget_user(
+        self, request: HttpRequest
+    ) -> "User | AnonymousUser":
+        """
+        Async version of get_user
+
+        :param request: The request object
+
+        :return: The user, or AnonymousUser if the request can't be
+        authenticated
+        """
+        cached_user: Optional[User | AnonymousUser] = getattr(
+            request, CACHED_USER_ATTRIBUTE, None
+            )
+        if cached_user is not None:
+            return cached_user
+        with span("auth"):
+            try:
+                at, rt = self.async_verifier.get_tokens_from_request(request)
+                if at is None or rt is None:
+                    user: User | AnonymousUser = AnonymousUser()
+                else:
+                    received_tokens = (at, rt)
+                    at, rt = await self.async_verifier.aget_refreshed_tokens(
+                        at, rt
+                        )
+                    self.async_verifier.refresh_ahead_of_expiry(at, rt)
+                    email, at, rt = await self.async_verifier.aauthenticate(
+                        at, rt
+                        )
+                    changed = (
+                        (at, rt) != received_tokens
+                        or self.async_verifier.cookie_needs_renewal(request)
+                    )
+                    credentials = Credentials(at, rt, changed)
+                    set_request_credentials(request, credentials)
+                    with span("user_lookup"):
+                        user = await self.serializer.afind_by_email(email)
+                    set_user_id(user.pk)
+                    self.track_activity(user)
+            except Exception as e:
+                reason = get_failure_reason(e)
+                logger.info(
+                    "Authentication failed: %s", e, extra={"reason": reason}
+                    )
+                record_auth_failure(reason)
+                user = AnonymousUser()
+        setattr(request, CACHED_USER_ATTRIBUTE, user)
+        return user
+
+    def track_activity(self, user: User) -> None:
+        """
+        Record that the user was seen. It's buffered in memory, so it
+        doesn't write to the database during the request.
+
+        :param user: The authenticated user
+        """
+        if settings.ACTIVITY_TRACKING["ENABLED"]:
+            get_activity_tracker().touch(user.pk)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """
+        Handle a request in async mode. Setting the lazy user doesn't block,
+        so it's done in the event loop instead of in a thread.
+
+        :param request: The request object
+
+        :return: The response object
+        """
+        self.process_request(request)
+        response = await cast(
+            Awaitable[HttpResponse], self.get_response(request)
+            )
+        return self.process_response(request, response)
 
     def process_response(
         self,
-        _: HttpRequest,
+        request: HttpRequest,
         response: HttpResponse
     ) -> HttpResponse:
         """
         Process the response to set the access and refresh tokens as cookies.
-        :param _: The request object (not used)
+        The cookie is only set when the user was authenticated, and the
+        tokens changed during the request (e.g. they were refreshed) or the
+        cookie is about to expire.
+        :param request: The request object
         :param response: The response object
         :return: The response object with the cookies set
         """
-        if self.access_token and self.refresh_token:
-            self.verifier.set_credentials_as_cookie(
-                response, self.access_token, self.refresh_token
-            )
+        credentials = get_request_credentials(request)
+        if credentials is None or not credentials.changed:
+            return response
+        self.verifier.set_credentials_as_cookie(
+            response, credentials.access_token, credentials.refresh_token
+        )
         return response
@@ -0,0 +1,375 @@
+"""
+Caches used to keep hot authentication data off the network and DB path.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Protocol, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def digest(value: str) -> str:
+    """
+    Return a stable digest of a secret value (e.g. a token), so that it can
+    be used as a cache key without storing the secret itself
+
+    :param value: The value to digest
+
+    :return: The hex SHA-256 digest of the value
+    """
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class Cache(Protocol):
+    """
+    Interface shared by all the cache backends
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+    def delete(self, key: str) -> None:
+        ...
+
+    async def aget(self, key: str) -> Optional[Any]:
+        ...
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+
+class LocalCache:
+    """
+    In-process LRU cache. Entries expire after their TTL and the least
+    recently used entry is evicted once the size limit is reached.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a value from the cache
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store a value in the cache
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a value from the cache
+
+        :param key: The key of the entry
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all the values from the cache
+        """
+        with self.lock:
+            self.entries.clear()
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """
+        Async version of get
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Async version of set
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        self.set(key, value, ttl)
+
+
+class SharedCache:
+    """
+    Cache backed by one of the Django cache backends (see the CACHES
+    setting), so that entries are shared between workers
+    """
+
+    def __init__(self, alias: str, prefix: str) -> None:
+        self.alias = alias
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a value from the cache
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        return caches[self.alias].get(f"{self.prefix}:{key}")
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store a value in the cache
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        # Django cache backends only accept whole seconds
+        timeout = int(ttl)
+        if timeout <= 0:
+            return
+        caches[self.alias].set(f"{self.prefix}:{key}", value, timeout)
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a value from the cache
+
+        :param key: The key of the entry
+        """
+        caches[self.alias].delete(f"{self.prefix}:{key}")
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """
+        Get a value from the cache, without blocking the event loop
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        return await caches[self.alias].aget(f"{self.prefix}:{key}")
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store a value in the cache, without blocking the event loop
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        # Django cache backends only accept whole seconds
+        timeout = int(ttl)
+        if timeout <= 0:
+            return
+        await caches[self.alias].aset(f"{self.prefix}:{key}", value, timeout)
+
+
+class NullCache:
+    """
+    Cache that never stores anything. Used when caching is disabled.
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """
+        Async version of get, always a miss
+
+        :param key: The key of the entry
+
+        :return: None
+        """
+        return None
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Async version of set, which stores nothing
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process LRU cache in front of a shared cache. Hits
+    in the local tier don't leave the process, and entries found in the
+    shared tier are copied to the local tier.
+
+    Entries deleted in another process are only removed from the shared
+    tier, so entries are kept in the local tier for at most local_ttl
+    seconds to bound how long a process can serve a stale value.
+    """
+
+    def __init__(
+        self, local: LocalCache, shared: SharedCache, local_ttl: float
+    ) -> None:
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a value from the local tier, or else from the shared tier
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store a value in both tiers
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        self.shared.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a value from both tiers
+
+        :param key: The key of the entry
+        """
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """
+        Async version of get. Only the shared tier is awaited, the local
+        tier is read in memory
+
+        :param key: The key of the entry
+
+        :return: The cached value, or None if missing or expired
+        """
+        value = self.local.get(key)
+        if value is None:
+            value = await self.shared.aget(key)
+            if value is not None:
+                self.local.set(key, value, self.local_ttl)
+        return value
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Async version of set
+
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: Number of seconds the entry is valid for
+        """
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        await self.shared.aset(key, value, ttl)
+
+
+def build_cache(config: dict[str, Any], prefix: str) -> Cache:
+    """
+    Build a cache from its configuration in the settings
+
+    :param config: The cache configuration. BACKEND can be "local",
+    "django", "tiered" or "none"
+    :param prefix: Prefix for the keys stored in shared caches
+
+    :return: The cache
+    """
+    backend = config.get("BACKEND", "local")
+    if backend == "local":
+        return LocalCache(config.get("MAX_SIZE", 1024))
+    if backend == "django":
+        return SharedCache(config.get("CACHE_ALIAS", "default"), prefix)
+    if backend == "tiered":
+        return TieredCache(
+            LocalCache(config.get("MAX_SIZE", 1024)),
+            SharedCache(config.get("CACHE_ALIAS", "default"), prefix),
+            config.get("LOCAL_TTL", 30),
+        )
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+_token_cache: Optional[Cache] = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache() -> Cache:
+    """
+    Get the per-process cache of verified access tokens, which maps the
+    digest of an access token to the email it belongs to
+
+    :return: The token cache
+    """
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = build_cache(
+                    settings.OKTA["TOKEN_CACHE"], "okta-token"
+                )
+    return _token_cache
+
+
+_user_cache: Optional[Cache] = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> Cache:
+    """
+    Get the per-process cache of users, which maps a normalized email to
+    the user it belongs to
+
+    :return: The user cache
+    """
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = build_cache(settings.USER_CACHE, "user")
+    return _user_cache
@@ -0,0 +1,329 @@
+"""
+Encoding of the credentials cookie.
+
+Two formats are supported:
+
+- Legacy: the JSON map {"access_token": ..., "refresh_token": ...}
+  encrypted with Fernet. It is only decoded, so cookies issued before the
+  compact format keep working.
+- Compact (version 2): the tokens as length-prefixed binary fields,
+  optionally compressed with zlib, encrypted with Fernet or an AEAD cipher
+  (AES-GCM or ChaCha20-Poly1305) and base64url-encoded once.
+
+A compact cookie is laid out as:
+
+    version (1 byte) | cipher (1 byte) | key ID (1 byte) |
+    issued at (4 bytes) | encrypted payload
+
+The header is sent in clear (and authenticated by the AEAD ciphers), so
+the age of the cookie and the key it was encrypted with can be checked
+without decrypting it.
+"""
+import base64
+import binascii
+import functools
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+from typing import Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import (
+    AESGCM,
+    ChaCha20Poly1305,
+)
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+
+from core.crypto import Crypto, get_ciphers
+
+"""First byte of a Fernet token, i.e. of a legacy cookie"""
+LEGACY_VERSION = 0x80
+
+"""First byte of a compact cookie"""
+COMPACT_VERSION = 0x02
+
+"""IDs of the ciphers of compact cookies"""
+CIPHERS = {
+    "fernet": 0,
+    "aesgcm": 1,
+    "chacha20": 2,
+}
+
+HEADER = struct.Struct(">BBBI")
+FIELD_LENGTH = struct.Struct(">H")
+NONCE_SIZE = 12
+
+"""Flags of the payload of compact cookies"""
+FLAG_ZLIB = 0x01
+
+
+class InvalidCookieError(ValueError):
+    """
+    Raised when the credentials cookie can't be decoded
+    """
+
+
+def b64url_encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).decode().rstrip("=")
+
+
+def b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def get_key_id(key: str) -> int:
+    """
+    :param key: An encryption key
+
+    :return: A one-byte hint identifying the key, so that the key used to
+    encrypt a cookie can be found without trying all of them
+    """
+    return hashlib.sha256(key.encode()).digest()[0]
+
+
+@functools.lru_cache(maxsize=8)
+def get_aead_keys(
+    keys: Tuple[str, ...], cipher: str
+) -> Tuple[Tuple[int, AESGCM | ChaCha20Poly1305], ...]:
+    """
+    Derive the AEAD ciphers from the encryption keys. A separate key is
+    derived with HKDF, so the same key material is never used by two
+    algorithms.
+
+    :param keys: The encryption keys, newest first
+    :param cipher: The name of the AEAD cipher
+
+    :return: The key ID and the cipher of each key
+    """
+    aead_keys = []
+    for key in keys:
+        derived_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=f"credentials-cookie-{cipher}".encode(),
+        ).derive(b64url_decode(key))
+        aead = (
+            AESGCM(derived_key)
+            if cipher == "aesgcm"
+            else ChaCha20Poly1305(derived_key)
+        )
+        aead_keys.append((get_key_id(key), aead))
+    return tuple(aead_keys)
+
+
+def pack_tokens(
+    access_token: str, refresh_token: str, compress: bool
+) -> bytes:
+    """
+    Serialize the tokens as length-prefixed fields
+
+    :param access_token: The access token
+    :param refresh_token: The refresh token
+    :param compress: Whether to compress the fields with zlib (only done
+    when it makes them smaller)
+
+    :return: The payload of a compact cookie
+    """
+    fields = b""
+    for field in (access_token, refresh_token):
+        encoded_field = field.encode()
+        fields += FIELD_LENGTH.pack(len(encoded_field)) + encoded_field
+    flags = 0
+    if compress:
+        compressed_fields = zlib.compress(fields, 9)
+        if len(compressed_fields) < len(fields):
+            fields = compressed_fields
+            flags |= FLAG_ZLIB
+    return bytes([flags]) + fields
+
+
+def unpack_tokens(payload: bytes) -> Tuple[str, str]:
+    """
+    Deserialize the tokens of a compact cookie
+
+    :param payload: The decrypted payload
+
+    :return: The access token and the refresh token
+    """
+    if not payload:
+        raise InvalidCookieError("Empty cookie payload")
+    flags, fields = payload[0], payload[1:]
+    if flags & FLAG_ZLIB:
+        try:
+            fields = zlib.decompress(fields)
+        except zlib.error:
+            raise InvalidCookieError("Invalid compressed cookie payload")
+    tokens = []
+    offset = 0
+    for _ in range(2):
+        if offset + FIELD_LENGTH.size > len(fields):
+            raise InvalidCookieError("Truncated cookie payload")
+        (length,) = FIELD_LENGTH.unpack_from(fields, offset)
+        offset += FIELD_LENGTH.size
+        if offset + length > len(fields):
+            raise InvalidCookieError("Truncated cookie payload")
+        tokens.append(fields[offset:offset + length].decode())
+        offset += length
+    return tokens[0], tokens[1]
+
+
+def encode(access_token: str, refresh_token: str) -> str:
+    """
+    Encode the tokens as the value of the credentials cookie, in the format
+    configured in AUTH_COOKIE_CONFIG
+
+    :param access_token: The access token
+    :param refresh_token: The refresh token
+
+    :return: The value of the cookie
+    """
+    config = settings.AUTH_COOKIE_CONFIG
+    if config["FORMAT"] == "json":
+        return Crypto().encrypt(json.dumps({
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+        }))
+
+    keys = tuple(settings.ENCRYPTION_KEYS)
+    cipher = config["CIPHER"]
+    header = HEADER.pack(
+        COMPACT_VERSION,
+        CIPHERS[cipher],
+        get_key_id(keys[0]),
+        int(time.time()),
+    )
+    payload = pack_tokens(access_token, refresh_token, config["COMPRESS"])
+    if cipher == "fernet":
+        multi_fernet, _ = get_ciphers(keys)
+        encrypted_payload = b64url_decode(
+            multi_fernet.encrypt(payload).decode()
+        )
+    else:
+        _, aead = get_aead_keys(keys, cipher)[0]
+        nonce = os.urandom(NONCE_SIZE)
+        encrypted_payload = nonce + aead.encrypt(nonce, payload, header)
+    return b64url_encode(header + encrypted_payload)
+
+
+def decode(value: str) -> Tuple[str, str]:
+    """
+    Decode the value of the credentials cookie, in any of the supported
+    formats
+
+    :param value: The value of the cookie
+
+    :return: The access token and the refresh token
+    """
+    raw = decode_raw(value)
+    if raw[0] == LEGACY_VERSION:
+        try:
+            credentials = json.loads(Crypto().decrypt(value))
+        except InvalidToken:
+            raise InvalidCookieError(
+                "The cookie can't be decrypted with any key"
+            )
+        return credentials.get("access_token"), credentials.get(
+            "refresh_token"
+        )
+
+    header, encrypted_payload = raw[:HEADER.size], raw[HEADER.size:]
+    _, cipher_id, key_id, _ = HEADER.unpack(header)
+    keys = tuple(settings.ENCRYPTION_KEYS)
+    if cipher_id == CIPHERS["fernet"]:
+        multi_fernet, _ = get_ciphers(keys)
+        try:
+            payload = multi_fernet.decrypt(
+                base64.urlsafe_b64encode(encrypted_payload)
+            )
+        except InvalidToken:
+            raise InvalidCookieError(
+                "The cookie can't be decrypted with any key"
+            )
+        return unpack_tokens(payload)
+
+    cipher = {v: k for k, v in CIPHERS.items()}.get(cipher_id)
+    if cipher is None:
+        raise InvalidCookieError(f"Unknown cookie cipher: {cipher_id}")
+    nonce = encrypted_payload[:NONCE_SIZE]
+    ciphertext = encrypted_payload[NONCE_SIZE:]
+    for aead_key_id, aead in get_aead_keys(keys, cipher):
+        if aead_key_id != key_id:
+            continue
+        try:
+            payload = aead.decrypt(nonce, ciphertext, header)
+        except InvalidTag:
+            continue
+        return unpack_tokens(payload)
+    raise InvalidCookieError("The cookie can't be decrypted with any key")
+
+
+def decode_raw(value: str) -> bytes:
+    """
+    Decode the base64 layer of a cookie and check its version
+
+    :param value: The value of the cookie
+
+    :return: The raw bytes of the cookie
+    """
+    try:
+        raw = b64url_decode(value)
+    except (ValueError, binascii.Error):
+        raise InvalidCookieError("Malformed cookie")
+    if not raw:
+        raise InvalidCookieError("Empty cookie")
+    if raw[0] == COMPACT_VERSION and len(raw) < HEADER.size:
+        raise InvalidCookieError("Truncated cookie")
+    if raw[0] not in (LEGACY_VERSION, COMPACT_VERSION):
+        raise InvalidCookieError(f"Unknown cookie version: {raw[0]}")
+    return raw
+
+
+def get_issued_at(value: str) -> int:
+    """
+    Get when the cookie was issued, without decrypting it
+
+    :param value: The value of the cookie
+
+    :return: The UNIX timestamp when the cookie was issued
+    """
+    raw = decode_raw(value)
+    if raw[0] == LEGACY_VERSION:
+        try:
+            return Crypto().get_timestamp(value)
+        except InvalidToken:
+            raise InvalidCookieError("Malformed cookie")
+    _, _, _, issued_at = HEADER.unpack(raw[:HEADER.size])
+    issued_at_timestamp: int = issued_at
+    return issued_at_timestamp
+
+
+def is_current(value: str) -> bool:
+    """
+    Check whether the cookie uses the configured format, cipher and newest
+    key. Cookies that don't should be issued again.
+
+    :param value: The value of the cookie
+
+    :return: Whether the cookie is up to date
+    """
+    config = settings.AUTH_COOKIE_CONFIG
+    raw = decode_raw(value)
+    if raw[0] == LEGACY_VERSION:
+        return (
+            config["FORMAT"] == "json"
+            and Crypto().is_encrypted_with_primary_key(value)
+        )
+    _, cipher_id, key_id, _ = HEADER.unpack(raw[:HEADER.size])
+    current: bool = (
+        config["FORMAT"] == "compact"
+        and cipher_id == CIPHERS[config["CIPHER"]]
+        and key_id == get_key_id(settings.ENCRYPTION_KEYS[0])
+    )
+    return current
@@ -1,22 +1,45 @@
 import base64
+import functools
+from typing import Tuple
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from django.conf import settings
 
 
-class Crypto:
-    """
-    A class to handle encryption and decryption of sensitive data.
+@functools.lru_cache(maxsize=4)
+def get_ciphers(keys: Tuple[str, ...]) -> Tuple[MultiFernet, Fernet]:
     """
+    Build the ciphers for a list of keys. They are cached, so the keys are
+    only decoded and validated once per process.
 
-    def __init__(self) -> None:
-        self.key = settings.ENCRYPTION_KEY.encode()
+    :param keys: The encryption keys. The first one is used to encrypt, all
+    of them are tried to decrypt, so older keys can be kept while rotating
+
+    :return: The cipher for all the keys, and the cipher for the first key
+    """
+    if not keys:
+        raise ValueError("At least one encryption key is required")
+    fernets = []
+    for key in keys:
+        encoded_key = key.encode()
         if len(base64.urlsafe_b64decode(
-          self.key + b'=' * (-len(self.key) % 4)
+          encoded_key + b'=' * (-len(encoded_key) % 4)
           )) != 32:
             raise ValueError("Encryption key must be 32 bytes long after"
                              " base64 decoding")
-        self.cipher = Fernet(self.key)
+        fernets.append(Fernet(encoded_key))
+    return MultiFernet(fernets), fernets[0]
+
+
+class Crypto:
+    """
+    A class to handle encryption and decryption of sensitive data.
+    """
+
+    def __init__(self) -> None:
+        self.cipher, self.primary_cipher = get_ciphers(
+            tuple(settings.ENCRYPTION_KEYS)
+        )
 
     def encrypt(self, value: str) -> str:
         """
@@ -35,3 +58,20 @@ class Crypto:
             return encrypted_value
         decrypted = self.cipher.decrypt(encrypted_value.encode())
         return decrypted.decode()
+
+    def get_timestamp(self, encrypted_value: str) -> int:
+        """
+        Get when a value was encrypted, without decrypting it
+        """
+        return self.cipher.extract_timestamp(encrypted_value.encode())
+
+    def is_encrypted_with_primary_key(self, encrypted_value: str) -> bool:
+        """
+        Check whether a value was encrypted with the current key, rather than
+        with an older key that is being rotated out
+        """
+        try:
+            self.primary_cipher.extract_timestamp(encrypted_value.encode())
+            return True
+        except InvalidToken:
+            return False
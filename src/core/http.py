@@ -0,0 +1,203 @@
+"""
+HTTP client shared by all the calls to Okta
+"""
+import asyncio
+import threading
+import time
+import weakref
+from typing import Any, Optional, Tuple
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader
+from urllib3.util.retry import Retry
+
+from core.metrics import record_okta_request
+
+"""Statuses that are retried for idempotent requests"""
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_async_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, httpx.AsyncClient
+] = weakref.WeakKeyDictionary()
+
+
+class InstrumentedSession(requests.Session):
+    """
+    Session recording the status and duration of each call in the metrics
+    """
+
+    def request(  # type: ignore[override]
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            record_okta_request(url, status, time.perf_counter() - started_at)
+
+
+def build_retry() -> Retry:
+    """
+    Build the retry policy of the calls to Okta, as configured in the
+    settings
+
+    :return: The retry policy
+    """
+    config = settings.OKTA["HTTP"]
+    # Connection errors are retried for every request, since the request
+    # never reached Okta. Read errors and error statuses are only retried
+    # for idempotent methods: authorization codes and rotating refresh tokens
+    # can only be used once, so POSTs to the token endpoint are not retried.
+    # The wait asked by a Retry-After header is capped, since the request
+    # holds a worker while it waits.
+    return Retry(
+        total=config["MAX_RETRIES"],
+        backoff_factor=config["BACKOFF_FACTOR"],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        retry_after_max=config["MAX_RETRY_AFTER"],
+        raise_on_status=False,
+    )
+
+
+def build_session() -> requests.Session:
+    """
+    Build an HTTP session with a pool of keep-alive connections and
+    bounded retries, as configured in the settings
+
+    :return: The session
+    """
+    config = settings.OKTA["HTTP"]
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config["POOL_SIZE"],
+        max_retries=build_retry(),
+    )
+    session = InstrumentedSession()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Get the per-process HTTP session used for the calls to Okta. It is
+    created on first use, so each worker process gets its own pool.
+
+    :return: The session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get_timeout() -> Tuple[float, float]:
+    """
+    Get the timeouts for the calls to Okta
+
+    :return: The connect and read timeouts in seconds
+    """
+    config = settings.OKTA["HTTP"]
+    return config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"]
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Get the HTTP client used for the calls to Okta from async code. The
+    connections of an async client belong to an event loop, so there is one
+    client per event loop (i.e. one per worker process under ASGI).
+
+    :return: The async client
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        config = settings.OKTA["HTTP"]
+        transport = httpx.AsyncHTTPTransport(
+            retries=config["MAX_RETRIES"],
+            limits=httpx.Limits(
+                max_connections=config["POOL_SIZE"],
+                max_keepalive_connections=config["POOL_SIZE"],
+            ),
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                config["READ_TIMEOUT"],
+                connect=config["CONNECT_TIMEOUT"],
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def get_retry_delay(response: httpx.Response, attempt: int) -> float:
+    """
+    Get how long to wait before retrying a call to Okta from async code,
+    like the sync session does: the Retry-After header of the response is
+    respected (up to MAX_RETRY_AFTER seconds), and otherwise the delay grows
+    exponentially
+
+    :param response: The failed response
+    :param attempt: The number of retries made so far
+
+    :return: The delay in seconds
+    """
+    retry_after = response.headers.get("Retry-After")
+    if (
+        retry_after is not None
+        and response.status_code in Retry.RETRY_AFTER_STATUS_CODES
+    ):
+        try:
+            delay = build_retry().parse_retry_after(retry_after)
+        except InvalidHeader:
+            delay = 0
+        if delay:
+            return delay
+    backoff_factor: float = settings.OKTA["HTTP"]["BACKOFF_FACTOR"]
+    return backoff_factor * 2.0 ** attempt
+
+
+async def arequest(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """
+    Make a call to Okta from async code, with the same retry policy as the
+    sync session: the transport retries connection errors, and error
+    statuses are retried for GETs, after the delay asked by the Retry-After
+    header or with backoff
+
+    :param method: The HTTP method
+    :param url: The URL to call
+    :param kwargs: Extra arguments for httpx.AsyncClient.request
+
+    :return: The response
+    """
+    config = settings.OKTA["HTTP"]
+    client = get_async_client()
+    retries = config["MAX_RETRIES"] if method.upper() == "GET" else 0
+    started_at = time.perf_counter()
+    status = "error"
+    try:
+        for attempt in range(retries + 1):
+            response = await client.request(method, url, **kwargs)
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt == retries
+            ):
+                break
+            await asyncio.sleep(get_retry_delay(response, attempt))
+        status = str(response.status_code)
+        return response
+    finally:
+        record_okta_request(url, status, time.perf_counter() - started_at)
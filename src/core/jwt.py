@@ -0,0 +1,294 @@
+"""
+Helpers to read and verify JSON Web Tokens issued by Okta
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.conf import settings
+
+from core.http import get_session, get_timeout
+
+logger = logging.getLogger(__name__)
+
+"""Hash algorithms of the supported JWT signature algorithms"""
+ALGORITHMS: dict[str, hashes.HashAlgorithm] = {
+    "RS256": hashes.SHA256(),
+    "RS384": hashes.SHA384(),
+    "RS512": hashes.SHA512(),
+}
+
+
+class InvalidTokenError(ValueError):
+    """
+    Raised when a token can't be verified locally
+    """
+
+
+def b64url_decode(value: str) -> bytes:
+    """
+    Decode a base64url value without padding, as used in JWTs
+
+    :param value: The encoded value
+
+    :return: The decoded bytes
+    """
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def get_unverified_claims(token: str) -> Optional[dict[str, Any]]:
+    """
+    Read the claims of a JWT without verifying its signature. This must
+    never be used to trust the token, only to read hints such as the
+    expiration time.
+
+    :param token: The JWT
+
+    :return: The claims, or None if the token is not a JWT
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        claims = json.loads(b64url_decode(parts[1]))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(claims, dict):
+        return None
+    return claims
+
+
+def get_expiration(token: str) -> Optional[float]:
+    """
+    Get the expiration time of a JWT without verifying it
+
+    :param token: The JWT
+
+    :return: The expiration time as a UNIX timestamp, or None if unknown
+    """
+    claims = get_unverified_claims(token)
+    if claims is None:
+        return None
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return None
+    return float(exp)
+
+
+def b64url_decode_int(value: str) -> int:
+    """
+    Decode a base64url encoded big-endian integer, as used in JWKs
+
+    :param value: The encoded value
+
+    :return: The decoded integer
+    """
+    return int.from_bytes(b64url_decode(value), "big")
+
+
+class JWKSClient:
+    """
+    Client for a JSON Web Key Set. The keys are fetched on first use and
+    kept in memory. When a token is signed with an unknown key, the key set
+    is refreshed in the background so that rotated keys are picked up.
+
+    While the key set can't be fetched (e.g. during an outage of Okta), the
+    fetch is tried at most once per refresh interval, so that requests fall
+    back to the userinfo endpoint right away instead of each waiting for the
+    timeouts and retries of the fetch.
+    """
+
+    def __init__(self, url: str, refresh_interval: float) -> None:
+        """
+        :param url: The URL of the JWKS document
+        :param refresh_interval: Minimum number of seconds between two
+        refreshes of the key set
+        """
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.keys: Optional[dict[str, rsa.RSAPublicKey]] = None
+        self.last_refresh = 0.0
+        self.last_failure: Optional[float] = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def fetch(self) -> dict[str, rsa.RSAPublicKey]:
+        """
+        Download the key set
+
+        :return: The RSA public keys by key ID
+        """
+        response = get_session().get(
+            self.url,
+            headers={"Accept": "application/json"},
+            timeout=get_timeout(),
+        )
+        response.raise_for_status()
+        keys: dict[str, rsa.RSAPublicKey] = {}
+        for jwk in response.json().get("keys", []):
+            if jwk.get("kty") != "RSA" or "kid" not in jwk:
+                continue
+            if jwk.get("use", "sig") != "sig":
+                continue
+            numbers = rsa.RSAPublicNumbers(
+                b64url_decode_int(jwk["e"]),
+                b64url_decode_int(jwk["n"]),
+            )
+            keys[jwk["kid"]] = numbers.public_key()
+        return keys
+
+    def refresh(self) -> None:
+        """
+        Download the key set and replace the keys in memory
+        """
+        try:
+            keys = self.fetch()
+            with self.lock:
+                self.keys = keys
+        except Exception as e:
+            logger.warning("Failed to refresh the JWKS: %s", str(e))
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def refresh_in_background(self) -> None:
+        """
+        Start a refresh of the key set in a background thread, unless one is
+        already running or the last one happened too recently
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.refreshing:
+                return
+            if now - self.last_refresh < self.refresh_interval:
+                return
+            self.refreshing = True
+            self.last_refresh = now
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def load(self) -> dict[str, rsa.RSAPublicKey]:
+        """
+        Get the keys in memory, downloading the key set if it was never
+        downloaded before (and the last attempt didn't fail within the
+        refresh interval)
+
+        :return: The RSA public keys by key ID
+        """
+        if self.keys is None:
+            with self.lock:
+                if self.keys is None:
+                    now = time.monotonic()
+                    if (
+                        self.last_failure is not None
+                        and now - self.last_failure < self.refresh_interval
+                    ):
+                        raise InvalidTokenError("The JWKS is unavailable")
+                    self.last_refresh = now
+                    try:
+                        self.keys = self.fetch()
+                    except Exception as e:
+                        self.last_failure = time.monotonic()
+                        raise InvalidTokenError(
+                            f"Failed to fetch the JWKS: {str(e)}"
+                        )
+        return self.keys
+
+    def get_key(self, kid: str) -> rsa.RSAPublicKey:
+        """
+        Get a signing key by its ID
+
+        :param kid: The key ID
+
+        :return: The public key
+        """
+        key = self.load().get(kid)
+        if key is None:
+            self.refresh_in_background()
+            raise InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+
+def verify(
+    token: str,
+    jwks: JWKSClient,
+    issuer: str,
+    audience: str,
+    leeway: float = 0,
+) -> dict[str, Any]:
+    """
+    Verify the signature and the standard claims (exp, iss and aud) of a JWT
+
+    :param token: The JWT
+    :param jwks: The client for the key set used to sign the tokens
+    :param issuer: The expected issuer
+    :param audience: The expected audience
+    :param leeway: Seconds of clock skew tolerated when checking the
+    expiration
+
+    :return: The verified claims
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise InvalidTokenError("Not a JWT")
+    try:
+        header = json.loads(b64url_decode(parts[0]))
+        claims = json.loads(b64url_decode(parts[1]))
+        signature = b64url_decode(parts[2])
+    except (ValueError, binascii.Error):
+        raise InvalidTokenError("Malformed JWT")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise InvalidTokenError("Malformed JWT")
+
+    algorithm = ALGORITHMS.get(header.get("alg", ""))
+    if algorithm is None:
+        raise InvalidTokenError(f"Unsupported algorithm: {header.get('alg')}")
+    key = jwks.get_key(header.get("kid", ""))
+    try:
+        key.verify(
+            signature,
+            f"{parts[0]}.{parts[1]}".encode(),
+            padding.PKCS1v15(),
+            algorithm,
+        )
+    except InvalidSignature:
+        raise InvalidTokenError("Invalid signature")
+
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)) or exp + leeway < time.time():
+        raise InvalidTokenError("Token expired")
+    if claims.get("iss") != issuer:
+        raise InvalidTokenError("Invalid issuer")
+    token_audience = claims.get("aud")
+    if isinstance(token_audience, str):
+        token_audience = [token_audience]
+    if not isinstance(token_audience, list) or audience not in token_audience:
+        raise InvalidTokenError("Invalid audience")
+    return claims
+
+
+_jwks_client: Optional[JWKSClient] = None
+_jwks_client_lock = threading.Lock()
+
+
+def get_jwks_client() -> JWKSClient:
+    """
+    Get the per-process client for Okta's key set
+
+    :return: The JWKS client
+    """
+    global _jwks_client
+    if _jwks_client is None:
+        with _jwks_client_lock:
+            if _jwks_client is None:
+                _jwks_client = JWKSClient(
+                    settings.OKTA["JWT"]["JWKS_URL"],
+                    settings.OKTA["JWT"]["JWKS_REFRESH_INTERVAL"],
+                )
+    return _jwks_client
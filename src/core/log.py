@@ -0,0 +1,221 @@
+"""
+Logging utilities: structured (JSON) records carrying the ID of the request
+and of its user, sampling of debug records, and the configuration of
+the queue handlers writing the records from a background thread.
+
+The pieces are wired together by the LOGGING setting.
+"""
+import atexit
+import json
+import logging
+import logging.config
+import re
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Optional, cast
+
+from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.deprecation import MiddlewareMixin
+
+"""Header with the ID of the request, received from a proxy or generated"""
+REQUEST_ID_HEADER = "X-Request-ID"
+
+"""Request IDs received in the header are only kept if they look safe"""
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+"""Attributes of every log record, which are not extra fields"""
+RECORD_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "request_id", "user_id", "taskName"}
+
+_request_id: ContextVar[Optional[str]] = ContextVar(
+    "request_id", default=None
+)
+_user_id: ContextVar[Optional[int]] = ContextVar("user_id", default=None)
+
+
+def get_request_id() -> Optional[str]:
+    """
+    :return: The ID of the request being processed, or None outside of a
+    request
+    """
+    return _request_id.get()
+
+
+def reset_request_context(**kwargs: Any) -> None:
+    """
+    Stop attaching the IDs of the request to the logs. Connected to
+    request_finished, so the records Django logs after the middlewares
+    (e.g. of the django.request logger) still carry them.
+    """
+    _request_id.set(None)
+    _user_id.set(None)
+
+
+def set_user_id(user_id: Optional[int]) -> None:
+    """
+    Attach the authenticated user to the logs of the current request
+
+    :param user_id: The ID of the user
+    """
+    _user_id.set(user_id)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds the request ID and user ID of the current request to the records
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.user_id = _user_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records at or below a level (debug by
+    default). The decision is made per request, so the debug records of a
+    sampled request are all kept.
+    """
+
+    def __init__(self, rate: float = 1.0, level: str = "DEBUG") -> None:
+        """
+        :param rate: The fraction of records kept, from 0 to 1
+        :param level: The highest level sampled
+        """
+        super().__init__()
+        self.rate = rate
+        self.levelno = logging.getLevelName(level)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.levelno or self.rate >= 1:
+            return True
+        request_id = _request_id.get()
+        if request_id is None:
+            # Outside of requests, records are sampled one by one
+            key = f"{record.name}:{record.lineno}:{record.created}"
+        else:
+            key = request_id
+        return zlib.crc32(key.encode()) / 2 ** 32 < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records as JSON objects, one per line, including the extra
+    fields passed to the logger (e.g. the timings of core.timing)
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(
+                record.created, timezone.utc
+                ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "user_id": getattr(record, "user_id", None),
+        }
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                fields[name] = value
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            fields["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(fields, default=str)
+
+
+"""Listeners of the queue handlers, started by configure_logging"""
+_listeners: list[QueueListener] = []
+
+
+def configure_logging(config: dict[str, Any]) -> None:
+    """
+    Configure logging from the LOGGING setting (it's the LOGGING_CONFIG
+    function). dictConfig builds the listener of each queue handler but
+    doesn't start it, so it's started here, in each worker process when
+    gunicorn doesn't preload the application.
+
+    :param config: The logging configuration, in the dictConfig format
+    """
+    stop_listeners()
+    logging.config.dictConfig(config)
+    for name in logging.getHandlerNames():
+        handler = logging.getHandlerByName(name)
+        if isinstance(handler, QueueHandler) and handler.listener:
+            handler.listener.start()
+            _listeners.append(handler.listener)
+
+
+def stop_listeners() -> None:
+    """
+    Write the records left in the queues and stop the listeners' threads
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_listeners)
+
+
+class RequestContextMiddleware(MiddlewareMixin):
+    """
+    Sets the ID of each request for its logs, and returns it in the
+    X-Request-ID header. It must be the first middleware, so the logs of the
+    others carry the ID.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def process_request(self, request: HttpRequest) -> None:
+        """
+        Set the ID of the request, from the header if there's a valid one
+
+        :param request: The request object
+        """
+        request_id = request.headers.get(REQUEST_ID_HEADER, "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        _request_id.set(request_id)
+        _user_id.set(None)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """
+        Handle a request in async mode. The IDs live in the context of the
+        request's task, so they're set in the event loop instead of in a
+        thread.
+
+        :param request: The request object
+
+        :return: The response object
+        """
+        self.process_request(request)
+        response = await cast(
+            Awaitable[HttpResponse], self.get_response(request)
+            )
+        return self.process_response(request, response)
+
+    def process_response(
+        self,
+        request: HttpRequest,
+        response: HttpResponse
+    ) -> HttpResponse:
+        """
+        Return the ID of the request in the response
+
+        :param request: The request object
+        :param response: The response object
+
+        :return: The response object
+        """
+        request_id = _request_id.get()
+        if request_id is not None:
+            response[REQUEST_ID_HEADER] = request_id
+        return response
@@ -0,0 +1,279 @@
+"""
+Bulk import of users from a CSV or JSONL file.
+
+The rows are read as a stream and normalized like UserManager.create_user.
+They're loaded in chunks with COPY into a temporary staging table, and
+merged into the users table with INSERT ... ON CONFLICT. Only one chunk is
+held in memory at a time.
+"""
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+from typing import Any, Iterator, TextIO, Tuple
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+)
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.models import User
+
+"""Row of the staging table: email, username, first name, last name and
+whether the user is active"""
+StagingRow = Tuple[str, str, str, str, bool]
+
+STAGING_TABLE = "import_users_staging"
+STAGING_COLUMNS = "email, username, first_name, last_name, is_active"
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV or JSONL file (or - for stdin) with the "
+        "fields email, first_name, last_name and is_active. Existing users "
+        "are skipped, or updated with --update. The user cache is bypassed, "
+        "so updated users may be served from it until their entry expires."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("path", help="The file to import, or - for stdin")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="The format of the file (defaults to its extension)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50000,
+            help="Number of rows loaded and merged at a time",
+        )
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Update the names and status of the existing users",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database to import the users into",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        connection = connections[options["database"]]
+        if connection.vendor != "postgresql":
+            raise CommandError("Importing users requires PostgreSQL")
+        if options["batch_size"] <= 0:
+            raise CommandError("The batch size must be positive")
+        file_format = options["format"] or self.get_format(options["path"])
+
+        self.invalid_rows = 0
+        read_rows = 0
+        imported_users = 0
+        started_at = time.monotonic()
+        with self.open(options["path"]) as file:
+            rows = self.normalize(self.read(file, file_format))
+            while True:
+                chunk = list(islice(rows, options["batch_size"]))
+                if not chunk:
+                    break
+                read_rows += len(chunk)
+                imported_users += self.import_chunk(
+                    options["database"], chunk, options["update"]
+                    )
+                elapsed = max(time.monotonic() - started_at, 1e-9)
+                self.stdout.write(
+                    f"{read_rows} rows imported"
+                    f" ({read_rows / elapsed:.0f} rows/s)"
+                )
+
+        elapsed = max(time.monotonic() - started_at, 1e-9)
+        action = "created or updated" if options["update"] else "created"
+        self.stdout.write(self.style.SUCCESS(
+            f"{imported_users} users {action} from {read_rows} rows in"
+            f" {elapsed:.1f}s ({read_rows / elapsed:.0f} rows/s),"
+            f" {self.invalid_rows} invalid rows skipped"
+        ))
+
+    def get_format(self, path: str) -> str:
+        """
+        :param path: The path of the file
+
+        :return: The format of the file, from its extension
+        """
+        if path.endswith(".csv"):
+            return "csv"
+        if path.endswith((".jsonl", ".ndjson")):
+            return "jsonl"
+        raise CommandError("Unknown file format, use --format")
+
+    def open(self, path: str) -> TextIO:
+        """
+        :param path: The path of the file, or - for stdin
+
+        :return: The file, opened for reading
+        """
+        if path == "-":
+            return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+        try:
+            return open(path, encoding="utf-8", newline="")
+        except OSError as e:
+            raise CommandError(f"Can't open {path}: {e}")
+
+    def read(self, file: TextIO, file_format: str) -> Iterator[dict[str, Any]]:
+        """
+        Read the rows of the file one at a time
+
+        :param file: The file
+        :param file_format: csv or jsonl
+
+        :return: The rows, as dictionaries
+        """
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+            return
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                self.invalid_rows += 1
+                continue
+            yield row
+
+    def normalize(
+        self, rows: Iterator[dict[str, Any]]
+    ) -> Iterator[StagingRow]:
+        """
+        Normalize the rows like UserManager.create_user. Invalid rows are
+        skipped.
+
+        :param rows: The rows read from the file
+
+        :return: The rows of the staging table
+        """
+        for row in rows:
+            try:
+                user = User.objects.build_user(
+                    str(row.get("email") or ""),
+                    first_name=str(row.get("first_name") or ""),
+                    last_name=str(row.get("last_name") or ""),
+                    is_active=self.parse_bool(row.get("is_active")),
+                )
+            except ValueError:
+                self.invalid_rows += 1
+                continue
+            yield (
+                user.email,
+                user.username,
+                user.first_name,
+                user.last_name,
+                user.is_active,
+            )
+
+    def parse_bool(self, value: Any) -> bool:
+        """
+        :param value: A boolean from the file (missing means True)
+
+        :return: The boolean
+        """
+        if value is None or value == "":
+            return True
+        if isinstance(value, bool):
+            return value
+        normalized_value = str(value).strip().lower()
+        if normalized_value in ("true", "t", "1", "yes", "y"):
+            return True
+        if normalized_value in ("false", "f", "0", "no", "n"):
+            return False
+        raise ValueError(f"Invalid boolean: {value}")
+
+    def import_chunk(
+        self, database: str, chunk: list[StagingRow], update: bool
+    ) -> int:
+        """
+        Load a chunk of rows into the staging table and merge it into the
+        users table, in a transaction
+
+        :param database: The alias of the database
+        :param chunk: The rows
+        :param update: Whether to update the existing users
+
+        :return: The number of users created (or updated)
+        """
+        connection = connections[database]
+        meta = User._meta
+        table = connection.ops.quote_name(meta.db_table)
+        if update:
+            # DISTINCT ON since a row can't be updated twice by a statement
+            merge = f"""
+                INSERT INTO {table} (
+                    password, is_superuser, email, username, first_name,
+                    last_name, date_joined, is_active
+                )
+                SELECT DISTINCT ON (LOWER(email))
+                    '', FALSE, email, username, first_name, last_name,
+                    NOW(), is_active
+                FROM {STAGING_TABLE}
+                ORDER BY LOWER(email)
+                ON CONFLICT (LOWER(email)) DO UPDATE SET
+                    first_name = EXCLUDED.first_name,
+                    last_name = EXCLUDED.last_name,
+                    is_active = EXCLUDED.is_active
+            """
+        else:
+            merge = f"""
+                INSERT INTO {table} (
+                    password, is_superuser, email, username, first_name,
+                    last_name, date_joined, is_active
+                )
+                SELECT
+                    '', FALSE, email, username, first_name, last_name,
+                    NOW(), is_active
+                FROM {STAGING_TABLE}
+                ON CONFLICT DO NOTHING
+            """
+        with transaction.atomic(using=database):
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (
+                        email TEXT NOT NULL,
+                        username TEXT NOT NULL,
+                        first_name TEXT NOT NULL,
+                        last_name TEXT NOT NULL,
+                        is_active BOOLEAN NOT NULL
+                    ) ON COMMIT DELETE ROWS
+                """)
+                self.copy(cursor.cursor, chunk)
+                cursor.execute(merge)
+                imported_users: int = cursor.rowcount
+        return imported_users
+
+    def copy(self, cursor: Any, chunk: list[StagingRow]) -> None:
+        """
+        Load the rows into the staging table with COPY, with either psycopg
+        3 or psycopg2
+
+        :param cursor: The DB-API cursor
+        :param chunk: The rows
+        """
+        query = f"COPY {STAGING_TABLE} ({STAGING_COLUMNS}) FROM STDIN"
+        if hasattr(cursor, "copy"):
+            # psycopg 3 streams the rows to the server
+            with cursor.copy(query) as copy:
+                for row in chunk:
+                    copy.write_row(row)
+            return
+        buffer = io.StringIO()
+        # Unquoted empty values are NULLs in the CSV format of COPY
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+        writer.writerows(chunk)
+        buffer.seek(0)
+        cursor.copy_expert(f"{query} WITH (FORMAT csv)", buffer)
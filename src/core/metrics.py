@@ -0,0 +1,241 @@
+"""
+Prometheus metrics of the auth and database hot paths.
+
+The metrics are exposed in the text format by metrics_view, which is only
+routed when METRICS_ENABLED is set. Without it, nothing is recorded. Under
+gunicorn each worker process has its own metrics: when
+PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py) they are written to
+files in that directory, and the view aggregates the files of all the
+workers, whichever worker serves the scrape.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, cast
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+OKTA_REQUESTS = Counter(
+    "okta_requests_total",
+    "Calls to Okta, by endpoint and response status",
+    ["endpoint", "status"],
+)
+
+OKTA_REQUEST_DURATION = Histogram(
+    "okta_request_duration_seconds",
+    "Duration of the calls to Okta, retries included",
+    ["endpoint"],
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Lookups in the token and user caches, by result (hit or miss)",
+    ["cache", "result"],
+)
+
+TOKEN_REFRESHES = Counter(
+    "token_refreshes_total",
+    "Token refreshes, by trigger (expired or ahead of expiry)",
+    ["trigger"],
+)
+
+AUTH_FAILURES = Counter(
+    "auth_failures_total",
+    "Requests with credentials that couldn't be authenticated, by reason",
+    ["reason"],
+)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duration of the requests, by URL name, method and status",
+    ["view", "method", "status"],
+)
+
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries made by each request, by URL name",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, float("inf")),
+)
+
+
+def record_okta_request(url: str, status: str, duration: float) -> None:
+    """
+    :param url: The URL of the call to Okta
+    :param status: The status of the response, or "error" if there was no
+    response
+    :param duration: The duration of the call, in seconds
+    """
+    if not settings.METRICS["ENABLED"]:
+        return
+    # The last segment of the path (userinfo, token, keys) keeps the
+    # number of label values bounded
+    endpoint = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1] or "/"
+    OKTA_REQUESTS.labels(endpoint, status).inc()
+    OKTA_REQUEST_DURATION.labels(endpoint).observe(duration)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    :param cache: The name of the cache (token or user)
+    :param hit: Whether the entry was found
+    """
+    if not settings.METRICS["ENABLED"]:
+        return
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_token_refresh(trigger: str) -> None:
+    """
+    :param trigger: Why the tokens were refreshed: expired (Okta rejected
+    the access token) or ahead (it was about to expire)
+    """
+    if not settings.METRICS["ENABLED"]:
+        return
+    TOKEN_REFRESHES.labels(trigger).inc()
+
+
+def record_auth_failure(reason: str) -> None:
+    """
+    :param reason: Why the request couldn't be authenticated
+    """
+    if not settings.METRICS["ENABLED"]:
+        return
+    AUTH_FAILURES.labels(reason).inc()
+
+
+"""Number of queries made by the request being processed"""
+_query_count: ContextVar[Optional[list[int]]] = ContextVar(
+    "query_count", default=None
+)
+
+
+def count_query(
+    execute: Callable[..., Any],
+    sql: str,
+    params: Any,
+    many: bool,
+    context: dict[str, Any],
+) -> Any:
+    """
+    Database execute wrapper counting the queries of the current request
+    """
+    query_count = _query_count.get()
+    if query_count is not None:
+        query_count[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(
+    sender: Any, connection: BaseDatabaseWrapper, **kwargs: Any
+) -> None:
+    """
+    Count the queries made through a database connection. Connected to
+    connection_created, so it covers every connection of every thread.
+    """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Measures the duration and the database queries of each request. It's
+    only used when metrics are enabled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Any) -> None:
+        if not settings.METRICS["ENABLED"]:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def process_request(self, request: HttpRequest) -> None:
+        """
+        Start measuring the request
+
+        :param request: The request object
+        """
+        _query_count.set([0])
+        setattr(request, "_metrics_started_at", time.perf_counter())
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """
+        Handle a request in async mode. The query counter lives in the
+        context of the request's task, so it's set in the event loop
+        instead of in a thread.
+
+        :param request: The request object
+
+        :return: The response object
+        """
+        self.process_request(request)
+        response = await cast(
+            Awaitable[HttpResponse], self.get_response(request)
+            )
+        return self.process_response(request, response)
+
+    def process_response(
+        self,
+        request: HttpRequest,
+        response: HttpResponse
+    ) -> HttpResponse:
+        """
+        Record the duration and the queries of the request
+
+        :param request: The request object
+        :param response: The response object
+
+        :return: The response object
+        """
+        started_at: Optional[float] = getattr(
+            request, "_metrics_started_at", None
+            )
+        query_count = _query_count.get()
+        _query_count.set(None)
+        if started_at is None or query_count is None:
+            return response
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unmatched"
+        REQUEST_DURATION.labels(
+            view, request.method, str(response.status_code)
+            ).observe(time.perf_counter() - started_at)
+        REQUEST_DB_QUERIES.labels(view).observe(query_count[0])
+        return response
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Expose the metrics in the Prometheus text format, aggregated across
+    the worker processes in multiprocess mode
+
+    :param request: The request object
+
+    :return: The metrics
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(  # type: ignore[no-untyped-call]
+            registry
+            )
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+        )
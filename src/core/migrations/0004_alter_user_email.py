@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_user_email_lower_unique"),
+    ]
+
+    operations = [
+        # The unique constraint on LOWER(email) already enforces uniqueness
+        migrations.AlterField(
+            model_name="user",
+            name="email",
+            field=models.EmailField(max_length=255),
+        ),
+    ]
@@ -3,13 +3,32 @@ This file contains the database models for the core app.
 """
 
 from __future__ import annotations
-from django.db import models
+from django.db import (
+    IntegrityError,
+    connections,
+    models,
+    router,
+    transaction,
+)
+from django.db.models.functions import Lower
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
-from typing import Any
+from typing import Any, Tuple
+
+
+def normalize_email(email: str) -> str:
+    """
+    Normalize an email, so that the same address always maps to the same
+    user and cache entry
+
+    :param email: The email
+
+    :return: The normalized email
+    """
+    return email.strip().lower()
 
 
 class UserManager(BaseUserManager['User']):
@@ -17,30 +36,122 @@ class UserManager(BaseUserManager['User']):
 
     def create_user(self, email: str, **extra_fields: dict[str, Any]) -> User:
         """Create, save and return a new user"""
-        lowercased_email = email.lower()
-        email_parts = lowercased_email.split("@")
+        user = self.build_user(email, **extra_fields)
+        user.save(using=self._db)
+        return user
+
+    def build_user(self, email: str, **extra_fields: Any) -> User:
+        """
+        Return a new user, without saving it. The username is the
+        normalized email, so users with the same local part on different
+        domains don't collide.
+        """
+        normalized_email = normalize_email(email)
+        email_parts = normalized_email.split("@")
         if len(email_parts) != 2:
             raise ValueError("Invalid email")
-        username = email_parts[0]
         user: User = self.model(
-            email=lowercased_email,
-            username=username,
+            email=normalized_email,
+            username=normalized_email,
             **extra_fields
             )
-        user.save(using=self._db)
         return user
 
+    def get_or_create_user(self, email: str) -> Tuple[User, bool]:
+        """
+        Get the user with the given email, creating it if it doesn't exist.
+        It's safe to call concurrently for the same email: on PostgreSQL
+        the user is inserted or fetched in a single statement, and other
+        databases fall back to get_or_create inside a savepoint.
+
+        :param email: The email of the user
+
+        :return: The user, and whether it was created
+        """
+        user = self.build_user(email)
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        if connection.vendor != "postgresql":
+            return self.get_or_create_user_in_savepoint(user, db)
+
+        meta = self.model._meta
+        table = connection.ops.quote_name(meta.db_table)
+        email_column = connection.ops.quote_name(
+            meta.get_field("email").column
+            )
+        fields = [
+            field for field in meta.local_fields
+            if field.concrete and not field.primary_key
+        ]
+        columns = ", ".join(
+            connection.ops.quote_name(field.column) for field in fields
+            )
+        values = [
+            field.get_db_prep_save(field.pre_save(user, True), connection)
+            for field in fields
+        ]
+        placeholders = ", ".join(["%s"] * len(values))
+        # When the row already exists the insert returns nothing and the
+        # select finds it. If it's being inserted by a concurrent
+        # transaction, the insert waits for it to commit, but the select
+        # can't see it yet (it uses the snapshot taken when the statement
+        # started), so it's fetched again below.
+        query = f"""
+            WITH inserted AS (
+                INSERT INTO {table} ({columns})
+                VALUES ({placeholders})
+                ON CONFLICT DO NOTHING
+                RETURNING *, TRUE AS created
+            )
+            SELECT * FROM inserted
+            UNION ALL
+            SELECT *, FALSE AS created FROM {table}
+            WHERE LOWER({email_column}) = %s
+            LIMIT 1
+        """
+        found = list(
+            self.raw(query, [*values, user.email]).using(db)
+            )
+        if found:
+            return found[0], bool(getattr(found[0], "created"))
+        return self.using(db).get(email__lower=user.email), False
+
+    def get_or_create_user_in_savepoint(
+        self, user: User, db: str
+    ) -> Tuple[User, bool]:
+        """
+        Save a new user, or get the existing one if it was created
+        concurrently
+
+        :param user: The new user
+        :param db: The alias of the database
+
+        :return: The user, and whether it was created
+        """
+        try:
+            return self.using(db).get(email__lower=user.email), False
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic(using=db):
+                user.save(using=db)
+            return user, True
+        except IntegrityError:
+            return self.using(db).get(email__lower=user.email), False
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     """User in the system"""
 
-    """The email field is unique and comes from the Okta token"""
+    """
+    The email comes from the Okta token. It's unique regardless of the case,
+    through the constraint on its lowercase value in Meta
+    """
     email = models.EmailField(
-        max_length=255,
-        unique=True
+        max_length=255
         )
 
-    """The username is unique and is derived from the email"""
+    """The username is unique. For new users it's the normalized email"""
     username = models.CharField(
         max_length=255,
         unique=True
@@ -52,9 +163,16 @@ class User(AbstractBaseUser, PermissionsMixin):
     """The last name of the user"""
     last_name = models.CharField(max_length=255)
 
-    """When the user last logged in"""
+    """When the user last logged in. It's only set by the login callback"""
     last_login = models.DateTimeField(
-        auto_now=True
+        null=True,
+        blank=True
+        )
+
+    """When the user last made an authenticated request (see core.activity)"""
+    last_seen = models.DateTimeField(
+        null=True,
+        blank=True
         )
 
     """When the user was created"""
@@ -69,3 +187,18 @@ class User(AbstractBaseUser, PermissionsMixin):
     objects = UserManager()
 
     USERNAME_FIELD = "username"
+
+    class Meta:
+        constraints = [
+            # Backs the case-insensitive lookups by email of the auth path.
+            # It makes a plain unique index on the email redundant.
+            models.UniqueConstraint(
+                Lower("email"),
+                name="core_user_email_lower_unique",
+            ),
+        ]
+
+
+# Allow filtering by email__lower, which uses the functional index above.
+# It's registered on this field only, not on every EmailField.
+User._meta.get_field("email").register_lookup(Lower)
@@ -0,0 +1,525 @@
+"""
+Coalescing of concurrent token refreshes.
+
+When an access token expires, every in-flight request carrying it needs a
+new one at the same time. Refreshes are keyed by the digest of the refresh
+token, so that only one of them calls Okta and the others wait for it and
+share its result. With rotating refresh tokens this also prevents the
+requests from invalidating each other's refresh token.
+
+Tokens can also be refreshed in the background shortly before the access
+token expires, when refresh tokens don't rotate (see BackgroundRefresher).
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from cryptography.fernet import InvalidToken
+from django.conf import settings
+from django.core.cache import caches
+
+from core.cache import LocalCache, digest
+from core.crypto import Crypto
+from core.jwt import get_expiration
+
+logger = logging.getLogger(__name__)
+
+"""Access token and refresh token returned by a refresh"""
+Tokens = Tuple[str, str]
+
+"""Seconds between two checks of the shared cache while waiting"""
+POLL_INTERVAL = 0.05
+
+
+class Flight:
+    """
+    A refresh in progress, which other threads can wait for
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Tokens] = None
+        self.error: Optional[BaseException] = None
+
+    def resolve(self, result: Tokens) -> None:
+        self.result = result
+        self.done.set()
+
+    def reject(self, error: BaseException) -> None:
+        self.error = error
+        self.done.set()
+
+    def wait(self, timeout: float) -> Tokens:
+        """
+        Wait for the refresh to finish
+
+        :param timeout: Max number of seconds to wait
+
+        :return: The tokens returned by the refresh
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for a token refresh")
+        if self.error is not None:
+            raise self.error
+        assert self.result is not None
+        return self.result
+
+
+class RefreshCoalescer:
+    """
+    Makes sure that only one refresh per refresh token runs at a time in the
+    process (and optionally across processes, using a lock in the Django
+    cache). The result of a refresh is kept for a short time, so requests
+    that still carry the old refresh token get the new tokens instead of
+    refreshing again.
+
+    The results of background refreshes are kept apart, bound to both the
+    old access token and refresh token, until a request picks them up.
+    """
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        """
+        :param config: The refresh configuration from the settings
+        """
+        self.config = config
+        self.results = LocalCache(config["MAX_SIZE"])
+        self.ahead_results = LocalCache(config["MAX_SIZE"])
+        self.flights: dict[str, Flight] = {}
+        self.async_flights: dict[
+            Tuple[asyncio.AbstractEventLoop, str], asyncio.Future[Tokens]
+        ] = {}
+        self.lock = threading.Lock()
+
+    def refresh(
+        self,
+        refresh_token: str,
+        fetch: Callable[[str], Tokens],
+    ) -> Tokens:
+        """
+        Refresh the tokens, or wait for a concurrent refresh of the same
+        refresh token
+
+        :param refresh_token: The refresh token
+        :param fetch: Function calling Okta to refresh the tokens
+
+        :return: The new access token and refresh token
+        """
+        key = digest(refresh_token)
+        cached: Optional[Tokens] = self.results.get(key)
+        if cached is not None:
+            return cached
+
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = Flight()
+                self.flights[key] = flight
+        if not is_leader:
+            return flight.wait(self.config["LOCK_TIMEOUT"])
+
+        try:
+            if self.config["SHARED"]:
+                result = self.refresh_shared(key, refresh_token, fetch)
+            else:
+                result = fetch(refresh_token)
+            self.results.set(key, result, self.config["RESULT_TTL"])
+            flight.resolve(result)
+            return result
+        except BaseException as e:
+            flight.reject(e)
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    def refresh_shared(
+        self,
+        key: str,
+        refresh_token: str,
+        fetch: Callable[[str], Tokens],
+    ) -> Tokens:
+        """
+        Refresh the tokens holding a lock in the Django cache, so that only
+        one worker refreshes a given refresh token. The other workers wait
+        for the result to be published in the cache. They never refresh
+        without the lock: with rotating refresh tokens, a second refresh of
+        the same token is seen by Okta as a reuse, and revokes the tokens.
+
+        :param key: The digest of the refresh token
+        :param refresh_token: The refresh token
+        :param fetch: Function calling Okta to refresh the tokens
+
+        :return: The new access token and refresh token
+        """
+        cache = caches[self.config["CACHE_ALIAS"]]
+        result_key = f"okta-refresh:{key}"
+        lock_key = f"okta-refresh-lock:{key}"
+        deadline = time.monotonic() + self.config["LOCK_TIMEOUT"]
+        while True:
+            shared_result = self.decode(cache.get(result_key))
+            if shared_result is not None:
+                return shared_result
+            if cache.add(lock_key, 1, self.config["LOCK_TIMEOUT"]):
+                try:
+                    result = fetch(refresh_token)
+                    cache.set(
+                        result_key,
+                        self.encode(result),
+                        self.config["RESULT_TTL"],
+                    )
+                    return result
+                finally:
+                    cache.delete(lock_key)
+            if time.monotonic() > deadline:
+                shared_result = self.decode(cache.get(result_key))
+                if shared_result is not None:
+                    return shared_result
+                raise TimeoutError("Timed out waiting for a token refresh")
+            time.sleep(POLL_INTERVAL)
+
+    async def arefresh(
+        self,
+        refresh_token: str,
+        fetch: Callable[[str], Awaitable[Tokens]],
+    ) -> Tokens:
+        """
+        Async version of refresh
+
+        :param refresh_token: The refresh token
+        :param fetch: Coroutine function calling Okta to refresh the tokens
+
+        :return: The new access token and refresh token
+        """
+        key = digest(refresh_token)
+        cached: Optional[Tokens] = self.results.get(key)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        flight = self.async_flights.get((loop, key))
+        if flight is not None:
+            return await asyncio.wait_for(
+                asyncio.shield(flight), self.config["LOCK_TIMEOUT"]
+            )
+        flight = loop.create_future()
+        self.async_flights[(loop, key)] = flight
+
+        try:
+            if self.config["SHARED"]:
+                result = await self.arefresh_shared(key, refresh_token, fetch)
+            else:
+                result = await fetch(refresh_token)
+            self.results.set(key, result, self.config["RESULT_TTL"])
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Avoid "exception never retrieved" warnings without waiters
+            flight.exception()
+            raise
+        finally:
+            del self.async_flights[(loop, key)]
+
+    async def arefresh_shared(
+        self,
+        key: str,
+        refresh_token: str,
+        fetch: Callable[[str], Awaitable[Tokens]],
+    ) -> Tokens:
+        """
+        Async version of refresh_shared
+
+        :param key: The digest of the refresh token
+        :param refresh_token: The refresh token
+        :param fetch: Coroutine function calling Okta to refresh the tokens
+
+        :return: The new access token and refresh token
+        """
+        cache = caches[self.config["CACHE_ALIAS"]]
+        result_key = f"okta-refresh:{key}"
+        lock_key = f"okta-refresh-lock:{key}"
+        deadline = time.monotonic() + self.config["LOCK_TIMEOUT"]
+        while True:
+            shared_result = self.decode(await cache.aget(result_key))
+            if shared_result is not None:
+                return shared_result
+            if await cache.aadd(lock_key, 1, self.config["LOCK_TIMEOUT"]):
+                try:
+                    result = await fetch(refresh_token)
+                    await cache.aset(
+                        result_key,
+                        self.encode(result),
+                        self.config["RESULT_TTL"],
+                    )
+                    return result
+                finally:
+                    await cache.adelete(lock_key)
+            if time.monotonic() > deadline:
+                shared_result = self.decode(await cache.aget(result_key))
+                if shared_result is not None:
+                    return shared_result
+                raise TimeoutError("Timed out waiting for a token refresh")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def get_ahead_key(self, access_token: str, refresh_token: str) -> str:
+        """
+        :param access_token: The access token that was refreshed
+        :param refresh_token: The refresh token that was used
+
+        :return: The key of the result of a background refresh, so that it's
+        only given to requests carrying both tokens
+        """
+        return digest(f"{access_token}:{refresh_token}")
+
+    def publish_ahead_result(
+        self,
+        access_token: str,
+        refresh_token: str,
+        tokens: Tokens,
+        ttl: float,
+    ) -> None:
+        """
+        Keep the result of a background refresh until the client's next
+        request picks it up
+
+        :param access_token: The access token that was refreshed
+        :param refresh_token: The refresh token that was used
+        :param tokens: The new access token and refresh token
+        :param ttl: Seconds the result is kept
+        """
+        key = self.get_ahead_key(access_token, refresh_token)
+        self.ahead_results.set(key, tokens, ttl)
+        if self.config["SHARED"]:
+            cache = caches[self.config["CACHE_ALIAS"]]
+            cache.set(f"okta-refresh-ahead:{key}", self.encode(tokens), ttl)
+
+    def pop_ahead_result(
+        self, access_token: str, refresh_token: str
+    ) -> Optional[Tokens]:
+        """
+        Get the result of a background refresh of the tokens, and remove
+        it: the request picking it up sends the new tokens to the client
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: The new access token and refresh token, or None
+        """
+        key = self.get_ahead_key(access_token, refresh_token)
+        result: Optional[Tokens] = self.ahead_results.get(key)
+        if result is not None:
+            self.ahead_results.delete(key)
+        if self.config["SHARED"]:
+            cache = caches[self.config["CACHE_ALIAS"]]
+            shared_key = f"okta-refresh-ahead:{key}"
+            if result is None:
+                result = self.decode(cache.get(shared_key))
+            if result is not None:
+                cache.delete(shared_key)
+        return result
+
+    async def apop_ahead_result(
+        self, access_token: str, refresh_token: str
+    ) -> Optional[Tokens]:
+        """
+        Async version of pop_ahead_result
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+
+        :return: The new access token and refresh token, or None
+        """
+        key = self.get_ahead_key(access_token, refresh_token)
+        result: Optional[Tokens] = self.ahead_results.get(key)
+        if result is not None:
+            self.ahead_results.delete(key)
+        if self.config["SHARED"]:
+            cache = caches[self.config["CACHE_ALIAS"]]
+            shared_key = f"okta-refresh-ahead:{key}"
+            if result is None:
+                result = self.decode(await cache.aget(shared_key))
+            if result is not None:
+                await cache.adelete(shared_key)
+        return result
+
+    def encode(self, tokens: Tokens) -> str:
+        """
+        Encrypt the tokens before publishing them in the shared cache
+
+        :param tokens: The access token and refresh token
+
+        :return: The encrypted tokens
+        """
+        return Crypto().encrypt(json.dumps(tokens))
+
+    def decode(self, value: Optional[str]) -> Optional[Tokens]:
+        """
+        Decrypt the tokens published in the shared cache. Entries encrypted
+        with a key that was since removed are ignored.
+
+        :param value: The encrypted tokens, if any
+
+        :return: The access token and refresh token, or None
+        """
+        if value is None:
+            return None
+        try:
+            decrypted = Crypto().decrypt(value)
+        except InvalidToken:
+            return None
+        access_token, refresh_token = json.loads(decrypted)
+        return access_token, refresh_token
+
+
+class BackgroundRefresher:
+    """
+    Refreshes tokens shortly before the access token expires, in a pool of
+    worker threads, so that requests don't have to wait for Okta to reject
+    the token and then for the refresh. The new tokens are picked up from
+    the coalescer by the next request carrying the old tokens.
+
+    It's only enabled when refresh tokens don't rotate. With rotation, the
+    refresh would use up the client's refresh token, and its result would
+    have to be kept until the client comes back, whenever that is: anyone
+    replaying the old cookie meanwhile would get fresh tokens. Without
+    rotation the old tokens stay valid, so the result is only kept while the
+    old access token is, and a client coming back later refreshes as usual.
+    """
+
+    def __init__(
+        self, coalescer: RefreshCoalescer, config: dict[str, Any]
+    ) -> None:
+        """
+        :param coalescer: The coalescer running the refreshes
+        :param config: The refresh configuration from the settings
+        """
+        self.coalescer = coalescer
+        self.window: float = config["AHEAD_WINDOW"]
+        if self.window > 0 and config["ROTATION"]:
+            logger.warning(
+                "Background token refresh is disabled: it requires refresh "
+                "tokens that don't rotate (OKTA_REFRESH_TOKEN_ROTATION)"
+            )
+            self.window = 0
+        # Until the old access token has expired, plus the grace period of
+        # all refresh results
+        self.ttl: float = self.window + config["RESULT_TTL"]
+        self.executor = ThreadPoolExecutor(
+            max_workers=config["WORKERS"],
+            thread_name_prefix="token-refresh",
+        )
+        self.pending: set[str] = set()
+        self.lock = threading.Lock()
+
+    def is_due(self, access_token: str) -> bool:
+        """
+        Check whether the access token expires within the refresh window
+
+        :param access_token: The access token
+
+        :return: Whether it should be refreshed now
+        """
+        if self.window <= 0:
+            return False
+        expiration = get_expiration(access_token)
+        if expiration is None:
+            return False
+        return expiration - time.time() <= self.window
+
+    def schedule(
+        self,
+        access_token: str,
+        refresh_token: str,
+        fetch: Callable[[str], Tokens],
+    ) -> bool:
+        """
+        Start a background refresh if the access token is about to expire
+
+        :param access_token: The access token
+        :param refresh_token: The refresh token
+        :param fetch: Function calling Okta to refresh the tokens
+
+        :return: Whether a refresh was scheduled
+        """
+        if not self.is_due(access_token):
+            return False
+        key = digest(refresh_token)
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+        self.executor.submit(
+            self.run, key, access_token, refresh_token, fetch
+            )
+        return True
+
+    def run(
+        self,
+        key: str,
+        access_token: str,
+        refresh_token: str,
+        fetch: Callable[[str], Tokens],
+    ) -> None:
+        """
+        Refresh the tokens and keep the result for the client's next request
+
+        :param key: The digest of the refresh token
+        :param access_token: The access token about to expire
+        :param refresh_token: The refresh token
+        :param fetch: Function calling Okta to refresh the tokens
+        """
+        try:
+            tokens = self.coalescer.refresh(refresh_token, fetch)
+            self.coalescer.publish_ahead_result(
+                access_token, refresh_token, tokens, self.ttl
+                )
+        except Exception as e:
+            logger.warning("Background token refresh failed: %s", str(e))
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+
+_coalescer: Optional[RefreshCoalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_refresh_coalescer() -> RefreshCoalescer:
+    """
+    Get the per-process refresh coalescer
+
+    :return: The refresh coalescer
+    """
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = RefreshCoalescer(settings.OKTA["REFRESH"])
+    return _coalescer
+
+
+_refresher: Optional[BackgroundRefresher] = None
+
+
+def get_background_refresher() -> BackgroundRefresher:
+    """
+    Get the per-process background refresher
+
+    :return: The background refresher
+    """
+    global _refresher
+    if _refresher is None:
+        with _coalescer_lock:
+            if _refresher is None:
+                _refresher = BackgroundRefresher(
+                    get_refresh_coalescer(), settings.OKTA["REFRESH"]
+                )
+    return _refresher
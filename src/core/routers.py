@@ -0,0 +1,77 @@
+"""
+Database routing between the primary database and the optional read
+replica.
+
+Reads of the models of the replicated apps (the user lookups of the auth
+path) go to the replica. Once a request writes to the primary, its reads
+stick to the primary until the end of the request, so it never reads data
+older than what it just wrote, whatever the replication lag.
+"""
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Model
+
+PRIMARY = "default"
+REPLICA = "replica"
+
+"""Apps whose models are read from the replica"""
+REPLICATED_APPS = {"core"}
+
+_pinned_to_primary: ContextVar[bool] = ContextVar(
+    "pinned_to_primary", default=False
+)
+
+
+def pin_to_primary() -> None:
+    """
+    Send the reads of the current request (or thread) to the primary
+    """
+    _pinned_to_primary.set(True)
+
+
+def reset_pin(**kwargs: Any) -> None:
+    """
+    Send the reads to the replica again. Connected to request_started, so
+    every request starts unpinned.
+    """
+    _pinned_to_primary.set(False)
+
+
+def is_pinned_to_primary() -> bool:
+    """
+    :return: Whether the reads go to the primary
+    """
+    return _pinned_to_primary.get()
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of the replicated apps to the replica, and everything
+    else to the primary
+    """
+
+    def db_for_read(self, model: type[Model], **hints: Any) -> Optional[str]:
+        if REPLICA not in settings.DATABASES:
+            return PRIMARY
+        if model._meta.app_label not in REPLICATED_APPS:
+            return PRIMARY
+        if is_pinned_to_primary() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return REPLICA
+
+    def db_for_write(self, model: type[Model], **hints: Any) -> Optional[str]:
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1: Model, obj2: Model, **hints: Any) -> bool:
+        # Both databases hold the same data
+        return True
+
+    def allow_migrate(
+        self, db: str, app_label: str, **hints: Any
+    ) -> bool:
+        # The replica gets its schema from the primary
+        return db == PRIMARY
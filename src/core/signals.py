@@ -0,0 +1,51 @@
+"""
+Signal handlers of the core app
+"""
+from typing import Any
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.cache import get_user_cache
+from core.log import reset_request_context
+from core.metrics import install_query_counter
+from core.models import User, normalize_email
+from core.routers import reset_pin
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(
+    sender: type[User], instance: User, **kwargs: Any
+) -> None:
+    """
+    Remove a user from the user cache when it's saved or deleted. The entry
+    is removed again once the transaction is committed, in case another
+    request cached the old row in the meantime.
+
+    Updates that don't send signals (e.g. QuerySet.update) are only seen
+    once the entry expires.
+    """
+    if not instance.email:
+        return
+    key = normalize_email(instance.email)
+    cache = get_user_cache()
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+request_started.connect(reset_pin, dispatch_uid="core.routers.reset_pin")
+request_finished.connect(
+    reset_request_context,
+    dispatch_uid="core.log.reset_request_context",
+    )
+
+if settings.METRICS["ENABLED"]:
+    connection_created.connect(
+        install_query_counter,
+        dispatch_uid="core.metrics.install_query_counter",
+        )
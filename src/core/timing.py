@@ -0,0 +1,183 @@
+"""
+Per-request timing of the stages of the auth pipeline.
+
+The TimingMiddleware collects the spans of each request (cookie decoding,
+calls to Okta, user lookup, etc.) in a context variable, so any code run
+by the request can add spans without having access to the request. When
+the request is done, the spans are logged as structured fields and,
+optionally, sent back in a Server-Timing header.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, cast
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+"""Name of the span covering the whole request"""
+TOTAL_SPAN = "total"
+
+
+class Timings:
+    """
+    Spans of a request. Spans with the same name (e.g. two calls to Okta)
+    are added up.
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        # Name of each span, with its total duration and number of calls
+        self.spans: dict[str, list[float]] = {}
+
+    def add(self, name: str, duration: float) -> None:
+        """
+        :param name: The name of the span
+        :param duration: The duration of the span, in seconds
+        """
+        span = self.spans.setdefault(name, [0.0, 0])
+        span[0] += duration
+        span[1] += 1
+
+    def finish(self) -> float:
+        """
+        Add the span covering the whole request
+
+        :return: The duration of the request, in seconds
+        """
+        duration = time.perf_counter() - self.started_at
+        self.spans[TOTAL_SPAN] = [duration, 1]
+        return duration
+
+    def as_header(self) -> str:
+        """
+        :return: The spans, as the value of a Server-Timing header
+        """
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}"
+            for name, (duration, _) in self.spans.items()
+            )
+
+    def as_fields(self) -> dict[str, float]:
+        """
+        :return: The duration of each span, in milliseconds
+        """
+        return {
+            name: round(duration * 1000, 1)
+            for name, (duration, _) in self.spans.items()
+        }
+
+
+_current_timings: ContextVar[Optional[Timings]] = ContextVar(
+    "current_timings", default=None
+)
+
+
+def get_current_timings() -> Optional[Timings]:
+    """
+    :return: The spans of the request being processed, or None outside of
+    a request (e.g. in background threads) or when timing is disabled
+    """
+    return _current_timings.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time the code run in the block as a span of the current request. It
+    does nothing outside of a request.
+
+    :param name: The name of the span. It must be a valid Server-Timing
+    metric name (no spaces)
+    """
+    timings = get_current_timings()
+    if timings is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started_at)
+
+
+class TimingMiddleware(MiddlewareMixin):
+    """
+    Collects the spans of each request, and reports them once the response
+    is ready. It must be the first middleware, so the spans of the others
+    are included in the request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def process_request(self, request: HttpRequest) -> None:
+        """
+        Start collecting the spans of the request
+
+        :param request: The request object
+        """
+        if settings.REQUEST_TIMING["ENABLED"]:
+            _current_timings.set(Timings())
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """
+        Handle a request in async mode. The spans are collected in the
+        context of the request's task, so it's done in the event loop
+        instead of in a thread.
+
+        :param request: The request object
+
+        :return: The response object
+        """
+        self.process_request(request)
+        response = await cast(
+            Awaitable[HttpResponse], self.get_response(request)
+            )
+        return self.process_response(request, response)
+
+    def process_response(
+        self,
+        request: HttpRequest,
+        response: HttpResponse
+    ) -> HttpResponse:
+        """
+        Log the spans of the request, and set them in the Server-Timing
+        header if enabled
+
+        :param request: The request object
+        :param response: The response object
+
+        :return: The response object
+        """
+        timings = get_current_timings()
+        if timings is None:
+            return response
+        _current_timings.set(None)
+        duration = timings.finish()
+        config = settings.REQUEST_TIMING
+        if config["HEADER"]:
+            response["Server-Timing"] = timings.as_header()
+            origin = request.headers.get("Origin")
+            if origin and origin in settings.CORS_ALLOWED_ORIGINS:
+                # Let the front end read the timings of cross-origin calls
+                response["Timing-Allow-Origin"] = origin
+        if duration >= config["LOG_THRESHOLD"]:
+            logger.info(
+                "%s %s took %.1fms",
+                request.method,
+                request.path,
+                duration * 1000,
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "status_code": response.status_code,
+                    "timings": timings.as_fields(),
+                },
+            )
+        return response
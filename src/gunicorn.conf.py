@@ -0,0 +1,56 @@
+"""
+Gunicorn configuration, loaded from the working directory on start.
+
+When METRICS_ENABLED is set, the Prometheus metrics of each worker process
+are kept in files of PROMETHEUS_MULTIPROC_DIR, so the metrics endpoint can
+aggregate all the workers (see core.metrics). The variable is set here,
+before the workers are forked and import the application. Without metrics,
+the directory is neither set nor touched.
+"""
+import os
+import shutil
+import tempfile
+from typing import Any
+
+import environ  # type: ignore
+from prometheus_client import multiprocess
+
+env = environ.Env(
+    METRICS_ENABLED=(bool, False),  # Whether to collect Prometheus metrics
+)
+
+# The same .env file as the application settings
+environ.Env.read_env(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+)
+
+"""Whether the workers collect metrics, as in the application settings"""
+METRICS_ENABLED: bool = env.bool("METRICS_ENABLED")
+
+if METRICS_ENABLED:
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR",
+        os.path.join(tempfile.gettempdir(), "prometheus"),
+    )
+
+
+def on_starting(server: Any) -> None:
+    """
+    Remove the metrics left by a previous run of the server
+    """
+    if not METRICS_ENABLED:
+        return
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    """
+    Discard the live metrics of a worker that exited
+    """
+    if not METRICS_ENABLED:
+        return
+    multiprocess.mark_process_dead(  # type: ignore[no-untyped-call]
+        worker.pid
+        )
@@ -1,10 +1,14 @@
 """
 Serializers for the User API view
 """
+import copy
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
-from core.models import User
-from typing import Any
+from core.cache import get_user_cache
+from core.metrics import record_cache_lookup
+from core.models import User, normalize_email
+from typing import Any, Optional
 
 
 class UserSerializer(serializers.ModelSerializer[User]):
@@ -26,12 +30,31 @@ class UserSerializer(serializers.ModelSerializer[User]):
         return get_user_model().objects.create_user(**validated_data)
 
     def find_by_email(self, email: str) -> User:
-        """Find a user by email"""
-        email_parts = email.lower().split("@")
-        if len(email_parts) != 2:
-            raise ValueError("Invalid email")
-        username = email_parts[0]
-        return get_user_model().objects.get(username=username)
+        """
+        Find a user by email. Users are read through the user cache, which
+        is invalidated when a user is saved or deleted (see core.signals).
+        The returned user is a copy, so changing it doesn't change the
+        cached user.
+        """
+        key = normalize_email(email)
+        cache = get_user_cache()
+        user: Optional[User] = cache.get(key)
+        record_cache_lookup("user", user is not None)
+        if user is None:
+            user = get_user_model().objects.get(email__lower=key)
+            cache.set(key, user, settings.USER_CACHE["TTL"])
+        return copy.copy(user)
+
+    async def afind_by_email(self, email: str) -> User:
+        """Find a user by email, from async code"""
+        key = normalize_email(email)
+        cache = get_user_cache()
+        user: Optional[User] = await cache.aget(key)
+        record_cache_lookup("user", user is not None)
+        if user is None:
+            user = await get_user_model().objects.aget(email__lower=key)
+            await cache.aset(key, user, settings.USER_CACHE["TTL"])
+        return copy.copy(user)
 
     def to_dict(self, user: User) -> dict[str, Any]:
         """Return a dictionary representation of the user"""
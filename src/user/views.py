@@ -1,5 +1,8 @@
+import logging
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
 from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.views import View
@@ -10,6 +13,8 @@ from .serializers import UserSerializer
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 
 class LoginView(View):
 
@@ -23,16 +28,14 @@ class LoginView(View):
             token_manager = TokenManager()
             at, rt = token_manager.get_tokens_from_provider(code)
             email, at, rt = token_manager.authenticate(at, rt)
-            try:
-                self.serializer.find_by_email(email)
-            except User.DoesNotExist:
-                self.serializer.create({"email": email})
+            user, _ = User.objects.get_or_create_user(email)
+            update_last_login(User, user)
 
             response = redirect(f"{settings.FRONT_END_URL}/profiles")
             token_manager.set_credentials_as_cookie(response, at, rt)
             return response
         except Exception as e:
-            print(e)
+            logger.warning("Login failed: %s", e)
             return redirect(f"{settings.FRONT_END_URL}/error")
 
 
@@ -41,10 +44,11 @@ class CurrentUserView(View):
 
     def get(self, request: HttpRequest) -> HttpResponse:
         try:
-            if not request.user.is_authenticated:
+            # The user was already loaded by the authentication middleware,
+            # so it's serialized as is instead of being queried again
+            user = request.user
+            if not isinstance(user, User) or not user.is_authenticated:
                 return JsonResponse({"error": "Not authenticated"}, status=401)
-            email = request.user.email
-            user = self.serializer.find_by_email(email)
             return JsonResponse({"user": self.serializer.to_dict(user)})
         except Exception as e:
             json_error = {"error": str(e)}
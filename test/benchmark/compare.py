@@ -0,0 +1,96 @@
+"""
+Compare the results of two benchmark runs, e.g. of two commits:
+
+    python -m test.benchmark.compare base.json head.json
+
+It exits with status 1 if the p95 latency of any benchmark regressed by
+more than the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Optional
+
+"""Metrics compared between the runs"""
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput"]
+
+
+def load(path: str) -> dict[str, Any]:
+    """
+    :param path: The path of the results of a run
+
+    :return: The results
+    """
+    with open(path) as file:
+        report: dict[str, Any] = json.load(file)
+    return report
+
+
+def get_change(base: float, head: float) -> Optional[float]:
+    """
+    :param base: The value of the base run
+    :param head: The value of the new run
+
+    :return: The relative change, in percent, or None if the base is zero
+    """
+    if base == 0:
+        return None
+    return (head - base) / base * 100
+
+
+def compare(
+        base: dict[str, Any],
+        head: dict[str, Any],
+        threshold: float,
+        ) -> list[str]:
+    """
+    Print the changes of each benchmark found in both runs
+
+    :param base: The results of the base run
+    :param head: The results of the new run
+    :param threshold: Max increase of the p95 latency, in percent
+
+    :return: The benchmarks whose p95 latency regressed
+    """
+    regressions = []
+    print(f"base: {base.get('commit')}  head: {head.get('commit')}")
+    for name, head_result in head["results"].items():
+        base_result = base["results"].get(name)
+        if base_result is None:
+            print(f"{name}: new benchmark")
+            continue
+        changes = []
+        for metric in METRICS:
+            change = get_change(base_result[metric], head_result[metric])
+            formatted_change = "n/a" if change is None else f"{change:+.1f}%"
+            changes.append(
+                f"{metric} {base_result[metric]} -> {head_result[metric]}"
+                f" ({formatted_change})"
+            )
+        print(f"{name}: " + ", ".join(changes))
+        p95_change = get_change(base_result["p95_ms"], head_result["p95_ms"])
+        if p95_change is not None and p95_change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base", help="Results of the base run")
+    parser.add_argument("head", help="Results of the new run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Max increase of the p95 latency, in percent",
+    )
+    args = parser.parse_args()
+    regressions = compare(load(args.base), load(args.head), args.threshold)
+    if regressions:
+        print(f"p95 regressed by more than {args.threshold}%: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
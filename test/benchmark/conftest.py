@@ -0,0 +1,45 @@
+import json
+import platform
+import subprocess
+import time
+from typing import Any, Iterator, Optional
+
+import pytest
+
+
+def get_commit() -> Optional[str]:
+    """
+    :return: The commit being benchmarked, if it's run from a git checkout
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(
+    request: pytest.FixtureRequest,
+) -> Iterator[dict[str, Any]]:
+    """
+    Collect the results of the benchmarks, and write them as JSON when the
+    session ends, so runs can be compared across commits (see compare.py)
+    """
+    results: dict[str, Any] = {}
+    yield results
+    report = {
+        "commit": get_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "okta_latency_ms": request.config.getoption("--okta-latency"),
+        "okta_scenario": request.config.getoption("--okta-scenario"),
+        "results": results,
+    }
+    path = request.config.getoption("--benchmark-json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
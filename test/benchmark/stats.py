@@ -0,0 +1,95 @@
+"""
+Measurement of latencies and throughput for the benchmarks
+"""
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+def summarize(
+        latencies: list[float],
+        elapsed: float,
+        errors: int = 0,
+        concurrency: int = 1,
+        ) -> dict[str, Any]:
+    """
+    Summarize the latencies of a benchmark
+
+    :param latencies: The latency of each call, in seconds
+    :param elapsed: The wall-clock duration of the benchmark, in seconds
+    :param errors: The number of failed calls
+    :param concurrency: The number of concurrent callers
+
+    :return: The percentiles and mean in milliseconds, and the throughput in
+    calls per second
+    """
+    if len(latencies) < 2:
+        raise ValueError("At least two calls are needed to get percentiles")
+    # 99 cut points: the percentile n is at index n - 1
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "p50_ms": round(cut_points[49] * 1000, 3),
+        "p95_ms": round(cut_points[94] * 1000, 3),
+        "p99_ms": round(cut_points[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+    }
+
+
+def measure(
+        call: Callable[[], Any],
+        iterations: int,
+        warmup: int = 100,
+        ) -> dict[str, Any]:
+    """
+    Benchmark a function by calling it repeatedly in the current thread
+
+    :param call: The function to benchmark
+    :param iterations: The number of measured calls
+    :param warmup: The number of calls made before measuring
+
+    :return: The summary of the latencies
+    """
+    for _ in range(warmup):
+        call()
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        call_started_at = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_started_at)
+    elapsed = time.perf_counter() - started_at
+    return summarize(latencies, elapsed)
+
+
+def measure_concurrently(
+        call: Callable[[int], bool],
+        requests: int,
+        concurrency: int,
+        ) -> dict[str, Any]:
+    """
+    Benchmark a request by making it from a fixed number of threads
+
+    :param call: The function making the request. It gets the number of
+    the request, and returns whether it succeeded
+    :param requests: The total number of requests
+    :param concurrency: The number of threads making requests
+
+    :return: The summary of the latencies
+    """
+    def timed_call(index: int) -> tuple[float, bool]:
+        started_at = time.perf_counter()
+        succeeded = call(index)
+        return time.perf_counter() - started_at, succeeded
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(requests)))
+    elapsed = time.perf_counter() - started_at
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, succeeded in results if not succeeded)
+    return summarize(latencies, elapsed, errors, concurrency)
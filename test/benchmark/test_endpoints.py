@@ -0,0 +1,164 @@
+"""
+Benchmarks of the endpoints of the auth path, driven at a fixed concurrency
+against the API container. Okta is replaced by MockServer, which waits
+--okta-latency milliseconds before each response, or follows the latencies
+and failures of --okta-scenario (see test/okta.py).
+"""
+import json
+import uuid
+from typing import Any, Callable
+
+import pytest
+
+from ..factories.user import user_factory
+from ..okta import OKTA_ENDPOINTS, load_scenario
+from ..utils import Helper
+from .stats import measure_concurrently
+
+"""Requests made before measuring, e.g. to open the DB connections"""
+WARMUP_REQUESTS = 20
+
+EMAIL = "benchmark.user@email.net"
+
+
+def run(
+        request: pytest.FixtureRequest,
+        call: Callable[[int], bool],
+        ) -> dict[str, Any]:
+    """
+    Warm up the endpoint and benchmark it with the configured number of
+    requests and concurrency
+
+    :param request: The pytest request, with the benchmark options
+    :param call: The function making a request
+
+    :return: The summary of the latencies
+    """
+    concurrency = request.config.getoption("--benchmark-concurrency")
+    for index in range(WARMUP_REQUESTS):
+        call(-index - 1)
+    return measure_concurrently(
+        call,
+        request.config.getoption("--benchmark-requests"),
+        concurrency,
+    )
+
+
+@pytest.fixture
+def mock_okta(
+    tests_helper: Helper, request: pytest.FixtureRequest
+) -> Callable[[dict[str, Any]], None]:
+    """
+    :return: A function mocking the endpoints of Okta, given the body of
+    their successful responses, with the configured latency or scenario
+    """
+    def mock(response_bodies: dict[str, Any]) -> None:
+        scenario_path = request.config.getoption("--okta-scenario")
+        if scenario_path is not None:
+            tests_helper.mock_okta_scenario(
+                load_scenario(scenario_path), response_bodies
+                )
+            return
+        for endpoint, response_body in response_bodies.items():
+            path, method = OKTA_ENDPOINTS[endpoint]
+            tests_helper.mock_response(
+                request_path=path,
+                request_method=method,
+                response_body=response_body,
+                delay=request.config.getoption("--okta-latency"),
+            )
+
+    return mock
+
+
+def test_current_user_without_okta(
+    tests_helper: Helper,
+    request: pytest.FixtureRequest,
+    benchmark_results: dict[str, Any],
+) -> None:
+    """
+    Benchmark the current user endpoint with mock tokens, which are not
+    verified with Okta: it measures the overhead of the application itself
+    """
+    tests_helper.insert_user(user_factory({"email": EMAIL}))
+
+    def call(index: int) -> bool:
+        response = tests_helper.get_request(
+            "/users/me", authenticated_as=EMAIL
+            )
+        return response.status_code == 200
+
+    benchmark_results["users_me_mock_token"] = run(request, call)
+
+
+def test_current_user_with_cached_token(
+    tests_helper: Helper,
+    request: pytest.FixtureRequest,
+    benchmark_results: dict[str, Any],
+    mock_okta: Callable[[dict[str, Any]], None],
+) -> None:
+    """
+    Benchmark the current user endpoint with the same opaque token, which is
+    only verified with Okta once and then read from the token cache
+    """
+    tests_helper.insert_user(user_factory({"email": EMAIL}))
+    mock_okta({"userinfo": {"email": EMAIL}})
+    access_token = f"opaque-{uuid.uuid4()}"
+
+    def call(index: int) -> bool:
+        response = tests_helper.get_request(
+            "/users/me", access_token=access_token
+            )
+        return response.status_code == 200
+
+    benchmark_results["users_me_cached_token"] = run(request, call)
+
+
+def test_current_user_with_okta(
+    tests_helper: Helper,
+    request: pytest.FixtureRequest,
+    benchmark_results: dict[str, Any],
+    mock_okta: Callable[[dict[str, Any]], None],
+) -> None:
+    """
+    Benchmark the current user endpoint with a new opaque token on every
+    request, so each of them calls Okta's userinfo endpoint
+    """
+    tests_helper.insert_user(user_factory({"email": EMAIL}))
+    mock_okta({"userinfo": {"email": EMAIL}})
+    run_id = uuid.uuid4()
+
+    def call(index: int) -> bool:
+        response = tests_helper.get_request(
+            "/users/me", access_token=f"opaque-{run_id}-{index}"
+            )
+        return response.status_code == 200
+
+    benchmark_results["users_me_userinfo"] = run(request, call)
+
+
+def test_login_callback(
+    tests_helper: Helper,
+    request: pytest.FixtureRequest,
+    benchmark_results: dict[str, Any],
+    mock_okta: Callable[[dict[str, Any]], None],
+) -> None:
+    """
+    Benchmark the login callback: exchanging the code for tokens, getting
+    or creating the user and setting the credentials cookie
+    """
+    mock_okta({"token": {
+        "access_token": json.dumps({"sub": EMAIL}),
+        "refresh_token": "benchmark-refresh-token",
+    }})
+
+    def call(index: int) -> bool:
+        response = tests_helper.get_request(
+            f"/users/login-callback?code=benchmark-{index}"
+            )
+        return (
+            response.status_code == 302
+            and response.headers["Location"].endswith("/profiles")
+        )
+
+    benchmark_results["login_callback"] = run(request, call)
@@ -0,0 +1,103 @@
+"""
+Micro-benchmarks of the building blocks of the auth path, run in the test
+process. The application is imported inside the tests, once the django_app
+fixture has set it up.
+"""
+from typing import Any
+
+import pytest
+
+from ..factories.token import jwt_factory
+from .stats import measure
+
+"""Number of measured calls of each micro-benchmark"""
+ITERATIONS = 5000
+
+"""Refresh token with the length of the ones issued by Okta"""
+REFRESH_TOKEN = "r" * 43
+
+
+@pytest.mark.usefixtures("django_app")
+def test_crypto(benchmark_results: dict[str, Any]) -> None:
+    """
+    Benchmark the encryption and decryption of the credentials with Fernet
+    """
+    from core.crypto import Crypto
+
+    crypto = Crypto()
+    credentials = f'{{"access_token": "{jwt_factory({})}"}}'
+    encrypted = crypto.encrypt(credentials)
+    benchmark_results["crypto_encrypt"] = measure(
+        lambda: crypto.encrypt(credentials), ITERATIONS
+    )
+    benchmark_results["crypto_decrypt"] = measure(
+        lambda: crypto.decrypt(encrypted), ITERATIONS
+    )
+
+
+@pytest.mark.parametrize("cookie_format", ["compact", "json"])
+@pytest.mark.usefixtures("django_app")
+def test_get_tokens_from_cookie(
+    benchmark_results: dict[str, Any], cookie_format: str
+) -> None:
+    """
+    Benchmark reading the tokens from the credentials cookie
+    """
+    from django.conf import settings
+    from django.test import RequestFactory, override_settings
+
+    from core import cookie
+    from core.auth import TokenManager
+
+    config = {**settings.AUTH_COOKIE_CONFIG, "FORMAT": cookie_format}
+    with override_settings(AUTH_COOKIE_CONFIG=config):
+        value = cookie.encode(jwt_factory({}), REFRESH_TOKEN)
+        request = RequestFactory().get("/users/me")
+        request.COOKIES[config["NAME"]] = value
+        token_manager = TokenManager()
+        result = measure(
+            lambda: token_manager.get_tokens_from_request(request),
+            ITERATIONS,
+        )
+    result["cookie_bytes"] = len(value)
+    benchmark_results[f"get_tokens_from_cookie_{cookie_format}"] = result
+
+
+@pytest.mark.usefixtures("django_app")
+def test_get_tokens_from_header(benchmark_results: dict[str, Any]) -> None:
+    """
+    Benchmark reading the access token from the Authorization header
+    """
+    from django.test import RequestFactory
+
+    from core.auth import TokenManager
+
+    request = RequestFactory().get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {jwt_factory({})}"},
+    )
+    token_manager = TokenManager()
+    benchmark_results["get_tokens_from_header"] = measure(
+        lambda: token_manager.get_tokens_from_request(request), ITERATIONS
+    )
+
+
+@pytest.mark.usefixtures("django_app")
+def test_user_to_dict(benchmark_results: dict[str, Any]) -> None:
+    """
+    Benchmark the serialization of the current user
+    """
+    from core.models import User
+    from user.serializers import UserSerializer
+
+    user = User(
+        id=1,
+        email="fake-user@email.net",
+        username="fake-user@email.net",
+        first_name="Fake",
+        last_name="User",
+    )
+    serializer = UserSerializer()
+    benchmark_results["user_to_dict"] = measure(
+        lambda: serializer.to_dict(user), ITERATIONS
+    )
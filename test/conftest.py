@@ -1,5 +1,7 @@
 import logging
 import os
+import sys
+from pathlib import Path
 
 import docker
 import pytest
@@ -13,6 +15,63 @@ from .utils import Helper
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+"""Directory of the application, imported by the in-process tests"""
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """
+    Options of the benchmarks, which only run with --benchmark
+    """
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="Run the benchmarks in test/benchmark",
+    )
+    group.addoption(
+        "--benchmark-json",
+        default="benchmark.json",
+        help="File where the results of the benchmarks are written",
+    )
+    group.addoption(
+        "--benchmark-requests",
+        type=int,
+        default=500,
+        help="Number of requests made by each endpoint benchmark",
+    )
+    group.addoption(
+        "--benchmark-concurrency",
+        type=int,
+        default=10,
+        help="Number of concurrent clients of the endpoint benchmarks",
+    )
+    group.addoption(
+        "--okta-latency",
+        type=int,
+        default=50,
+        help="Milliseconds the Okta stand-in waits before responding",
+    )
+    group.addoption(
+        "--okta-scenario",
+        help="JSON scenario of latencies and failures of the Okta stand-in,"
+        " instead of --okta-latency (see test/okta.py)",
+    )
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: list[pytest.Item]
+) -> None:
+    """
+    Skip the benchmarks unless --benchmark is given
+    """
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="Benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.path.parts:
+            item.add_marker(skip)
+
 
 @pytest.fixture(scope="session", autouse=True)
 def tests_helper(request: pytest.FixtureRequest) -> Helper:
@@ -64,6 +123,9 @@ def tests_helper(request: pytest.FixtureRequest) -> Helper:
         logger.info("Starting PostgreSQL container")
         db_container = (
             DockerContainer(image="postgres:17-alpine")
+            .with_command(
+                "postgres -c shared_preload_libraries=pg_stat_statements"
+                )
             .with_exposed_ports(5432)
             .with_env("POSTGRES_DB", "test")
             .with_env("POSTGRES_USER", "test")
@@ -97,24 +159,34 @@ def tests_helper(request: pytest.FixtureRequest) -> Helper:
         api_container = (
             DockerContainer(image=image.id)
             .with_exposed_ports(8000)
+            .with_env("ACTIVITY_TRACKING_FLUSH_INTERVAL", "1")
+            .with_env("ALLOWED_ORIGINS", static.FRONT_END_URL)
+            .with_env("CACHE_URL", "filecache:///var/cache/django")
+            .with_env("DB_CONN_HEALTH_CHECKS", "True")
+            .with_env("DB_CONN_MAX_AGE", "60")
             .with_env("DB_HOST", "db")
             .with_env("DB_NAME", "test")
             .with_env("DB_PASSWORD", "test")
             .with_env("DB_PORT", "5432")
+            .with_env("DB_REPLICA_HOST", "db")
             .with_env("DB_USER", "test")
             .with_env("DEBUG", "True")
             .with_env("DJANGO_SECRET_KEY", "test")
             .with_env("FRONT_END_URL", static.FRONT_END_URL)
+            .with_env("METRICS_ENABLED", "True")
             .with_env("MOCK_AUTH", "True")
+            .with_env("OKTA_AUDIENCE", static.OKTA_AUDIENCE)
             .with_env("OKTA_CLIENT_ID", "client-id")
             .with_env("OKTA_CLIENT_SECRET", "client-secret")
             .with_env("OKTA_DOMAIN", f"{mockserver_url}/okta")
+            .with_env("OKTA_ISSUER", static.OKTA_ISSUER)
             .with_env("OKTA_LOGIN_REDIRECT", static.FRONT_END_URL)
+            .with_env("OKTA_TOKEN_CACHE_BACKEND", "django")
+            .with_env("OKTA_VERIFICATION_MODE", "jwt")
+            .with_env("REQUEST_TIMING_HEADER", "True")
+            .with_env("USER_CACHE_BACKEND", "django")
             .with_env("USE_HTTPS", False)
-            .with_env(
-                "ENCRYPTION_KEY",
-                "HqvJK8Ur9q_ZFZlnM-1TOKu7sK4HidccP6NnmMdCEVo="
-                )
+            .with_env("ENCRYPTION_KEY", static.ENCRYPTION_KEY)
             .with_network(network)
             .start()
         )
@@ -156,7 +228,9 @@ def tests_helper(request: pytest.FixtureRequest) -> Helper:
             api_url=api_url,
             mockserver_url=mockserver_external_url,
             db_port=db_port,
+            api_container=api_container,
         )
+        helper.enable_query_stats()
         return helper
     except Exception as e:
         logger.error("Error starting containerized system: %s", str(e))
@@ -186,3 +260,39 @@ def tear_down(request: pytest.FixtureRequest, tests_helper: Helper) -> None:
         pass
 
     request.addfinalizer(cleanup)
+
+
+@pytest.fixture(scope="session")
+def django_app(tests_helper: Helper) -> None:
+    """
+    Set up the application in the test process, for the tests calling its
+    code directly instead of through the API (e.g. the async path, which
+    Gunicorn doesn't serve). It uses the database and the MockServer of the
+    containers. The application must be imported inside the tests, once
+    this fixture has set it up.
+    """
+    import django
+
+    environment = {
+        "ACTIVITY_TRACKING_ENABLED": "False",
+        "DB_HOST": "localhost",
+        "DB_NAME": "test",
+        "DB_PASSWORD": "test",
+        "DB_PORT": str(tests_helper.db_port),
+        "DB_USER": "test",
+        "DJANGO_SETTINGS_MODULE": "app.settings",
+        "ENCRYPTION_KEY": static.ENCRYPTION_KEY,
+        "FRONT_END_URL": static.FRONT_END_URL,
+        "MOCK_AUTH": "True",
+        "OKTA_AUDIENCE": static.OKTA_AUDIENCE,
+        "OKTA_CLIENT_ID": "client-id",
+        "OKTA_CLIENT_SECRET": "client-secret",
+        "OKTA_DOMAIN": f"{tests_helper.mockserver_url}/okta",
+        "OKTA_ISSUER": static.OKTA_ISSUER,
+        "USE_HTTPS": "False",
+    }
+    for name, value in environment.items():
+        os.environ.setdefault(name, value)
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+    django.setup()
@@ -0,0 +1,67 @@
+import base64
+import json
+import time
+from typing import Any
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from .. import static
+
+"""Key used to sign the tokens, generated once per test session"""
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+"""ID of the signing key in the JWKS"""
+SIGNING_KEY_ID = "test-signing-key"
+
+
+def b64url_encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).decode().rstrip("=")
+
+
+def int_to_b64url(value: int) -> str:
+    return b64url_encode(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def jwks_factory() -> dict[str, Any]:
+    """Return the JWKS containing the public part of the signing key"""
+    public_numbers = signing_key.public_key().public_numbers()
+    return {
+        "keys": [
+            {
+                "kty": "RSA",
+                "alg": "RS256",
+                "use": "sig",
+                "kid": SIGNING_KEY_ID,
+                "n": int_to_b64url(public_numbers.n),
+                "e": int_to_b64url(public_numbers.e),
+            }
+        ]
+    }
+
+
+def jwt_factory(
+        overrides: dict[str, Any],
+        key: rsa.RSAPrivateKey = signing_key,
+        ) -> str:
+    """Return an access token signed like the ones issued by Okta"""
+    now = int(time.time())
+    claims = {
+        "iss": static.OKTA_ISSUER,
+        "aud": static.OKTA_AUDIENCE,
+        "iat": now,
+        "exp": now + 3600,
+        "email": "fake-user@email.net",
+    }
+    claims.update(overrides)
+    header = {"alg": "RS256", "kid": SIGNING_KEY_ID, "typ": "JWT"}
+    signing_input = ".".join([
+        b64url_encode(json.dumps(header).encode()),
+        b64url_encode(json.dumps(claims).encode()),
+    ])
+    signature = key.sign(
+        signing_input.encode(),
+        padding.PKCS1v15(),
+        hashes.SHA256(),
+    )
+    return f"{signing_input}.{b64url_encode(signature)}"
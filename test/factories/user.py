@@ -13,9 +13,8 @@ def user_factory(overrides: dict[str, Any]) -> dict[str, Any]:
 
     overrides_email = overrides.get("email")
     if overrides_email is not None:
-        lower_email = overrides_email.lower()
-        username = lower_email.split("@")[0]
+        lower_email = overrides_email.strip().lower()
         user["email"] = lower_email
-        user["username"] = username
+        user["username"] = lower_email
 
     return user
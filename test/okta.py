@@ -0,0 +1,117 @@
+"""
+Scenarios of latency and failures of the Okta stand-in (MockServer).
+
+A scenario is a dictionary (or a JSON file) like:
+
+    {
+        "seed": 42,
+        "endpoints": {
+            "userinfo": {
+                "latency": {"distribution": "lognormal", "median": 40,
+                            "sigma": 0.5},
+                "samples": 200,
+                "failures": [
+                    {"status": 401, "times": 1},
+                    {"status": 503, "times": 2},
+                    {"status": 429, "times": 1,
+                     "headers": {"Retry-After": "1"}}
+                ]
+            },
+            "token": {
+                "latency": {"distribution": "uniform", "min": 50, "max": 150}
+            }
+        }
+    }
+
+The failures of an endpoint are served first, in order, each of them the
+given number of times. The next "samples" responses succeed with a delay
+drawn from the latency distribution, and later responses succeed with the
+median delay. Delays are drawn from a generator seeded with "seed", so a
+scenario always produces the same sequence of responses.
+
+Latency distributions, in milliseconds:
+- fixed: "value"
+- uniform: "min" and "max"
+- normal: "mean" and "stddev" (negative delays are served as 0)
+- lognormal: "median" and "sigma", for the long tail of real networks
+"""
+import json
+import math
+import random
+from typing import Any, Tuple
+
+"""Path and method of each endpoint of the Okta stand-in"""
+OKTA_ENDPOINTS: dict[str, Tuple[str, str]] = {
+    "keys": ("/okta/keys", "GET"),
+    "token": ("/okta/oauth/token", "POST"),
+    "userinfo": ("/okta/userinfo", "GET"),
+}
+
+"""Number of responses with a sampled delay, if not set in the scenario"""
+DEFAULT_SAMPLES = 100
+
+"""Body of the failed responses, if not set in the scenario"""
+FAILURE_BODIES = {
+    401: {"error": "invalid_token"},
+    429: {"error": "too_many_requests"},
+}
+
+
+def load_scenario(path: str) -> dict[str, Any]:
+    """
+    :param path: The path of a scenario in JSON
+
+    :return: The scenario
+    """
+    with open(path) as file:
+        scenario: dict[str, Any] = json.load(file)
+    return scenario
+
+
+def sample_delays(
+        latency: dict[str, Any],
+        count: int,
+        rng: random.Random,
+        ) -> list[int]:
+    """
+    Draw delays from a latency distribution
+
+    :param latency: The distribution and its parameters
+    :param count: The number of delays
+    :param rng: The random generator
+
+    :return: The delays, in milliseconds
+    """
+    distribution = latency["distribution"]
+    delays: list[float]
+    if distribution == "fixed":
+        delays = [latency["value"]] * count
+    elif distribution == "uniform":
+        delays = [
+            rng.uniform(latency["min"], latency["max"]) for _ in range(count)
+        ]
+    elif distribution == "normal":
+        delays = [
+            rng.gauss(latency["mean"], latency["stddev"])
+            for _ in range(count)
+        ]
+    elif distribution == "lognormal":
+        # The median of a log-normal distribution is e^mu
+        mu = math.log(latency["median"])
+        delays = [
+            rng.lognormvariate(mu, latency["sigma"]) for _ in range(count)
+        ]
+    else:
+        raise ValueError(f"Unknown latency distribution: {distribution}")
+    return [max(0, round(delay)) for delay in delays]
+
+
+def get_failure_body(failure: dict[str, Any]) -> Any:
+    """
+    :param failure: A failure of a scenario
+
+    :return: The body of the failed response
+    """
+    if "body" in failure:
+        return failure["body"]
+    return FAILURE_BODIES.get(failure["status"], {"error": "server_error"})
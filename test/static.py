@@ -1 +1,4 @@
+ENCRYPTION_KEY = "HqvJK8Ur9q_ZFZlnM-1TOKu7sK4HidccP6NnmMdCEVo="
 FRONT_END_URL = "http://fake-front-end.net"
+OKTA_AUDIENCE = "api://test"
+OKTA_ISSUER = "https://fake-okta.net/oauth2/test"
@@ -0,0 +1,139 @@
+import asyncio
+import uuid
+from typing import Any, Optional
+
+import pytest
+
+from .factories.token import jwt_factory
+from .factories.user import user_factory
+from .utils import Helper
+
+
+def authenticate_async(
+        headers: Optional[dict[str, str]] = None,
+        cookies: Optional[dict[str, str]] = None,
+        ) -> Any:
+    """
+    Authenticate a request the way it's done under ASGI, i.e. awaiting
+    request.auser(), in the test process
+
+    :param headers: The headers of the request
+    :param cookies: The cookies of the request
+
+    :return: The request, and its user
+    """
+    from django.http import HttpResponse
+    from django.test import AsyncRequestFactory
+
+    from core.auth import CustomAuthMiddleware
+
+    factory = AsyncRequestFactory()
+    for name, value in (cookies or {}).items():
+        factory.cookies[name] = value
+    request = factory.get("/users/me", headers=headers)
+    middleware = CustomAuthMiddleware(lambda request: HttpResponse())
+    middleware.process_request(request)
+
+    async def get_user() -> Any:
+        return await request.auser()
+
+    return request, asyncio.run(get_user())
+
+
+@pytest.mark.usefixtures("django_app")
+def test_bearer_token_is_verified_in_async_mode(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that a request handled in async mode is authenticated by calling
+    the userinfo endpoint with the async client.
+    """
+    email = "async.bearer@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    _, user = authenticate_async(
+        headers={"Authorization": f"Bearer opaque-{uuid.uuid4()}"}
+        )
+    assert user.email == email
+    assert tests_helper.count_requests("/okta/userinfo") == 1
+
+
+@pytest.mark.usefixtures("django_app")
+def test_rejected_token_is_refreshed_in_async_mode(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that when Okta rejects the access token of a request handled in
+    async mode, the tokens are refreshed and must be sent back in the
+    cookie.
+    """
+    from django.conf import settings
+
+    from core import cookie
+    from core.auth import get_request_credentials
+
+    email = "async.refresh@email.net"
+    refreshed_access_token = f"refreshed-{uuid.uuid4()}"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_okta_failures("userinfo", 401, times=1)
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": refreshed_access_token,
+    })
+    credentials_cookie = cookie.encode(
+        f"expired-{uuid.uuid4()}", f"refresh-{uuid.uuid4()}"
+        )
+    request, user = authenticate_async(cookies={
+        settings.AUTH_COOKIE_CONFIG["NAME"]: credentials_cookie,
+    })
+    assert user.email == email
+    credentials = get_request_credentials(request)
+    assert credentials is not None
+    assert credentials.changed
+    assert credentials.access_token == refreshed_access_token
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+@pytest.mark.usefixtures("django_app")
+def test_unavailable_jwks_is_not_fetched_in_the_event_loop(
+        tests_helper: Helper,
+        monkeypatch: pytest.MonkeyPatch,
+        ) -> None:
+    """
+    Test that when the JWKS can't be fetched in async mode, the request
+    falls back to the userinfo endpoint without fetching the JWKS again
+    from the event loop.
+    """
+    from django.conf import settings
+    from django.test import override_settings
+
+    from core import jwt
+
+    email = "async.jwks.down@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_response(
+        request_path="/okta/keys",
+        response_body={"error": "server_error"},
+        response_status=503,
+    )
+    okta = {
+        **settings.OKTA,
+        "VERIFICATION_MODE": "jwt",
+        "JWT": {
+            **settings.OKTA["JWT"],
+            "JWKS_URL": f"{tests_helper.mockserver_url}/okta/keys",
+            # Don't wait between fetches, so any second fetch is seen
+            "JWKS_REFRESH_INTERVAL": 0,
+        },
+    }
+    access_token = jwt_factory({"email": email})
+    monkeypatch.setattr(jwt, "_jwks_client", None)
+    with override_settings(OKTA=okta):
+        _, user = authenticate_async(
+            headers={"Authorization": f"Bearer {access_token}"}
+            )
+    assert user.email == email
+    calls_per_fetch = settings.OKTA["HTTP"]["MAX_RETRIES"] + 1
+    assert tests_helper.count_requests("/okta/keys") == calls_per_fetch
+    assert tests_helper.count_requests("/okta/userinfo") == 1
@@ -0,0 +1,113 @@
+import uuid
+from typing import Any
+
+import pytest
+from cryptography.fernet import Fernet
+
+from . import static
+
+"""Key replacing static.ENCRYPTION_KEY in the key rotation tests"""
+NEW_ENCRYPTION_KEY = Fernet.generate_key().decode()
+
+
+def cookie_settings(**overrides: Any) -> Any:
+    """
+    Override the format of the credentials cookie
+
+    :param overrides: The entries of AUTH_COOKIE_CONFIG to override
+
+    :return: The settings override
+    """
+    from django.conf import settings
+    from django.test import override_settings
+
+    return override_settings(
+        AUTH_COOKIE_CONFIG={**settings.AUTH_COOKIE_CONFIG, **overrides}
+        )
+
+
+@pytest.mark.usefixtures("django_app")
+@pytest.mark.parametrize("cipher", ["aesgcm", "chacha20", "fernet"])
+def test_compact_cookie_round_trip(cipher: str) -> None:
+    """
+    Test that the tokens are decoded from a compact cookie.
+    """
+    from core import cookie
+
+    access_token = f"access-{uuid.uuid4()}"
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    with cookie_settings(FORMAT="compact", CIPHER=cipher):
+        value = cookie.encode(access_token, refresh_token)
+        assert cookie.decode(value) == (access_token, refresh_token)
+        assert cookie.is_current(value)
+
+
+@pytest.mark.usefixtures("django_app")
+@pytest.mark.parametrize("cipher", ["aesgcm", "chacha20", "fernet"])
+def test_compact_cookie_with_old_key_is_accepted(cipher: str) -> None:
+    """
+    Test that a compact cookie encrypted with a key being rotated out is
+    still accepted, but must be issued again.
+    """
+    from django.test import override_settings
+
+    from core import cookie
+
+    access_token = f"access-{uuid.uuid4()}"
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    with cookie_settings(FORMAT="compact", CIPHER=cipher):
+        with override_settings(ENCRYPTION_KEYS=[static.ENCRYPTION_KEY]):
+            value = cookie.encode(access_token, refresh_token)
+        with override_settings(
+                ENCRYPTION_KEYS=[NEW_ENCRYPTION_KEY, static.ENCRYPTION_KEY]
+                ):
+            assert cookie.decode(value) == (access_token, refresh_token)
+            assert not cookie.is_current(value)
+
+
+@pytest.mark.usefixtures("django_app")
+@pytest.mark.parametrize("cipher", ["aesgcm", "chacha20", "fernet"])
+def test_compact_cookie_with_removed_key_is_rejected(cipher: str) -> None:
+    """
+    Test that a compact cookie encrypted with a key that was removed is
+    rejected as an invalid cookie.
+    """
+    from django.test import override_settings
+
+    from core import cookie
+    from core.auth import get_failure_reason
+
+    with cookie_settings(FORMAT="compact", CIPHER=cipher):
+        with override_settings(ENCRYPTION_KEYS=[static.ENCRYPTION_KEY]):
+            value = cookie.encode(
+                f"access-{uuid.uuid4()}", f"refresh-{uuid.uuid4()}"
+                )
+        with override_settings(ENCRYPTION_KEYS=[NEW_ENCRYPTION_KEY]):
+            with pytest.raises(cookie.InvalidCookieError) as error:
+                cookie.decode(value)
+    assert get_failure_reason(error.value) == "invalid_cookie"
+
+
+@pytest.mark.usefixtures("django_app")
+def test_legacy_cookie_with_old_key_is_accepted() -> None:
+    """
+    Test that a cookie in the legacy JSON format, encrypted with a key being
+    rotated out, is still accepted, and rejected once the key is removed.
+    """
+    from django.test import override_settings
+
+    from core import cookie
+
+    access_token = f"access-{uuid.uuid4()}"
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    with cookie_settings(FORMAT="json"):
+        with override_settings(ENCRYPTION_KEYS=[static.ENCRYPTION_KEY]):
+            value = cookie.encode(access_token, refresh_token)
+        with override_settings(
+                ENCRYPTION_KEYS=[NEW_ENCRYPTION_KEY, static.ENCRYPTION_KEY]
+                ):
+            assert cookie.decode(value) == (access_token, refresh_token)
+            assert not cookie.is_current(value)
+        with override_settings(ENCRYPTION_KEYS=[NEW_ENCRYPTION_KEY]):
+            with pytest.raises(cookie.InvalidCookieError):
+                cookie.decode(value)
@@ -0,0 +1,31 @@
+import shlex
+
+from .utils import Helper
+from .factories.user import user_factory
+
+
+def test_app_queries_the_database_through_the_pool(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the application starts with DB_POOL enabled, and runs its
+    queries on connections of the psycopg pool.
+    """
+    user = user_factory({
+        "email": "pooled@email.net",
+        "first_name": "Pooled",
+    })
+    tests_helper.insert_user(user)
+    script = (
+        "from django.db import connections\n"
+        "from core.models import User\n"
+        f"print(User.objects.get(email={user['email']!r}).first_name)\n"
+        "pools = [connections[alias].pool for alias in connections]\n"
+        "print(all(pool is not None for pool in pools))\n"
+    )
+    exit_code, output = tests_helper.run_command(
+        f"shell -c {shlex.quote(script)}",
+        environment={"DB_POOL": "True"},
+        )
+    assert exit_code == 0, output
+    assert output.splitlines()[-2:] == [user["first_name"], "True"]
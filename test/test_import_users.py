@@ -0,0 +1,67 @@
+import json
+
+from .utils import Helper
+from .factories.user import user_factory
+
+
+def test_import_users_from_csv(tests_helper: Helper) -> None:
+    """
+    Test that the import command creates the users of a CSV file, skipping
+    the existing users, the duplicates and the invalid rows.
+    """
+    existing_user = user_factory({
+        "email": "existing@email.net",
+        "first_name": "Existing",
+    })
+    tests_helper.insert_user(existing_user)
+    csv = (
+        "email,first_name,last_name,is_active\n"
+        " First@Email.net ,First,User,true\n"
+        "first@email.net,Duplicate,User,true\n"
+        "second@email.net,Second,User,false\n"
+        "existing@email.net,Updated,User,true\n"
+        "invalid-email,Invalid,User,true\n"
+    )
+    exit_code, output = tests_helper.run_command(
+        "import_users - --format csv --batch-size 2", stdin=csv
+        )
+    assert exit_code == 0, output
+    assert "2 users created from 4 rows" in output
+    assert "1 invalid rows skipped" in output
+
+    first_user = tests_helper.find_user_by_email("first@email.net")
+    assert first_user is not None
+    assert first_user["username"] == "first@email.net"
+    assert first_user["first_name"] == "First"
+    second_user = tests_helper.find_user_by_email("second@email.net")
+    assert second_user is not None
+    existing = tests_helper.find_user_by_email("existing@email.net")
+    assert existing is not None
+    assert existing["first_name"] == "Existing"
+
+
+def test_import_users_with_update(tests_helper: Helper) -> None:
+    """
+    Test that the import command updates the existing users with --update.
+    """
+    existing_user = user_factory({
+        "email": "existing@email.net",
+        "first_name": "Existing",
+    })
+    tests_helper.insert_user(existing_user)
+    jsonl = "\n".join([
+        json.dumps({"email": "Existing@Email.net", "first_name": "Updated"}),
+        json.dumps({"email": "new@email.net", "first_name": "New"}),
+    ])
+    exit_code, output = tests_helper.run_command(
+        "import_users - --format jsonl --update", stdin=jsonl
+        )
+    assert exit_code == 0, output
+    assert "2 users created or updated from 2 rows" in output
+
+    existing = tests_helper.find_user_by_email("existing@email.net")
+    assert existing is not None
+    assert existing["first_name"] == "Updated"
+    new_user = tests_helper.find_user_by_email("new@email.net")
+    assert new_user is not None
+    assert new_user["first_name"] == "New"
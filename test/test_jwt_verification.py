@@ -0,0 +1,104 @@
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from .factories.token import jwks_factory, jwt_factory
+from .factories.user import user_factory
+from .utils import Helper
+
+
+def test_valid_token_is_verified_locally(tests_helper: Helper) -> None:
+    """
+    Test that a valid JWT is verified against the JWKS without calling the
+    userinfo endpoint.
+    """
+    path = "/users/me"
+    email = "jwt.user@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_keys_response(jwks_factory())
+    access_token = jwt_factory({"email": email})
+    response = tests_helper.get_request(path, access_token=access_token)
+    assert response.status_code == 200
+    assert response.json()["user"]["email"] == email
+    assert tests_helper.count_requests("/okta/userinfo") == 0
+
+
+def test_wrong_audience_falls_back_to_userinfo(tests_helper: Helper) -> None:
+    """
+    Test that a JWT that can't be verified locally is verified by calling
+    the userinfo endpoint.
+    """
+    path = "/users/me"
+    email = "jwt.other.audience@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_keys_response(jwks_factory())
+    access_token = jwt_factory({"email": email, "aud": "api://other"})
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": email},
+        access_token=access_token,
+    )
+    response = tests_helper.get_request(path, access_token=access_token)
+    assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 1
+
+
+def test_missing_email_falls_back_to_userinfo(tests_helper: Helper) -> None:
+    """
+    Test that a valid JWT without the email claim is verified by calling
+    the userinfo endpoint.
+    """
+    path = "/users/me"
+    email = "jwt.without.email@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_keys_response(jwks_factory())
+    access_token = jwt_factory({"email": None})
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": email},
+        access_token=access_token,
+    )
+    response = tests_helper.get_request(path, access_token=access_token)
+    assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 1
+
+
+def test_forged_token_is_rejected(tests_helper: Helper) -> None:
+    """
+    Test that a JWT signed with a key that is not in the JWKS is not
+    accepted.
+    """
+    path = "/users/me"
+    email = "jwt.forged@email.net"
+    tests_helper.insert_user(user_factory({"email": email}))
+    tests_helper.mock_okta_keys_response(jwks_factory())
+    forged_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    access_token = jwt_factory({"email": email}, key=forged_key)
+    response = tests_helper.get_request(path, access_token=access_token)
+    assert response.status_code == 401
+
+
+@pytest.mark.usefixtures("django_app")
+def test_unavailable_jwks_is_fetched_once_per_interval(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that while the JWKS can't be fetched, it's not fetched again by
+    every verification, but once the refresh interval is over.
+    """
+    from django.conf import settings
+
+    from core.jwt import InvalidTokenError, JWKSClient
+
+    # A fetch makes the first call and its retries
+    calls_per_fetch = settings.OKTA["HTTP"]["MAX_RETRIES"] + 1
+    tests_helper.mock_okta_keys_response(jwks_factory())
+    tests_helper.mock_okta_failures("keys", 503, times=calls_per_fetch)
+    jwks = JWKSClient(
+        f"{tests_helper.mockserver_url}/okta/keys", refresh_interval=60
+        )
+    for _ in range(3):
+        with pytest.raises(InvalidTokenError):
+            jwks.load()
+    assert tests_helper.count_requests("/okta/keys") == calls_per_fetch
+
+    jwks.refresh_interval = 0
+    assert list(jwks.load()) == [jwks_factory()["keys"][0]["kid"]]
+    assert tests_helper.count_requests("/okta/keys") == calls_per_fetch + 1
@@ -0,0 +1,38 @@
+import copy
+import io
+import json
+import logging
+from logging.handlers import QueueHandler
+from typing import Any
+
+import pytest
+
+
+@pytest.mark.usefixtures("django_app")
+def test_logs_are_written_from_a_background_thread() -> None:
+    """
+    Test that with the LOGGING setting, the records are formatted as JSON
+    and written to the stream by the listener of the queue handler.
+    """
+    from django.conf import settings
+
+    from core.log import configure_logging, stop_listeners
+
+    output = io.StringIO()
+    config: dict[str, Any] = copy.deepcopy(settings.LOGGING)
+    config["handlers"]["stream"]["stream"] = output
+    try:
+        configure_logging(config)
+        assert isinstance(logging.getHandlerByName("console"), QueueHandler)
+        logging.getLogger("test.log").warning(
+            "Logged %s", "asynchronously", extra={"reason": "test"}
+            )
+        # Stopping the listener writes the records left in the queue
+        stop_listeners()
+        record = json.loads(output.getvalue())
+        assert record["level"] == "WARNING"
+        assert record["logger"] == "test.log"
+        assert record["message"] == "Logged asynchronously"
+        assert record["reason"] == "test"
+    finally:
+        configure_logging(copy.deepcopy(settings.LOGGING))
@@ -1,3 +1,6 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 from .utils import Helper
 from . import static
 import json
@@ -15,6 +18,29 @@ def test_missing_code(tests_helper: Helper) -> None:
     assert response.headers['Location'] == f"{static.FRONT_END_URL}/error"
 
 
+def test_credentials_are_not_verified(tests_helper: Helper) -> None:
+    """
+    Test that the credentials sent to the login endpoint, which never reads
+    the user of the request, are neither decoded nor verified, and that the
+    user isn't looked up.
+    """
+    path = "/users/login-callback"
+    tests_helper.reset_query_stats()
+    response = tests_helper.get_request(
+        path,
+        access_token=f"opaque-{uuid.uuid4()}",
+    )
+    assert response.status_code == 302
+    spans = {
+        metric.split(";")[0].strip()
+        for metric in response.headers["Server-Timing"].split(",")
+    }
+    assert "auth" not in spans
+    assert "cookie_decode" not in spans
+    assert tests_helper.count_queries("core_user", "SELECT") == 0
+    assert tests_helper.count_requests("/okta/userinfo") == 0
+
+
 def test_error_from_okta(tests_helper: Helper) -> None:
     """
     Test that the login endpoint returns 302 to the error page if Okta
@@ -83,3 +109,64 @@ def test_user_exists(tests_helper: Helper) -> None:
     response = tests_helper.get_request(path)
     assert response.status_code == 302
     assert response.headers['Location'] == f"{static.FRONT_END_URL}/profiles"
+
+
+def test_concurrent_first_logins(tests_helper: Helper) -> None:
+    """
+    Test that concurrent first logins of the same user all succeed and
+    create a single user.
+    """
+    user_email = "concurrent.user@email.net"
+    path = "/users/login-callback?code=123"
+    access_token = json.dumps({
+        "sub": user_email
+    })
+    tests_helper.mock_okta_token_response(
+        response_body={
+            "access_token": access_token,
+        },
+        response_status=200,
+    )
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(
+            lambda _: tests_helper.get_request(path), range(8)
+        ))
+    for response in responses:
+        assert response.status_code == 302
+        assert (
+            response.headers['Location']
+            == f"{static.FRONT_END_URL}/profiles"
+        )
+    result = tests_helper.query_db(
+        "SELECT COUNT(*) FROM core_user WHERE email = %s",
+        (user_email,),
+    )
+    assert result is not None
+    assert result[0][0] == 1
+
+
+def test_first_login_with_existing_local_part(tests_helper: Helper) -> None:
+    """
+    Test that the first login of a user creates a new user even if another
+    user has the same local part on a different domain.
+    """
+    existing_email = "shared.local@first.net"
+    user_email = "shared.local@second.net"
+    tests_helper.insert_user(user_factory({
+        "email": existing_email,
+    }))
+    path = "/users/login-callback?code=123"
+    access_token = json.dumps({
+        "sub": user_email
+    })
+    tests_helper.mock_okta_token_response(
+        response_body={
+            "access_token": access_token,
+        },
+        response_status=200,
+    )
+    response = tests_helper.get_request(path)
+    assert response.status_code == 302
+    assert response.headers['Location'] == f"{static.FRONT_END_URL}/profiles"
+    assert tests_helper.find_user_by_email(existing_email) is not None
+    assert tests_helper.find_user_by_email(user_email) is not None
@@ -0,0 +1,57 @@
+from .utils import Helper
+from .factories.user import user_factory
+
+
+def get_sample(tests_helper: Helper, sample: str) -> float:
+    """
+    Get the value of a sample from the metrics endpoint
+
+    :param tests_helper: The helper
+    :param sample: The name and labels of the sample, as exposed
+
+    :return: The value, or 0 if the sample is not exposed yet
+    """
+    response = tests_helper.get_request("/metrics")
+    assert response.status_code == 200
+    for line in response.text.splitlines():
+        if line.startswith(f"{sample} "):
+            return float(line.split(" ")[-1])
+    return 0
+
+
+def test_metrics_aggregate_workers(tests_helper: Helper) -> None:
+    """
+    Test that the metrics endpoint counts the requests served by every
+    worker process, whichever worker serves the scrape.
+    """
+    email = "metrics@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    sample = (
+        'http_request_duration_seconds_count'
+        '{method="GET",status="200",view="me"}'
+    )
+    count_before = get_sample(tests_helper, sample)
+    for _ in range(10):
+        response = tests_helper.get_request(
+            "/users/me",
+            authenticated_as=email,
+        )
+        assert response.status_code == 200
+    assert get_sample(tests_helper, sample) == count_before + 10
+
+
+def test_metrics_auth_failures(tests_helper: Helper) -> None:
+    """
+    Test that the metrics endpoint counts the authentication failures by
+    reason.
+    """
+    sample = 'auth_failures_total{reason="unknown_user"}'
+    count_before = get_sample(tests_helper, sample)
+    response = tests_helper.get_request(
+        "/users/me",
+        authenticated_as="unknown.metrics@email.net",
+    )
+    assert response.status_code == 401
+    assert get_sample(tests_helper, sample) == count_before + 1
@@ -0,0 +1,203 @@
+import json
+import time
+import uuid
+
+from cryptography.fernet import Fernet
+
+from . import static
+from .utils import Helper
+from .factories.user import user_factory
+
+
+def credentials_cookie(access_token: str, refresh_token: str) -> str:
+    """
+    :param access_token: The access token
+    :param refresh_token: The refresh token
+
+    :return: A credentials cookie with the tokens, in the original format
+    """
+    return Fernet(static.ENCRYPTION_KEY).encrypt(json.dumps({
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+    }).encode()).decode()
+
+
+def test_userinfo_server_errors_are_retried(tests_helper: Helper) -> None:
+    """
+    Test that the calls to the userinfo endpoint are retried when Okta
+    fails with a 5xx error.
+    """
+    path = "/users/me"
+    email = "userinfo.retried@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_okta_failures("userinfo", 503, times=2)
+    response = tests_helper.get_request(
+        path, access_token=f"opaque-{uuid.uuid4()}"
+        )
+    assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 3
+
+
+def test_userinfo_rate_limit_is_retried_after_delay(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that a call to the userinfo endpoint rate limited by Okta is
+    retried after the delay given in the Retry-After header.
+    """
+    path = "/users/me"
+    email = "userinfo.rate.limited@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_okta_failures(
+        "userinfo", 429, times=1, response_headers={"Retry-After": "1"}
+        )
+    started_at = time.monotonic()
+    response = tests_helper.get_request(
+        path, access_token=f"opaque-{uuid.uuid4()}"
+        )
+    assert response.status_code == 200
+    assert time.monotonic() - started_at >= 1
+    assert tests_helper.count_requests("/okta/userinfo") == 2
+
+
+def test_long_retry_after_is_capped(tests_helper: Helper) -> None:
+    """
+    Test that a call to the userinfo endpoint rate limited with a long
+    Retry-After is retried after at most OKTA_HTTP_MAX_RETRY_AFTER seconds,
+    instead of holding the worker for the whole delay.
+    """
+    path = "/users/me"
+    email = "userinfo.long.retry.after@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_okta_failures(
+        "userinfo", 429, times=1, response_headers={"Retry-After": "3600"}
+        )
+    started_at = time.monotonic()
+    response = tests_helper.get_request(
+        path, access_token=f"opaque-{uuid.uuid4()}"
+        )
+    assert response.status_code == 200
+    assert time.monotonic() - started_at < 10
+    assert tests_helper.count_requests("/okta/userinfo") == 2
+
+
+def test_rejected_token_is_refreshed(tests_helper: Helper) -> None:
+    """
+    Test that when Okta rejects the access token, the tokens are refreshed
+    and sent back in the cookie.
+    """
+    path = "/users/me"
+    email = "rejected.token@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_userinfo_response(response_body={"email": email})
+    tests_helper.mock_okta_failures("userinfo", 401, times=1)
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": f"refreshed-{uuid.uuid4()}",
+        "refresh_token": f"rotated-{uuid.uuid4()}",
+    })
+    response = tests_helper.get_request(
+        path,
+        cookies={"credentials": credentials_cookie(
+            f"expired-{uuid.uuid4()}", f"refresh-{uuid.uuid4()}"
+        )},
+    )
+    assert response.status_code == 200
+    assert response.cookies.get("credentials") is not None
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+    assert tests_helper.count_requests("/okta/userinfo") == 2
+
+
+def test_failed_refresh_is_not_retried(tests_helper: Helper) -> None:
+    """
+    Test that a refresh that fails with a 5xx error is not retried, since
+    rotating refresh tokens can only be used once.
+    """
+    path = "/users/me"
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"error": "invalid_token"},
+        response_status=401,
+    )
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": f"refreshed-{uuid.uuid4()}",
+    })
+    tests_helper.mock_okta_failures("token", 503, times=1)
+    response = tests_helper.get_request(
+        path,
+        cookies={"credentials": credentials_cookie(
+            f"expired-{uuid.uuid4()}", f"refresh-{uuid.uuid4()}"
+        )},
+    )
+    assert response.status_code == 401
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+def test_rate_limited_login_is_not_retried(tests_helper: Helper) -> None:
+    """
+    Test that the login callback fails without retrying when the token
+    endpoint is rate limited, since authorization codes can only be used
+    once.
+    """
+    path = "/users/login-callback?code=123"
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": json.dumps({"sub": "rate.limited@email.net"}),
+    })
+    tests_helper.mock_okta_failures("token", 429, times=1)
+    response = tests_helper.get_request(path)
+    assert response.status_code == 302
+    assert response.headers["Location"] == f"{static.FRONT_END_URL}/error"
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+def test_scenario_failures_are_served_in_order(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the failures of a scenario are served first, and then the
+    responses with sampled delays.
+    """
+    path = "/users/me"
+    email = "scenario.user@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_scenario(
+        {
+            "seed": 1,
+            "endpoints": {
+                "userinfo": {
+                    "latency": {"distribution": "fixed", "value": 10},
+                    "samples": 5,
+                    "failures": [
+                        {"status": 503, "times": 1},
+                        {
+                            "status": 429,
+                            "times": 1,
+                            "headers": {"Retry-After": "0"},
+                        },
+                    ],
+                },
+            },
+        },
+        response_bodies={"userinfo": {"email": email}},
+    )
+    response = tests_helper.get_request(
+        path, access_token=f"opaque-{uuid.uuid4()}"
+        )
+    assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 3
+    response = tests_helper.get_request(
+        path, access_token=f"opaque-{uuid.uuid4()}"
+        )
+    assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 4
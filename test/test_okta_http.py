@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from .utils import Helper
+
+
+@pytest.mark.usefixtures("django_app")
+def test_slow_call_times_out_after_retries(tests_helper: Helper) -> None:
+    """
+    Test that a call to Okta that doesn't respond within the read timeout
+    is retried, and then fails instead of waiting for the response.
+    """
+    import requests
+    from django.conf import settings
+    from django.test import override_settings
+
+    from core.http import get_session, get_timeout
+
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": "slow.okta@email.net"},
+        delay=5000,
+    )
+    okta = {
+        **settings.OKTA,
+        "HTTP": {**settings.OKTA["HTTP"], "READ_TIMEOUT": 0.5},
+    }
+    url = f"{tests_helper.mockserver_url}/okta/userinfo"
+    started_at = time.monotonic()
+    with override_settings(OKTA=okta):
+        with pytest.raises(requests.ConnectionError):
+            get_session().get(url, timeout=get_timeout())
+    assert time.monotonic() - started_at < 4
+    calls = settings.OKTA["HTTP"]["MAX_RETRIES"] + 1
+    assert tests_helper.count_requests("/okta/userinfo") == calls
+
+
+@pytest.mark.usefixtures("django_app")
+def test_async_call_respects_capped_retry_after(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that a call to Okta from async code that is rate limited is
+    retried after the delay of the Retry-After header, capped to
+    OKTA_HTTP_MAX_RETRY_AFTER seconds, like the calls of the sync session.
+    """
+    from django.conf import settings
+    from django.test import override_settings
+
+    from core.http import arequest
+
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": "async.rate.limited@email.net"}
+        )
+    tests_helper.mock_okta_failures(
+        "userinfo", 429, times=1, response_headers={"Retry-After": "3600"}
+        )
+    okta = {
+        **settings.OKTA,
+        "HTTP": {**settings.OKTA["HTTP"], "MAX_RETRY_AFTER": 1},
+    }
+    url = f"{tests_helper.mockserver_url}/okta/userinfo"
+    started_at = time.monotonic()
+    with override_settings(OKTA=okta):
+        response = asyncio.run(arequest("GET", url))
+    assert response.status_code == 200
+    assert 1 <= time.monotonic() - started_at < 3
+    assert tests_helper.count_requests("/okta/userinfo") == 2
@@ -0,0 +1,38 @@
+from .utils import Helper
+
+
+def test_request_id_is_returned(tests_helper: Helper) -> None:
+    """
+    Test that each response carries a generated request ID, different for
+    each request.
+    """
+    path = "/users/me"
+    first = tests_helper.get_request(path)
+    second = tests_helper.get_request(path)
+    assert len(first.headers["X-Request-ID"]) == 32
+    assert first.headers["X-Request-ID"] != second.headers["X-Request-ID"]
+
+
+def test_received_request_id_is_kept(tests_helper: Helper) -> None:
+    """
+    Test that the request ID sent by a proxy is kept, so the logs can be
+    correlated across services.
+    """
+    path = "/users/me"
+    response = tests_helper.get_request(
+        path, headers={"X-Request-ID": "proxy-request.42"}
+        )
+    assert response.headers["X-Request-ID"] == "proxy-request.42"
+
+
+def test_invalid_request_id_is_replaced(tests_helper: Helper) -> None:
+    """
+    Test that a request ID that could inject content in the logs is
+    replaced by a generated one.
+    """
+    path = "/users/me"
+    response = tests_helper.get_request(
+        path, headers={"X-Request-ID": "a\" \"forged\": \"value"}
+        )
+    assert response.headers["X-Request-ID"] != "a\" \"forged\": \"value"
+    assert len(response.headers["X-Request-ID"]) == 32
@@ -0,0 +1,98 @@
+import contextvars
+from typing import Any, Callable, Optional
+
+import pytest
+
+
+@pytest.fixture
+def replica(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Add a read replica to the databases, pointing to the primary
+    """
+    from django.conf import settings
+
+    monkeypatch.setitem(
+        settings.DATABASES, "replica", settings.DATABASES["default"]
+        )
+
+
+def in_request(handler: Callable[[], Any]) -> Any:
+    """
+    Run a function like a request handled by the worker: in its own context,
+    after the request_started signal
+
+    :param handler: The function to run
+
+    :return: The result of the function
+    """
+    from django.core.signals import request_started
+
+    def handle() -> Any:
+        request_started.send(sender=None)
+        return handler()
+
+    return contextvars.copy_context().run(handle)
+
+
+@pytest.mark.usefixtures("django_app", "replica")
+def test_reads_go_to_the_replica() -> None:
+    """
+    Test that the reads of the core models go to the replica, and the
+    reads of the other apps to the primary.
+    """
+    from django.contrib.auth.models import Group
+
+    from core.models import User
+    from core.routers import ReplicaRouter
+
+    router = ReplicaRouter()
+    assert in_request(lambda: router.db_for_read(User)) == "replica"
+    assert in_request(lambda: router.db_for_read(Group)) == "default"
+
+
+@pytest.mark.usefixtures("django_app", "replica")
+def test_reads_are_pinned_to_the_primary_after_a_write() -> None:
+    """
+    Test that once a request writes, its reads go to the primary until the
+    end of the request.
+    """
+    from core.models import User
+    from core.routers import ReplicaRouter
+
+    router = ReplicaRouter()
+
+    def read_after_write() -> Optional[str]:
+        assert router.db_for_read(User) == "replica"
+        assert router.db_for_write(User) == "default"
+        return router.db_for_read(User)
+
+    assert in_request(read_after_write) == "default"
+    assert in_request(lambda: router.db_for_read(User)) == "replica"
+
+
+@pytest.mark.usefixtures("django_app", "replica")
+def test_pin_does_not_leak_to_concurrent_requests() -> None:
+    """
+    Test that a write pins the reads of its own request only, not those of
+    the requests handled concurrently by the worker.
+    """
+    from core.models import User
+    from core.routers import ReplicaRouter
+
+    router = ReplicaRouter()
+    writing_request = contextvars.copy_context()
+    writing_request.run(router.db_for_write, User)
+    assert in_request(lambda: router.db_for_read(User)) == "replica"
+    assert writing_request.run(router.db_for_read, User) == "default"
+
+
+@pytest.mark.usefixtures("django_app")
+def test_reads_go_to_the_primary_without_replica() -> None:
+    """
+    Test that all the reads go to the primary when no replica is configured.
+    """
+    from core.models import User
+    from core.routers import ReplicaRouter
+
+    router = ReplicaRouter()
+    assert in_request(lambda: router.db_for_read(User)) == "default"
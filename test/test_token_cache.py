@@ -0,0 +1,73 @@
+import shlex
+
+from .factories.user import user_factory
+from .utils import Helper
+
+
+def test_verified_token_is_cached(tests_helper: Helper) -> None:
+    """
+    Test that repeated requests with the same access token only verify it
+    against Okta once.
+    """
+    path = "/users/me"
+    email = "cached.user@email.net"
+    access_token = "cached-user-access-token"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": email},
+        access_token=access_token,
+    )
+    for _ in range(3):
+        response = tests_helper.get_request(path, access_token=access_token)
+        assert response.status_code == 200
+    assert tests_helper.count_requests("/okta/userinfo") == 1
+
+
+def test_verified_token_is_written_to_the_shared_cache(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the verified token is written to the Django cache of the API,
+    where the other worker processes find it.
+    """
+    path = "/users/me"
+    email = "shared.cache.user@email.net"
+    access_token = "shared-cache-user-access-token"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"email": email},
+        access_token=access_token,
+    )
+    response = tests_helper.get_request(path, access_token=access_token)
+    assert response.status_code == 200
+    # Read the entry from another process than the workers
+    exit_code, output = tests_helper.run_command(
+        "shell -c " + shlex.quote(
+            "from core.cache import digest, get_token_cache; "
+            f"print(get_token_cache().get(digest({access_token!r})))"
+        )
+    )
+    assert exit_code == 0
+    assert email in output.splitlines()
+
+
+def test_rejected_token_is_not_cached(tests_helper: Helper) -> None:
+    """
+    Test that tokens rejected by Okta are verified again on the next request.
+    """
+    path = "/users/me"
+    access_token = "rejected-access-token"
+    tests_helper.mock_okta_userinfo_response(
+        response_body={"error": "invalid_token"},
+        response_status=403,
+        access_token=access_token,
+    )
+    for _ in range(2):
+        response = tests_helper.get_request(path, access_token=access_token)
+        assert response.status_code == 401
+    assert tests_helper.count_requests("/okta/userinfo") == 2
@@ -0,0 +1,264 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from cryptography.fernet import Fernet
+
+from .factories.token import jwt_factory
+from .utils import Helper
+
+"""Number of requests refreshing the same refresh token at the same time"""
+CONCURRENT_REFRESHES = 5
+
+
+@pytest.mark.usefixtures("django_app")
+def test_concurrent_refreshes_call_okta_once(tests_helper: Helper) -> None:
+    """
+    Test that concurrent refreshes of the same refresh token in different
+    threads make a single call to Okta and all get its result.
+    """
+    from django.conf import settings
+
+    from core.auth import TokenManager
+    from core.refresh import RefreshCoalescer
+
+    new_access_token = f"access-{uuid.uuid4()}"
+    new_refresh_token = f"refresh-{uuid.uuid4()}"
+    tests_helper.mock_okta_token_response(
+        response_body={
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+        },
+        delay=500,
+    )
+    coalescer = RefreshCoalescer(settings.OKTA["REFRESH"])
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    fetch = TokenManager().get_tokens_from_refresh_token
+    with ThreadPoolExecutor(max_workers=CONCURRENT_REFRESHES) as executor:
+        results = list(executor.map(
+            lambda _: coalescer.refresh(refresh_token, fetch),
+            range(CONCURRENT_REFRESHES),
+            ))
+    assert results == [(new_access_token, new_refresh_token)] * len(results)
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+@pytest.mark.usefixtures("django_app")
+def test_concurrent_async_refreshes_call_okta_once(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that concurrent refreshes of the same refresh token in an event
+    loop make a single call to Okta and all get its result.
+    """
+    from django.conf import settings
+
+    from core.auth import AsyncTokenManager
+    from core.refresh import RefreshCoalescer
+
+    new_access_token = f"access-{uuid.uuid4()}"
+    new_refresh_token = f"refresh-{uuid.uuid4()}"
+    tests_helper.mock_okta_token_response(
+        response_body={
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+        },
+        delay=500,
+    )
+    coalescer = RefreshCoalescer(settings.OKTA["REFRESH"])
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    fetch = AsyncTokenManager().aget_tokens_from_refresh_token
+
+    async def refresh_concurrently() -> list[tuple[str, str]]:
+        return await asyncio.gather(*(
+            coalescer.arefresh(refresh_token, fetch)
+            for _ in range(CONCURRENT_REFRESHES)
+            ))
+
+    results = asyncio.run(refresh_concurrently())
+    assert results == [(new_access_token, new_refresh_token)] * len(results)
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+@pytest.mark.usefixtures("django_app")
+def test_shared_refresh_times_out_without_the_lock(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that a worker waiting for the lock held by another worker gives up
+    once the lock timeout is over, without refreshing the token itself.
+    """
+    from django.conf import settings
+    from django.core.cache import caches
+
+    from core.auth import AsyncTokenManager, TokenManager
+    from core.cache import digest
+    from core.refresh import RefreshCoalescer
+
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": f"access-{uuid.uuid4()}",
+    })
+    config = {**settings.OKTA["REFRESH"], "LOCK_TIMEOUT": 1, "SHARED": True}
+    coalescer = RefreshCoalescer(config)
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    # Another worker is holding the lock, and never publishes its result
+    caches[config["CACHE_ALIAS"]].add(
+        f"okta-refresh-lock:{digest(refresh_token)}", 1, 60
+        )
+    with pytest.raises(TimeoutError):
+        coalescer.refresh(
+            refresh_token, TokenManager().get_tokens_from_refresh_token
+            )
+    with pytest.raises(TimeoutError):
+        asyncio.run(coalescer.arefresh(
+            refresh_token, AsyncTokenManager().aget_tokens_from_refresh_token
+            ))
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 0
+
+
+@pytest.mark.usefixtures("django_app")
+def test_shared_result_with_removed_key_is_a_miss() -> None:
+    """
+    Test that a refresh result encrypted with a key that was removed since
+    is ignored, as if it wasn't in the cache.
+    """
+    from django.conf import settings
+    from django.test import override_settings
+
+    from core.refresh import RefreshCoalescer
+
+    coalescer = RefreshCoalescer(settings.OKTA["REFRESH"])
+    tokens = (f"access-{uuid.uuid4()}", f"refresh-{uuid.uuid4()}")
+    value = coalescer.encode(tokens)
+    assert coalescer.decode(value) == tokens
+    with override_settings(ENCRYPTION_KEYS=[Fernet.generate_key().decode()]):
+        assert coalescer.decode(value) is None
+
+
+def refresh_ahead(
+        config: dict[str, Any],
+        access_token: str,
+        refresh_token: str,
+        ) -> Any:
+    """
+    Refresh the tokens in the background and wait for the refresh
+
+    :param config: The refresh configuration
+    :param access_token: The access token about to expire
+    :param refresh_token: The refresh token
+
+    :return: The coalescer holding the result of the refresh
+    """
+    from core.auth import TokenManager
+    from core.refresh import BackgroundRefresher, RefreshCoalescer
+
+    coalescer = RefreshCoalescer(config)
+    refresher = BackgroundRefresher(coalescer, config)
+    assert refresher.schedule(
+        access_token,
+        refresh_token,
+        TokenManager().get_tokens_from_refresh_token,
+        )
+    refresher.executor.shutdown(wait=True)
+    return coalescer
+
+
+@pytest.mark.usefixtures("django_app")
+def test_ahead_refresh_result_is_given_once_for_the_old_tokens(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the result of a background refresh is only given to a request
+    carrying both the old access token and refresh token, on any worker, and
+    only once.
+    """
+    from django.conf import settings
+
+    from core.refresh import RefreshCoalescer
+
+    new_access_token = f"access-{uuid.uuid4()}"
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": new_access_token,
+    })
+    config = {
+        **settings.OKTA["REFRESH"],
+        "AHEAD_WINDOW": 60,
+        "ROTATION": False,
+        "SHARED": True,
+    }
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    access_token = jwt_factory({
+        "exp": int(time.time()) + 30, "jti": str(uuid.uuid4()),
+    })
+    refresh_ahead(config, access_token, refresh_token)
+    other_worker = RefreshCoalescer(config)
+    other_access_token = jwt_factory({
+        "exp": int(time.time()) + 30, "jti": str(uuid.uuid4()),
+    })
+    assert other_worker.pop_ahead_result(
+        other_access_token, refresh_token
+        ) is None
+    assert other_worker.pop_ahead_result(access_token, refresh_token) == (
+        new_access_token, refresh_token
+        )
+    assert other_worker.pop_ahead_result(access_token, refresh_token) is None
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 1
+
+
+@pytest.mark.usefixtures("django_app")
+def test_ahead_refresh_result_expires_with_the_old_access_token(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the result of a background refresh isn't kept after the old
+    access token has expired and the grace period of refreshes is over.
+    """
+    from django.conf import settings
+
+    tests_helper.mock_okta_token_response(response_body={
+        "access_token": f"access-{uuid.uuid4()}",
+    })
+    config = {
+        **settings.OKTA["REFRESH"],
+        "AHEAD_WINDOW": 1,
+        "RESULT_TTL": 1,
+        "ROTATION": False,
+    }
+    refresh_token = f"refresh-{uuid.uuid4()}"
+    access_token = jwt_factory({"exp": int(time.time()) + 1})
+    coalescer = refresh_ahead(config, access_token, refresh_token)
+    time.sleep(config["AHEAD_WINDOW"] + config["RESULT_TTL"] + 0.5)
+    assert coalescer.pop_ahead_result(access_token, refresh_token) is None
+
+
+@pytest.mark.usefixtures("django_app")
+def test_ahead_refresh_is_disabled_with_rotating_tokens(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that tokens aren't refreshed in the background when refresh tokens
+    rotate, since the refresh would use up the client's refresh token.
+    """
+    from django.conf import settings
+
+    from core.auth import TokenManager
+    from core.refresh import BackgroundRefresher, RefreshCoalescer
+
+    config = {
+        **settings.OKTA["REFRESH"],
+        "AHEAD_WINDOW": 60,
+        "ROTATION": True,
+        "SHARED": True,
+    }
+    refresher = BackgroundRefresher(RefreshCoalescer(config), config)
+    access_token = jwt_factory({"exp": int(time.time()) + 1})
+    assert not refresher.schedule(
+        access_token,
+        f"refresh-{uuid.uuid4()}",
+        TokenManager().get_tokens_from_refresh_token,
+        )
+    refresher.executor.shutdown(wait=True)
+    assert tests_helper.count_requests("/okta/oauth/token", "POST") == 0
@@ -1,3 +1,9 @@
+import json
+import time
+
+from cryptography.fernet import Fernet
+
+from . import static
 from .utils import Helper
 from .factories.user import user_factory
 
@@ -42,3 +48,202 @@ def test_authenticated_as_existent_user(tests_helper: Helper) -> None:
         authenticated_as=email,
     )
     assert response.status_code == 200
+
+
+def test_current_user_query_budget(tests_helper: Helper) -> None:
+    """
+    Test that the current user endpoint queries the user only once: the
+    user loaded by the authentication middleware is not queried again by the
+    view.
+    """
+    path = "/users/me"
+    email = "query.budget@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    tests_helper.reset_query_stats()
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    assert response.json()["user"]["email"] == email
+    assert tests_helper.count_queries("core_user", "SELECT") <= 1
+
+
+def test_current_user_is_cached(tests_helper: Helper) -> None:
+    """
+    Test that once the user is cached, the current user endpoint doesn't
+    query the database.
+    """
+    path = "/users/me"
+    email = "cached.current.user@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    tests_helper.reset_query_stats()
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    assert response.json()["user"]["email"] == email
+    assert tests_helper.count_queries("core_user", "SELECT") == 0
+
+
+def test_unchanged_credentials_are_not_set_as_cookie(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that the credentials cookie is not set again when the tokens didn't
+    change during the request.
+    """
+    path = "/users/me"
+    email = "unchanged.credentials@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    assert "Set-Cookie" not in response.headers
+
+
+def test_credentials_do_not_leak_between_requests(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that requests without authentication data don't get the
+    credentials of previous requests handled by the same workers.
+    """
+    path = "/users/me"
+    email = "previous.request@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    for _ in range(5):
+        response = tests_helper.get_request(path)
+        assert response.status_code == 401
+        assert "Set-Cookie" not in response.headers
+
+
+def test_legacy_cookie_is_accepted_and_reissued(
+        tests_helper: Helper
+        ) -> None:
+    """
+    Test that a credentials cookie in the original format (Fernet-encrypted
+    JSON) is still accepted, and is set again in the compact format.
+    """
+    path = "/users/me"
+    email = "legacy.cookie@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    legacy_cookie = Fernet(static.ENCRYPTION_KEY).encrypt(json.dumps({
+        "access_token": json.dumps({"sub": email}),
+        "refresh_token": "refresh-token",
+    }).encode()).decode()
+    response = tests_helper.get_request(
+        path,
+        cookies={"credentials": legacy_cookie},
+    )
+    assert response.status_code == 200
+    compact_cookie = response.cookies.get("credentials")
+    assert compact_cookie is not None
+    assert len(compact_cookie) < len(legacy_cookie)
+
+    response = tests_helper.get_request(
+        path,
+        cookies={"credentials": compact_cookie},
+    )
+    assert response.status_code == 200
+    assert "Set-Cookie" not in response.headers
+
+
+def test_last_seen_is_recorded(tests_helper: Helper) -> None:
+    """
+    Test that the time an authenticated user was last seen is written to
+    the database in the background.
+    """
+    path = "/users/me"
+    email = "last.seen@email.net"
+    user = user_factory({
+        "email": email,
+    })
+    tests_helper.insert_user(user)
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    query = "SELECT last_seen FROM core_user WHERE email = %s"
+    last_seen = None
+    for _ in range(50):
+        result = tests_helper.query_db(query, (email,))
+        assert result is not None
+        last_seen = result[0][0]
+        if last_seen is not None:
+            break
+        time.sleep(0.1)
+    assert last_seen is not None
+
+
+def test_same_local_part_on_different_domains(tests_helper: Helper) -> None:
+    """
+    Test that users whose emails only differ by the domain are resolved to
+    their own user.
+    """
+    path = "/users/me"
+    emails = ["same.local@first.net", "same.local@second.net"]
+    for email in emails:
+        tests_helper.insert_user(user_factory({
+            "email": email,
+        }))
+    for email in emails:
+        response = tests_helper.get_request(
+            path,
+            authenticated_as=email.upper(),
+        )
+        assert response.status_code == 200
+        assert response.json()["user"]["email"] == email
+
+
+def test_server_timing(tests_helper: Helper) -> None:
+    """
+    Test that the current user endpoint reports the time spent in each
+    stage of the authentication in the Server-Timing header.
+    """
+    path = "/users/me"
+    email = "server.timing@email.net"
+    tests_helper.insert_user(user_factory({
+        "email": email,
+    }))
+    response = tests_helper.get_request(
+        path,
+        authenticated_as=email,
+    )
+    assert response.status_code == 200
+    spans = {
+        metric.split(";")[0].strip(): metric
+        for metric in response.headers["Server-Timing"].split(",")
+    }
+    for name in ["auth", "user_lookup", "total"]:
+        assert name in spans
+        assert ";dur=" in spans[name]
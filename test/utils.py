@@ -1,9 +1,19 @@
 import json
-from typing import Any, Mapping, Optional, Sequence
+import random
+import shlex
+import statistics
+from typing import Any, Mapping, Optional, Sequence, Tuple
 
-import psycopg2
+import psycopg
 import requests
 
+from .okta import (
+    DEFAULT_SAMPLES,
+    OKTA_ENDPOINTS,
+    get_failure_body,
+    sample_delays,
+)
+
 
 class Helper:
     """
@@ -13,13 +23,16 @@ class Helper:
 
     api_url: Optional[str] = None
     mockserver_url: Optional[str] = None
-    db_connection: Optional[psycopg2.extensions.connection] = None
+    db_port: Optional[int] = None
+    db_connection: Optional[psycopg.Connection[Any]] = None
+    api_container: Optional[Any] = None
 
     def __init__(
             self,
             api_url: str,
             mockserver_url: str,
             db_port: int,
+            api_container: Optional[Any] = None,
             ):
         """
         Initialize the Helper class.
@@ -27,11 +40,14 @@ class Helper:
         :param api_url: The URL of the API
         :param mockserver_url: The URL of the MockServer
         :param db_port: The port of the database
+        :param api_container: The testcontainers container running the API
         """
         self.api_url = api_url
         self.mockserver_url = mockserver_url
-        self.db_connection = psycopg2.connect(
-            database="test",
+        self.db_port = db_port
+        self.api_container = api_container
+        self.db_connection = psycopg.connect(
+            dbname="test",
             user="test",
             host="localhost",
             password="test",
@@ -57,6 +73,105 @@ class Helper:
         url = f"{self.mockserver_url}/mockserver/reset"
         requests.put(url)
 
+    def enable_query_stats(self) -> None:
+        """
+        Enable the statistics of the queries run in the database, so tests
+        can count the queries made by the API.
+        """
+        if self.db_connection is None:
+            return None
+
+        cursor = self.db_connection.cursor()
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+        self.db_connection.commit()
+        cursor.close()
+
+    def reset_query_stats(self) -> None:
+        """
+        Reset the statistics of the queries run in the database.
+        """
+        self.query_db("SELECT pg_stat_statements_reset()")
+
+    def count_queries(
+            self,
+            table: str,
+            statement: Optional[str] = None,
+            ) -> int:
+        """
+        Count the queries made by the API on a table since the statistics
+        were last reset. The table name is quoted in the queries made by
+        Django, so the queries made by the Helper are not counted.
+
+        :param table: The name of the table
+        :param statement: Only count the queries of this kind (e.g. SELECT),
+        so that writes made in the background aren't counted
+
+        :return: The number of queries
+        """
+        result = self.query_db(
+            "SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements"
+            " WHERE query LIKE %s AND query ILIKE %s",
+            (f'%"{table}"%', f"{statement or ''}%"),
+        )
+        if not result:
+            return 0
+        return int(result[0][0])
+
+    def run_command(
+            self,
+            command: str,
+            stdin: Optional[str] = None,
+            environment: Optional[Mapping[str, str]] = None,
+            ) -> Tuple[int, str]:
+        """
+        Run a management command in the API container
+
+        :param command: The command and its arguments
+        :param stdin: The input of the command
+        :param environment: The variables to add to the environment of the
+        command, e.g. to override settings
+
+        :return: The exit code and the output of the command
+        """
+        if self.api_container is None:
+            raise ValueError("The API container is not available")
+        shell_command = f"python /app/manage.py {command}"
+        if environment:
+            variables = " ".join(
+                shlex.quote(f"{name}={value}")
+                for name, value in environment.items()
+                )
+            shell_command = f"env {variables} {shell_command}"
+        if stdin is not None:
+            shell_command = f"printf %s {shlex.quote(stdin)} | {shell_command}"
+        exit_code, output = self.api_container.exec(
+            ["sh", "-c", shell_command]
+            )
+        return int(exit_code), output.decode("utf-8")
+
+    def count_requests(
+            self,
+            request_path: str,
+            request_method: str = "GET",
+            ) -> int:
+        """
+        Count the requests received by the MockServer
+
+        :param request_path: The path to match
+        :param request_method: The method to match
+
+        :return: The number of matching requests
+        """
+        url = f"{self.mockserver_url}/mockserver/retrieve"
+        response = requests.put(
+            url,
+            params={"type": "REQUESTS", "format": "JSON"},
+            json={"path": request_path, "method": request_method},
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return len(response.json())
+
     def find_user_by_email(self, email: str) -> Optional[dict[str, Any]]:
         """
         Find a user by email.
@@ -92,26 +207,56 @@ class Helper:
     def get_request(
             self,
             path: str,
-            authenticated_as: Optional[str] = None
+            authenticated_as: Optional[str] = None,
+            access_token: Optional[str] = None,
+            cookies: Optional[dict[str, str]] = None,
+            headers: Optional[dict[str, str]] = None,
             ) -> requests.Response:
         """
         Make a request to the API.
 
         :param path: The path to request
         :param authenticated_as: The email of the user to authenticate as
+        using a mock token
+        :param access_token: The access token to send as a bearer token
+        :param cookies: The cookies to send
+        :param headers: Other headers to send
 
         :return: The response object
         """
         url = f"{self.api_url}{path}"
         headers = {
             "Accept": "application/json",
+            **(headers or {}),
         }
         if authenticated_as is not None:
             access_token = json.dumps({
                 "sub": authenticated_as
             })
+        if access_token is not None:
             headers["Authorization"] = f"Bearer {access_token}"
-        response = requests.get(url, allow_redirects=False, headers=headers)
+        response = requests.get(
+            url, allow_redirects=False, headers=headers, cookies=cookies
+            )
+        return response
+
+    def options_request(
+            self,
+            path: str,
+            headers: Optional[dict[str, str]] = None,
+            ) -> requests.Response:
+        """
+        Make an OPTIONS request to the API (e.g. a CORS preflight).
+
+        :param path: The path to request
+        :param headers: The headers to send
+
+        :return: The response object
+        """
+        url = f"{self.api_url}{path}"
+        response = requests.options(
+            url, allow_redirects=False, headers=headers
+            )
         return response
 
     def insert_user(self, user: dict[str, Any]) -> None:
@@ -152,16 +297,31 @@ class Helper:
         self.db_connection.commit()
         cursor.close()
 
+    def mock_okta_keys_response(self, jwks: dict[str, Any]) -> None:
+        """
+        Mock Okta's JWKS endpoint.
+
+        :param jwks: The key set to return
+        """
+
+        self.mock_response(
+            request_path="/okta/keys",
+            request_method="GET",
+            response_body=jwks,
+        )
+
     def mock_okta_token_response(
             self,
             response_body: Any,
-            response_status: int = 200
+            response_status: int = 200,
+            delay: Optional[int] = None,
             ) -> None:
         """
         Mock Okta's token endpoint.
 
         :param response_body: The response body to return
         :param response_status: The response status code to return
+        :param delay: Milliseconds to wait before responding
         """
 
         self.mock_response(
@@ -169,14 +329,132 @@ class Helper:
             request_method="POST",
             response_body=response_body,
             response_status=response_status,
+            delay=delay,
+        )
+
+    def mock_okta_userinfo_response(
+            self,
+            response_body: Any,
+            response_status: int = 200,
+            access_token: Optional[str] = None,
+            delay: Optional[int] = None,
+            ) -> None:
+        """
+        Mock Okta's userinfo endpoint.
+
+        :param response_body: The response body to return
+        :param response_status: The response status code to return
+        :param access_token: Only match requests with this bearer token
+        :param delay: Milliseconds to wait before responding
+        """
+        request_headers = None
+        if access_token is not None:
+            request_headers = {"Authorization": [f"Bearer {access_token}"]}
+
+        self.mock_response(
+            request_path="/okta/userinfo",
+            request_method="GET",
+            request_headers=request_headers,
+            response_body=response_body,
+            response_status=response_status,
+            delay=delay,
+        )
+
+    def mock_okta_failures(
+            self,
+            endpoint: str,
+            response_status: int,
+            times: int,
+            response_headers: Optional[dict[str, str]] = None,
+            ) -> None:
+        """
+        Make an endpoint of Okta fail the next given number of times, before
+        falling back to its other mocks (e.g. a burst of 401s forcing a
+        refresh, 5xx errors or rate limiting).
+
+        :param endpoint: The endpoint: userinfo, token or keys
+        :param response_status: The status of the failed responses
+        :param times: The number of failed responses
+        :param response_headers: The headers of the failed responses (e.g.
+        Retry-After)
+        """
+        path, method = OKTA_ENDPOINTS[endpoint]
+        self.mock_response(
+            request_path=path,
+            request_method=method,
+            response_body=get_failure_body({"status": response_status}),
+            response_status=response_status,
+            response_headers=response_headers,
+            times=times,
+            priority=1000,
         )
 
+    def mock_okta_scenario(
+            self,
+            scenario: dict[str, Any],
+            response_bodies: dict[str, Any],
+            ) -> None:
+        """
+        Mock the endpoints of Okta following a scenario of latencies and
+        failures (see test/okta.py for the format)
+
+        :param scenario: The scenario
+        :param response_bodies: The body of the successful responses of each
+        endpoint of the scenario
+        """
+        rng = random.Random(scenario.get("seed", 0))
+        expectations = []
+        # Endpoints are sorted so the delays don't depend on the order of
+        # the keys in the scenario
+        for endpoint in sorted(scenario["endpoints"]):
+            config = scenario["endpoints"][endpoint]
+            path, method = OKTA_ENDPOINTS[endpoint]
+            failures = config.get("failures", [])
+            latency = config.get("latency", {"distribution": "fixed",
+                                             "value": 0})
+            delays = sample_delays(
+                latency, config.get("samples", DEFAULT_SAMPLES), rng
+                )
+            # Expectations with higher priorities are matched first: the
+            # failures in order, then the sampled delays, then the fallback
+            for index, failure in enumerate(failures):
+                expectations.append(self.build_expectation(
+                    request_path=path,
+                    request_method=method,
+                    response_body=get_failure_body(failure),
+                    response_status=failure["status"],
+                    response_headers=failure.get("headers"),
+                    times=failure["times"],
+                    priority=len(delays) + len(failures) - index,
+                ))
+            for index, delay in enumerate(delays):
+                expectations.append(self.build_expectation(
+                    request_path=path,
+                    request_method=method,
+                    response_body=response_bodies[endpoint],
+                    delay=delay,
+                    times=1,
+                    priority=len(delays) - index,
+                ))
+            expectations.append(self.build_expectation(
+                request_path=path,
+                request_method=method,
+                response_body=response_bodies[endpoint],
+                delay=round(statistics.median(delays)) if delays else None,
+            ))
+        self.put_expectations(expectations)
+
     def mock_response(
             self,
             request_path: str,
             request_method: str = "GET",
             response_body: Any = {},
             response_status: int = 200,
+            request_headers: Optional[dict[str, list[str]]] = None,
+            delay: Optional[int] = None,
+            response_headers: Optional[dict[str, str]] = None,
+            times: Optional[int] = None,
+            priority: int = 0,
             ) -> None:
         """
         Mock a response from the Mockserver
@@ -185,26 +463,85 @@ class Helper:
         :param request_method: The method to match
         :param response_body: The response body to return
         :param response_status: The response status code
+        :param request_headers: The headers to match
+        :param delay: Milliseconds to wait before responding
+        :param response_headers: The headers to return
+        :param times: The number of times the response is returned
+        (unlimited by default)
+        :param priority: Mocks with higher priorities are matched first
         """
+        self.put_expectations([self.build_expectation(
+            request_path=request_path,
+            request_method=request_method,
+            response_body=response_body,
+            response_status=response_status,
+            request_headers=request_headers,
+            delay=delay,
+            response_headers=response_headers,
+            times=times,
+            priority=priority,
+        )])
 
-        url = f"{self.mockserver_url}/mockserver/expectation"
-        mock = {
-            "httpRequest": {
-                "path": request_path,
-                "method": request_method,
-            },
-            "httpResponse": {
-                "body": response_body,
-                "statusCode": response_status,
-            },
+    def build_expectation(
+            self,
+            request_path: str,
+            request_method: str = "GET",
+            response_body: Any = {},
+            response_status: int = 200,
+            request_headers: Optional[dict[str, list[str]]] = None,
+            delay: Optional[int] = None,
+            response_headers: Optional[dict[str, str]] = None,
+            times: Optional[int] = None,
+            priority: int = 0,
+            ) -> dict[str, Any]:
+        """
+        Build a MockServer expectation (see mock_response for the
+        parameters)
+
+        :return: The expectation
+        """
+        http_request: dict[str, Any] = {
+            "path": request_path,
+            "method": request_method,
         }
+        if request_headers is not None:
+            http_request["headers"] = request_headers
+        http_response: dict[str, Any] = {
+            "body": response_body,
+            "statusCode": response_status,
+        }
+        if delay is not None:
+            http_response["delay"] = {
+                "timeUnit": "MILLISECONDS",
+                "value": delay,
+            }
+        if response_headers is not None:
+            http_response["headers"] = {
+                name: [value] for name, value in response_headers.items()
+            }
+        mock: dict[str, Any] = {
+            "httpRequest": http_request,
+            "httpResponse": http_response,
+            "priority": priority,
+        }
+        if times is not None:
+            mock["times"] = {"remainingTimes": times, "unlimited": False}
+        return mock
+
+    def put_expectations(self, expectations: list[dict[str, Any]]) -> None:
+        """
+        Create expectations in the MockServer
 
-        # Send a PUT request to the MockServer to create the expectation
-        requests.put(
+        :param expectations: The expectations
+        """
+        url = f"{self.mockserver_url}/mockserver/expectation"
+        # Send a PUT request to the MockServer to create the expectations
+        response = requests.put(
             url,
-            json=mock,
+            json=expectations,
             headers={"Content-Type": "application/json"},
         )
+        response.raise_for_status()
 
     def query_db(
             self,
@@ -226,7 +563,7 @@ class Helper:
         result = None
         try:
             result = cursor.fetchall()
-        except psycopg2.ProgrammingError:
+        except psycopg.ProgrammingError:
             pass
         cursor.close()
         return result